@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - On-Disk Power History (Memory-Mapped Daily Files)
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import time
+import datetime
+import json
+import os
+import re
+import numpy
+
+# Standard Library
+from typing import Optional, Any
+
+from nodes import SPAN_history, SPAN_topology
+
+LOGGER = udi_interface.LOGGER
+
+# relative to the NodeServer's working directory; one sub-directory per panel, one file per (UTC) day
+ARCHIVE_DIRECTORY = 'history'
+ARCHIVE_FILE_SUFFIX = '.span'
+ARCHIVE_MAGIC = b'SPANHIST'
+ARCHIVE_VERSION = 1
+
+# defaults for the optional History_Archive_Days / History_Archive_MB custom parameters; 0 days turns the archive off
+ARCHIVE_DEFAULT_DAYS = 0
+ARCHIVE_DEFAULT_MAX_MB = 250
+
+# a day file grows by this many records at a time (~0.5 MB), and is trimmed to what it holds when the day is over
+ARCHIVE_GROW_RECORDS = 2048
+# the mapping is synced to disk after this many appends (and on every grow, rotation and stop)
+ARCHIVE_FLUSH_EVERY = 30
+
+SECONDS_PER_DAY = 86400
+
+# fixed 64 byte header; 'count' is only advanced after the record it covers has been written
+HEADER_DTYPE = numpy.dtype([('magic', 'S8'), ('version', '<u4'), ('columns', '<u4'), ('count', '<u8'), ('dayStart', '<f8'), ('reserved', 'V32')])
+# one record per poll: the timestamp and a float32 per SPAN_history column (panel total, breakers 1-32, circuits)
+RECORD_DTYPE = numpy.dtype([('timestamp', '<f8'), ('values', '<f4', (SPAN_history.HISTORY_COLUMNS,))])
+
+'''
+The UTC midnight (epoch seconds) of the day 'timestamp' falls in.
+'''
+def dayStartOf(timestamp: float) -> float:
+    return float(int(timestamp // SECONDS_PER_DAY) * SECONDS_PER_DAY)
+
+def dayFileName(dayStart: float) -> str:
+    return datetime.datetime.fromtimestamp(dayStart, datetime.timezone.utc).strftime('%Y-%m-%d') + ARCHIVE_FILE_SUFFIX
+
+'''
+One day of one panel on disk: a HEADER_DTYPE header followed by RECORD_DTYPE records, both used through numpy.memmap,
+so an append writes straight into the mapping and a range read is a slice of it.
+The header's record count is only advanced after the record is written, and records past it (or a tail whose timestamps
+are not increasing, after a power loss) are ignored on open, so a crash loses at most the last few polls, never the file.
+The circuit -> column map of the day is kept next to it ('<day>.span.json').
+'''
+class DayFile(object):
+    def __init__(self, path: str, dayStart: float, writable: bool):
+        self.path = path
+        self.dayStart = dayStart
+        self.writable = writable
+        self._header: Optional[numpy.memmap] = None
+        self.records: Optional[numpy.memmap] = None
+        self.capacity = 0
+        self.count = 0
+        self._open()
+
+    def _open(self):
+        if self.writable and not(os.path.exists(self.path)):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            header = numpy.zeros(1, dtype=HEADER_DTYPE)
+            header['magic'] = ARCHIVE_MAGIC
+            header['version'] = ARCHIVE_VERSION
+            header['columns'] = SPAN_history.HISTORY_COLUMNS
+            header['dayStart'] = self.dayStart
+            with open(self.path, 'wb') as dayFile:
+                dayFile.write(header.tobytes())
+                dayFile.truncate(HEADER_DTYPE.itemsize + ARCHIVE_GROW_RECORDS*RECORD_DTYPE.itemsize)
+                dayFile.flush()
+                os.fsync(dayFile.fileno())
+
+        mode = 'r+' if self.writable else 'r'
+        self._header = numpy.memmap(self.path, dtype=HEADER_DTYPE, mode=mode, offset=0, shape=(1,))
+        if bytes(self._header['magic'][0]) != ARCHIVE_MAGIC or int(self._header['version'][0]) != ARCHIVE_VERSION or int(self._header['columns'][0]) != SPAN_history.HISTORY_COLUMNS:
+            self._header = None
+            raise ValueError("'" + self.path + "' is not a version " + str(ARCHIVE_VERSION) + " SPAN history file")
+        self.capacity = max(0, (os.path.getsize(self.path) - HEADER_DTYPE.itemsize) // RECORD_DTYPE.itemsize)
+        self.records = None
+        if self.capacity > 0:
+            self.records = numpy.memmap(self.path, dtype=RECORD_DTYPE, mode=mode, offset=HEADER_DTYPE.itemsize, shape=(self.capacity,))
+        self.count = self._validCount(min(int(self._header['count'][0]), self.capacity))
+
+    '''
+    How many of the first 'count' records can be trusted: timestamps must be in this day and strictly increasing.
+    '''
+    def _validCount(self, count: int) -> int:
+        if count == 0 or self.records is None:
+            return 0
+        timestamps = self.records['timestamp'][:count]
+        bad = (timestamps < self.dayStart) | (timestamps >= self.dayStart + SECONDS_PER_DAY)
+        bad[1:] |= numpy.diff(timestamps) <= 0
+        badIndexes = numpy.flatnonzero(bad)
+        if len(badIndexes) == 0:
+            return count
+        LOGGER.warning("\n\tHISTORY ARCHIVE '" + self.path + "': keeping the first " + str(int(badIndexes[0])) + " of " + str(count) + " records; the rest were not completely written.\n")
+        return int(badIndexes[0])
+
+    @property
+    def lastTimestamp(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return float(self.records['timestamp'][self.count - 1])
+
+    '''
+    The values row the next append goes to (a view into the mapping), growing the file if it is full.
+    '''
+    def nextRow(self) -> numpy.ndarray:
+        if self.count >= self.capacity:
+            self._resize(self.capacity + ARCHIVE_GROW_RECORDS)
+        return self.records['values'][self.count]
+
+    '''
+    Make the row handed out by nextRow() part of the file.
+    '''
+    def commit(self, timestamp: float):
+        self.records['timestamp'][self.count] = timestamp
+        self.count += 1
+        self._header['count'][0] = self.count
+
+    def flush(self):
+        if self.writable and self.records is not None:
+            self.records.flush()
+            self._header.flush()
+
+    def _resize(self, capacity: int):
+        self.flush()
+        self.records = None
+        self._header = None
+        with open(self.path, 'r+b') as dayFile:
+            dayFile.truncate(HEADER_DTYPE.itemsize + capacity*RECORD_DTYPE.itemsize)
+        self._open()
+
+    '''
+    Sync and, for the day being written, give back the space it did not use.
+    '''
+    def close(self):
+        if self.writable and self._header is not None and self.count < self.capacity:
+            self._resize(max(self.count, 1))
+        self.flush()
+        self.records = None
+        self._header = None
+
+    '''
+    The records from 'startTimestamp' through 'endTimestamp' (None = open-ended), as a view into the mapping.
+    '''
+    def view(self, startTimestamp: Optional[float]=None, endTimestamp: Optional[float]=None) -> numpy.ndarray:
+        if self.records is None or self.count == 0:
+            return numpy.zeros(0, dtype=RECORD_DTYPE)
+        records = self.records[:self.count]
+        timestamps = records['timestamp']
+        first = 0 if startTimestamp is None else int(numpy.searchsorted(timestamps, startTimestamp, side='left'))
+        last = self.count if endTimestamp is None else int(numpy.searchsorted(timestamps, endTimestamp, side='right'))
+        return records[first:last]
+
+    @property
+    def columnsPath(self) -> str:
+        return self.path + '.json'
+
+    def loadCircuitColumns(self) -> dict:
+        try:
+            with open(self.columnsPath, 'r', encoding='utf-8') as columnsFile:
+                return json.load(columnsFile).get('circuits', {})
+        except FileNotFoundError:
+            return {}
+        except:
+            LOGGER.warning("\n\tHISTORY ARCHIVE could not read the circuit columns of '" + self.path + "'.\n")
+            return {}
+
+    def saveCircuitColumns(self, circuitColumns: dict):
+        SPAN_topology.writeJsonAtomically(self.columnsPath, {'version': ARCHIVE_VERSION, 'circuits': circuitColumns})
+
+'''
+The on-disk power history of one panel (ARCHIVE_DIRECTORY/<ip address>/<YYYY-MM-DD>.span), one record per full poll
+with the same columns as SPAN_history. A new file is started at every UTC midnight; files older than 'retentionDays',
+and then the oldest ones while the panel's files take more than 'maxBytes', are deleted at each rotation, on every
+Long Poll and whenever the limits change (see enforceRetention). After a restart, the day in progress is reopened and appended to.
+'''
+class PanelArchive(object):
+    def __init__(self, ipAddress: str, retentionDays: float, maxBytes: int, directory: str=ARCHIVE_DIRECTORY):
+        self.ipAddress = ipAddress
+        self.retentionDays = retentionDays
+        self.maxBytes = maxBytes
+        self.directory = os.path.join(directory, re.sub(r'[^0-9A-Za-z_.-]', '_', ipAddress))
+        self._lock = threading.Lock()
+        self.today: Optional[DayFile] = None
+        self.columns = SPAN_history.SeriesColumns(ipAddress)
+        self._appendsSinceFlush = 0
+        # True once today's file has stopped growing because of 'maxBytes' (reported once per day)
+        self._capReached = False
+        self.appended = 0
+        self.dropped = 0
+        self.failed = 0
+
+    '''
+    Append one poll (a PanelSnapshot with panel data). Returns False if it was not written.
+    '''
+    def record(self, panelSnapshot) -> bool:
+        if not(panelSnapshot.hasPanelData):
+            return False
+        timestamp = panelSnapshot.timestamp
+        with self._lock:
+            try:
+                dayStart = dayStartOf(timestamp)
+                if self.today is None or self.today.dayStart != dayStart:
+                    self._rotate(dayStart)
+                lastTimestamp = self.today.lastTimestamp
+                if lastTimestamp is not None and timestamp <= lastTimestamp:
+                    self.dropped += 1
+                    return False
+                if self.today.count >= self.today.capacity and self._sizeOf(self.today.path) + ARCHIVE_GROW_RECORDS*RECORD_DTYPE.itemsize > self.maxBytes:
+                    # growing today's file would take this panel past History_Archive_MB on its own
+                    self.dropped += 1
+                    if not(self._capReached):
+                        self._capReached = True
+                        LOGGER.warning("\n\tHISTORY ARCHIVE for " + self.ipAddress + ": today's file has reached the " + str(round(self.maxBytes/1048576, 1)) + " MB limit; no more records until the next day.\n")
+                    return False
+
+                SPAN_history.fillRow(panelSnapshot, self.columns, self.today.nextRow())
+                self.today.commit(timestamp)
+                if self.columns.changed:
+                    self.today.saveCircuitColumns(self.columns.circuitColumns)
+                    self.columns.changed = False
+                self.appended += 1
+                self._appendsSinceFlush += 1
+                if self._appendsSinceFlush >= ARCHIVE_FLUSH_EVERY:
+                    self.today.flush()
+                    self._appendsSinceFlush = 0
+                return True
+            except:
+                self.failed += 1
+                LOGGER.warning("\n\tHISTORY ARCHIVE for " + self.ipAddress + " could not write to '" + self.directory + "' (" + str(self.failed) + " failed so far).\n")
+                return False
+
+    def _rotate(self, dayStart: float):
+        if self.today is not None:
+            self.today.close()
+            self.today = None
+        path = os.path.join(self.directory, dayFileName(dayStart))
+        try:
+            self.today = DayFile(path, dayStart, True)
+        except ValueError as e:
+            LOGGER.warning("\n\tHISTORY ARCHIVE: {}; starting it over.\n".format(e))
+            os.remove(path)
+            self.today = DayFile(path, dayStart, True)
+        self.columns = SPAN_history.SeriesColumns(self.ipAddress)
+        self.columns.load(self.today.loadCircuitColumns())
+        self._appendsSinceFlush = 0
+        self._capReached = False
+        self._enforceRetention(dayStart)
+
+    '''
+    (day start, path) of every day file of this panel, oldest first.
+    '''
+    def dayFiles(self) -> list:
+        days = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return days
+        for name in names:
+            if not(name.endswith(ARCHIVE_FILE_SUFFIX)):
+                continue
+            try:
+                day = datetime.datetime.strptime(name[:-len(ARCHIVE_FILE_SUFFIX)], '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+            except ValueError:
+                continue
+            days.append((day.timestamp(), os.path.join(self.directory, name)))
+        return sorted(days)
+
+    '''
+    Apply the current retention now (called when the limits change and on every Long Poll, as well as at each rotation).
+    The day being written is never deleted; it only stops growing once it alone would take more than 'maxBytes'.
+    '''
+    def enforceRetention(self):
+        with self._lock:
+            try:
+                self._enforceRetention(self.today.dayStart if self.today is not None else dayStartOf(time.time()))
+            except OSError:
+                LOGGER.warning("\n\tHISTORY ARCHIVE for " + self.ipAddress + " could not apply its retention in '" + self.directory + "'.\n")
+
+    def _enforceRetention(self, todayStart: float):
+        days = [(dayStart, path) for (dayStart, path) in self.dayFiles() if dayStart != todayStart]
+        oldestKept = todayStart - self.retentionDays*SECONDS_PER_DAY
+        totalBytes = sum(self._sizeOf(path) for (dayStart, path) in days) + self._sizeOf(os.path.join(self.directory, dayFileName(todayStart)))
+        for (dayStart, path) in days:
+            if dayStart >= oldestKept and totalBytes <= self.maxBytes:
+                break
+            totalBytes -= self._sizeOf(path)
+            LOGGER.info("\n\tHISTORY ARCHIVE for " + self.ipAddress + ": deleting '" + path + "' (retention).\n")
+            for stalePath in (path, path + '.json'):
+                try:
+                    os.remove(stalePath)
+                except FileNotFoundError:
+                    pass
+
+    @staticmethod
+    def _sizeOf(path: str) -> int:
+        try:
+            return os.path.getsize(path) + (os.path.getsize(path + '.json') if os.path.exists(path + '.json') else 0)
+        except OSError:
+            return 0
+
+    '''
+    The records from 'startTimestamp' through 'endTimestamp' (None = up to now), as [(day start, records, circuit ID -> column)],
+    one entry per day, oldest first. 'records' are views into the day files' mappings (fields 'timestamp' and 'values';
+    column numbers as in SPAN_history), not copies.
+    '''
+    def query(self, startTimestamp: float, endTimestamp: Optional[float]=None) -> list:
+        results = []
+        with self._lock:
+            if self.today is not None:
+                self.today.flush()
+            for (dayStart, path) in self.dayFiles():
+                if dayStart + SECONDS_PER_DAY <= startTimestamp or (endTimestamp is not None and dayStart > endTimestamp):
+                    continue
+                if self.today is not None and dayStart == self.today.dayStart:
+                    results.append((dayStart, self.today.view(startTimestamp, endTimestamp), dict(self.columns.circuitColumns)))
+                    continue
+                try:
+                    dayFile = DayFile(path, dayStart, False)
+                    results.append((dayStart, dayFile.view(startTimestamp, endTimestamp), dayFile.loadCircuitColumns()))
+                except:
+                    LOGGER.warning("\n\tHISTORY ARCHIVE could not read '" + path + "'; skipping it.\n")
+        return results
+
+    '''
+    (timestamps, Watts) of one circuit between the two timestamps, across days (the one copy made is the concatenation).
+    '''
+    def circuitSeries(self, circuitID: str, startTimestamp: float, endTimestamp: Optional[float]=None) -> tuple:
+        timestamps = []
+        values = []
+        for (dayStart, records, circuitColumns) in self.query(startTimestamp, endTimestamp):
+            column = circuitColumns.get(circuitID)
+            if column is None:
+                continue
+            timestamps.append(records['timestamp'])
+            values.append(records['values'][:, column])
+        return self._joined(timestamps, values)
+
+    '''
+    (timestamps, Watts) of one breaker between the two timestamps, across days.
+    '''
+    def breakerSeries(self, breakerID: int, startTimestamp: float, endTimestamp: Optional[float]=None) -> tuple:
+        if not(1 <= breakerID <= SPAN_history.MAX_BREAKER_SERIES):
+            return self._joined([], [])
+        column = SPAN_history.FIRST_BREAKER_COLUMN + breakerID - 1
+        days = self.query(startTimestamp, endTimestamp)
+        return self._joined([records['timestamp'] for (dayStart, records, circuitColumns) in days], [records['values'][:, column] for (dayStart, records, circuitColumns) in days])
+
+    @staticmethod
+    def _joined(timestamps: list, values: list) -> tuple:
+        if len(timestamps) == 0:
+            return (numpy.zeros(0), numpy.zeros(0, dtype=numpy.float32))
+        return (numpy.concatenate(timestamps), numpy.concatenate(values))
+
+    def close(self):
+        with self._lock:
+            if self.today is not None:
+                self.today.close()
+                self.today = None
+
+    def statsString(self) -> str:
+        with self._lock:
+            days = self.dayFiles()
+            totalBytes = sum(self._sizeOf(path) for (dayStart, path) in days)
+            todayCount = 0 if self.today is None else self.today.count
+            return "days=" + str(len(days)) + ", on disk=" + str(round(totalBytes/1048576, 1)) + " MB, today's records=" + str(todayCount) + ", appended=" + str(self.appended) + ", dropped=" + str(self.dropped) + ", failed=" + str(self.failed)
+
+# set from the optional History_Archive_Days / History_Archive_MB custom parameters; 0 days = no archive
+_archiveRetentionDays = ARCHIVE_DEFAULT_DAYS
+_archiveMaxBytes = ARCHIVE_DEFAULT_MAX_MB * 1048576
+
+_panelArchives: dict = {}
+_panelArchivesLock = threading.Lock()
+
+'''
+Set the retention (days, and MB per panel); archives already open apply it right away (or are closed, if off).
+'''
+def setArchiveLimits(retentionDays: float, maxMB: float):
+    global _archiveRetentionDays, _archiveMaxBytes
+    with _panelArchivesLock:
+        _archiveRetentionDays = max(0.0, float(retentionDays))
+        _archiveMaxBytes = int(max(0.0, float(maxMB)) * 1048576)
+        archives = list(_panelArchives.values())
+        if _archiveRetentionDays <= 0:
+            _panelArchives.clear()
+    for archive in archives:
+        changed = archive.retentionDays != _archiveRetentionDays or archive.maxBytes != _archiveMaxBytes
+        archive.retentionDays = _archiveRetentionDays
+        archive.maxBytes = _archiveMaxBytes
+        if _archiveRetentionDays <= 0:
+            archive.close()
+        elif changed:
+            archive.enforceRetention()
+    if _archiveRetentionDays <= 0:
+        LOGGER.info("\n\tHISTORY ARCHIVE is off.\n")
+    else:
+        LOGGER.info("\n\tHISTORY ARCHIVE keeps " + str(_archiveRetentionDays) + " days, up to " + str(round(_archiveMaxBytes/1048576, 1)) + " MB per panel, in '" + ARCHIVE_DIRECTORY + "'.\n")
+
+'''
+Return the shared PanelArchive for a panel, creating it on first use; None when the archive is off.
+'''
+def getPanelArchive(ipAddress: str) -> Optional[PanelArchive]:
+    with _panelArchivesLock:
+        if _archiveRetentionDays <= 0:
+            return None
+        archive = _panelArchives.get(ipAddress)
+        if archive is None:
+            archive = PanelArchive(ipAddress, _archiveRetentionDays, _archiveMaxBytes)
+            _panelArchives[ipAddress] = archive
+        return archive
+
+def panelArchives() -> list:
+    with _panelArchivesLock:
+        return list(_panelArchives.values())
+
+'''
+Sync and close every open day file (at STOP); the next record() reopens the day.
+'''
+def closeArchives():
+    for archive in panelArchives():
+        archive.close()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Columnar Panel Power Arrays
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import numpy
+
+# Standard Library
+from typing import Optional, Any
+
+LOGGER = udi_interface.LOGGER
+
+LEG_L1 = 0
+LEG_L2 = 1
+
+'''
+SPAN_snapshot.ceilPower() over a whole array at once: round UP to the hundredth of a Watt.
+'''
+def ceilPowerArray(values: Any) -> numpy.ndarray:
+    return numpy.ceil(numpy.asarray(values, dtype=numpy.float64)*100)/100
+
+'''
+The leg (LEG_L1 / LEG_L2) of each breaker position (tab): positions alternate legs every row of two, so
+tabs 1-2 are on L1, 3-4 on L2, 5-6 on L1, and so on.
+'''
+def legOfTabs(tabs: Any) -> numpy.ndarray:
+    return ((numpy.asarray(tabs, dtype=numpy.int64) - 1)//2) % 2
+
+'''
+The branch and circuit powers of one PanelSnapshot as contiguous arrays, built in one vectorized step per poll
+(see PanelSnapshot.powerArrays):
+  - breakerIDs / breakerPowerW: one entry per branch, in breaker ID order, rounded like every published wattage;
+  - circuitIDs / circuitPowerW: one entry per circuit, in panel order;
+  - breakerWatts / circuitWatts: breaker ID / circuit ID -> the Watts a child node shows ('ST': magnitude, to the hundredth),
+    so each child only looks its value up instead of rounding its own.
+Totals, per-leg sums, the top loads and what changed since an earlier poll all come from array operations.
+'''
+class PanelPowerArrays(object):
+    __slots__ = ('breakerIDs', 'breakerPowerW', 'circuitIDs', 'circuitPowerW', 'breakerWatts', 'circuitWatts')
+
+    def __init__(self, panelSnapshot):
+        breakerIDs = sorted(panelSnapshot.branches.keys())
+        self.breakerIDs = numpy.array(breakerIDs, dtype=numpy.int64)
+        self.breakerPowerW = ceilPowerArray([panelSnapshot.branches[breakerID].instantPowerW for breakerID in breakerIDs])
+        self.circuitIDs: tuple = tuple(panelSnapshot.circuits.keys())
+        self.circuitPowerW = ceilPowerArray([circuit.instantPowerW for circuit in panelSnapshot.circuits.values()])
+        self.breakerWatts: dict = dict(zip(breakerIDs, numpy.round(numpy.abs(self.breakerPowerW), 2).tolist()))
+        self.circuitWatts: dict = dict(zip(self.circuitIDs, numpy.round(numpy.abs(self.circuitPowerW), 2).tolist()))
+
+    @property
+    def branchTotalW(self) -> float:
+        return round(float(numpy.abs(self.breakerPowerW).sum()), 2)
+
+    @property
+    def circuitTotalW(self) -> float:
+        return round(float(numpy.abs(self.circuitPowerW).sum()), 2)
+
+    '''
+    (L1 Watts, L2 Watts): the branch powers summed per leg.
+    '''
+    def legPowerW(self) -> tuple:
+        magnitudes = numpy.abs(self.breakerPowerW)
+        onL1 = legOfTabs(self.breakerIDs) == LEG_L1
+        return (round(float(magnitudes[onL1].sum()), 2), round(float(magnitudes[~onL1].sum()), 2))
+
+    '''
+    The 'count' largest circuit loads as [(circuit ID, Watts)], largest first.
+    '''
+    def topCircuitLoads(self, count: int=5) -> list:
+        if len(self.circuitIDs) == 0 or count <= 0:
+            return []
+        magnitudes = numpy.abs(self.circuitPowerW)
+        order = numpy.argsort(-magnitudes, kind='stable')[:count]
+        return [(self.circuitIDs[i], float(magnitudes[i])) for i in order]
+
+    '''
+    Breaker IDs whose published power differs from 'previous' (every breaker if there is no comparable previous poll).
+    '''
+    def changedBreakerIDs(self, previous: Optional['PanelPowerArrays']) -> set:
+        if previous is None or not(numpy.array_equal(self.breakerIDs, previous.breakerIDs)):
+            return set(int(breakerID) for breakerID in self.breakerIDs)
+        return set(int(breakerID) for breakerID in self.breakerIDs[self.breakerPowerW != previous.breakerPowerW])
+
+    '''
+    Circuit IDs whose published power differs from 'previous' (every circuit if there is no comparable previous poll).
+    '''
+    def changedCircuitIDs(self, previous: Optional['PanelPowerArrays']) -> set:
+        if previous is None or self.circuitIDs != previous.circuitIDs:
+            return set(self.circuitIDs)
+        return set(self.circuitIDs[i] for i in numpy.flatnonzero(self.circuitPowerW != previous.circuitPowerW))
+
+    '''
+    The largest change of any circuit's power since 'previous', in Watts; None if the circuits are not comparable.
+    '''
+    def largestCircuitChangeW(self, previous: Optional['PanelPowerArrays']) -> Optional[float]:
+        if previous is None or len(self.circuitIDs) == 0 or self.circuitIDs != previous.circuitIDs:
+            return None
+        return float(numpy.abs(self.circuitPowerW - previous.circuitPowerW).max())
+
+'''
+Which tabs (breaker positions) feed which circuit, built once per topology (see PanelNodeForBreakers.publishPhaseBalance):
+circuitTabs (circuit ID -> tabs) and tabCircuit (tab -> circuit ID) for lookups, plus the same pairs as two flat arrays
+(entryCircuit: position of the circuit in panel order, entryTab: tab) so per-circuit tab sums are a single numpy.bincount.
+'''
+class TabIndex(object):
+    __slots__ = ('circuitIDs', 'circuitTabs', 'tabCircuit', 'entryCircuit', 'entryTab')
+
+    def __init__(self, panelSnapshot):
+        self.circuitIDs: tuple = tuple(panelSnapshot.circuits.keys())
+        self.circuitTabs: dict = {}
+        self.tabCircuit: dict = {}
+        entryCircuit = []
+        entryTab = []
+        for position, circuit in enumerate(panelSnapshot.circuits.values()):
+            self.circuitTabs[circuit.circuitID] = tuple(circuit.tabs)
+            for tab in circuit.tabs:
+                self.tabCircuit[tab] = circuit.circuitID
+                entryCircuit.append(position)
+                entryTab.append(tab)
+        self.entryCircuit = numpy.array(entryCircuit, dtype=numpy.int64)
+        self.entryTab = numpy.array(entryTab, dtype=numpy.int64)
+
+    '''
+    True if this index describes the circuits of 'powerArrays' (same circuit IDs, in the same order).
+    '''
+    def matches(self, powerArrays: PanelPowerArrays) -> bool:
+        return self.circuitIDs == powerArrays.circuitIDs
+
+'''
+Leg loads and circuit-vs-tab consistency of one poll (see computePhaseBalance).
+'''
+class PhaseBalance(object):
+    __slots__ = ('legL1W', 'legL2W', 'imbalancePercent', 'mismatchW', 'largestMismatchW', 'largestMismatchCircuitID')
+
+    def __init__(self, legL1W: float, legL2W: float, imbalancePercent: float, mismatchW: numpy.ndarray, largestMismatchW: float, largestMismatchCircuitID: Optional[str]):
+        self.legL1W = legL1W
+        self.legL2W = legL2W
+        # |L1 - L2| as a percentage of L1 + L2
+        self.imbalancePercent = imbalancePercent
+        # per circuit (panel order): |reported circuit power - sum of its tabs' branch power|
+        self.mismatchW = mismatchW
+        self.largestMismatchW = largestMismatchW
+        self.largestMismatchCircuitID = largestMismatchCircuitID
+
+    def __repr__(self):
+        return "PhaseBalance(L1=" + str(self.legL1W) + " W, L2=" + str(self.legL2W) + " W, imbalance=" + str(self.imbalancePercent) + "%, largest mismatch=" + str(self.largestMismatchW) + " W on " + str(self.largestMismatchCircuitID) + ")"
+
+'''
+L1 / L2 leg loads, their imbalance, and how far each circuit's reported power is from the sum of its tabs' branch power,
+in one vectorized pass over the poll's power arrays and the (prebuilt) tab index.
+'''
+def computePhaseBalance(powerArrays: PanelPowerArrays, tabIndex: TabIndex) -> PhaseBalance:
+    (legL1W, legL2W) = powerArrays.legPowerW()
+    totalW = legL1W + legL2W
+    imbalancePercent = 0.0 if totalW <= 0 else round(abs(legL1W - legL2W)*100/totalW, 1)
+
+    mismatchW = numpy.zeros(len(tabIndex.circuitIDs))
+    largestMismatchW = 0.0
+    largestMismatchCircuitID = None
+    if len(tabIndex.circuitIDs) > 0 and len(powerArrays.breakerIDs) > 0:
+        highestTab = int(max(powerArrays.breakerIDs.max(), tabIndex.entryTab.max() if len(tabIndex.entryTab) > 0 else 0))
+        tabPowerW = numpy.zeros(highestTab + 1)
+        tabPowerW[powerArrays.breakerIDs] = numpy.abs(powerArrays.breakerPowerW)
+        tabSumsW = numpy.bincount(tabIndex.entryCircuit, weights=tabPowerW[tabIndex.entryTab], minlength=len(tabIndex.circuitIDs))
+        mismatchW = numpy.round(numpy.abs(numpy.abs(powerArrays.circuitPowerW) - tabSumsW), 2)
+        largest = int(numpy.argmax(mismatchW))
+        largestMismatchW = float(mismatchW[largest])
+        largestMismatchCircuitID = tabIndex.circuitIDs[largest]
+
+    return PhaseBalance(legL1W, legL2W, imbalancePercent, mismatchW, largestMismatchW, largestMismatchCircuitID)
@@ -8,6 +8,7 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
 import string
 import re
 
@@ -16,6 +17,8 @@ from typing import Optional, Any, TYPE_CHECKING
 
 import math,datetime,urllib.parse,http.client,base64
 
+from nodes import SPAN_snapshot, SPAN_isy, SPAN_drivers, SPAN_scheduler
+
 LOGGER = udi_interface.LOGGER
 ISY = udi_interface.ISY
 
@@ -40,9 +43,13 @@ class BreakerNode(udi_interface.Node):
         self._initialized: bool = False
         
         self._fullyCreated: bool = False
+
+        # what has already been reported to IoX, so unchanged values are not re-sent every poll; 'ST' (Watts) also honours the power deadband
+        self.driverCache = SPAN_drivers.DriverStateCache(('ST',))
         
         self.poly = polyglot
-        self.n_queue = []
+        # set once ADDNODEDONE has been handled for this node (see wait_for_node_done)
+        self.nodeCreated = threading.Event()
         self.parent = parent
         
         self.ISY = ISY(self.poly)
@@ -52,7 +59,9 @@ class BreakerNode(udi_interface.Node):
         self.ipAddress = spanIPAddress
         self.token = bearerToken
         self.breakerID = spanBreakerID
-        self.allBreakersData = ''
+        self.branchRecord: Optional[SPAN_snapshot.BranchRecord] = None
+        # 'ST' as handed over with the branch record
+        self.powerW: Optional[float] = None
         
         tokenLastTen = self.token[-10:]
         LOGGER.debug("\n\tINIT IP Address for breaker:" + self.ipAddress + "; Bearer Token (last 10 characters): " + tokenLastTen + "; Breaker ID: " + str(self.breakerID))
@@ -66,50 +75,51 @@ class BreakerNode(udi_interface.Node):
         polyglot.subscribe(polyglot.DELETE, self.delete)
         
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
+    node_queue() and wait_for_node_done() create a simple way to wait
     for a node to be created.  The nodeAdd() API call is asynchronous and
     will return before the node is fully created. Using this, we can wait
+    (on a threading.Event, with an optional timeout; returns False if it ran out)
     until it is fully created before we try to use it.
     '''
     def node_queue(self, data):
         if self.address == data['address']:
             LOGGER.debug("\n\tWAIT FOR NODE CREATION: Fully Complete for Breaker " + self.address + "\n")
-            nowEpoch = int(time.time())
-            nowDT = datetime.datetime.fromtimestamp(nowEpoch)
-            
-            self.setDriver('ST', -1, True, True)
-            self.setDriver('PULSCNT', -1, True, True)
-            self.setDriver('CLIEMD', -1, True, True)
-            self.setDriver('TIME', -1, True, True)
-
-            self.setDriver('GPV', -1, True, True)
-            
-            self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
 
             self._fullyCreated = True
+            self.restoreDrivers()
             
-            self.n_queue.append(data['address'])        
+            self.nodeCreated.set()
+
+    def wait_for_node_done(self, timeout: Optional[float]=None) -> bool:
+        return self.nodeCreated.wait(timeout)
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    '''
+    Called from both node_queue() and start() (they run on separate threads, in either order); once both have run,
+    the last known driver values are restored (SPAN_drivers.restoreNodeDrivers) instead of forcing every driver to -1.
+    Safe to run twice: the second pass finds nothing that differs.
+    '''
+    def restoreDrivers(self):
+        if self._initialized and self._fullyCreated:
+            SPAN_drivers.restoreNodeDrivers(self, self.driverCache)
         
     # called by the interface after the node data has been put in the Polyglot DB
     # and the node created/updated in the ISY
     def start(self):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
-        self.setDriver('GPV', -1, True, True)
-        self.setDriver('ST', -1, True, True)
-        self.setDriver('PULSCNT', -1, True, True)
-        self.setDriver('CLIEMD', -1, True, True)
-        self.setDriver('TIME', -1, True, True)
+        self.restoreDrivers()
         
     # overload the setDriver() of the parent class to short circuit if 
     # node not initialized
     def setDriver(self, driver: str, value: Any, report: bool=True, force: bool=False, uom: Optional[int]=None, text: Optional[str]=None):
         if self._initialized and self._fullyCreated:
+            if report and not(self.driverCache.shouldReport(driver, value, uom, text)):
+                return
+            collector = SPAN_drivers.activeCollector()
+            if report and collector is not None:
+                super().setDriver(driver, value, False, force, uom, text)
+                collector.addDriver(self, driver)
+                return
             super().setDriver(driver, value, report, force, uom, text)
 
     def delete(self, address):
@@ -131,6 +141,10 @@ class BreakerNode(udi_interface.Node):
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
             
+        if not(self.driverCache.shouldPushText(driver, stringToPublish)):
+            LOGGER.debug("\n\tPUSHING REPORT SKIPPED for '" + self.address + "' driver " + driver + ": text is unchanged.\n")
+            return
+
         currentValue = int(self.getDriver(driver))
         newValue = -1
         encodedStringToPublish = urllib.parse.quote(stringToPublish, safe='')
@@ -154,113 +168,70 @@ class BreakerNode(udi_interface.Node):
                     'text': stringToPublish
                 }]
             }
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
+            collector = SPAN_drivers.activeCollector()
+            if collector is not None:
+                collector.add(self.address, driver, newValue, 56, stringToPublish)
+            else:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
+                self.poly.send(message, 'status')
+            self.driverCache.rememberText(driver, newValue, stringToPublish)
         elif not(self.ISY.unauthorized):
-            message = {
-                'set': [{
-                    'address': self.address,
-                    'driver': driver,
-                    'value': newValue,
-                    'uom': 56,
-                    'text': encodedStringToPublish
-                }]
-            }
-
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-    
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 0:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-        
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-                
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                    
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an error.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an error.\n")
-                finally:
-                    localConnection.close()  
+            isyReporter = SPAN_isy.getIsyReporter(self.poly, self.ISY)
+            if isyReporter.isConfigured:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 (queued) via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
+                # remembered first: a publisher that fails fast calls forgetText, which has to find it
+                self.driverCache.rememberText(driver, newValue, stringToPublish)
+                isyReporter.enqueueText(self.address, driver, newValue, encodedStringToPublish, self.driverCache.forgetText)
         else:
             LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
 
     '''
-    This is where the real work happens.  When the parent controller gets a shortPoll, do some work with the passed data. 
+    This is where the real work happens.  When the parent controller gets a shortPoll, do some work with the passed data.
+    The parent controller has already decoded the panel payload; we are only handed our own branch record, and the Watts
+    to show, already rounded for the whole panel at once (SPAN_arrays.PanelPowerArrays.breakerWatts).
+    When the polltype carries SPAN_scheduler.POWER_ONLY, only the power ('ST') is refreshed, not the relay state.
     '''
-    def updateBreakerNode(self, passedAllBreakersData, dateTimeString):
-        self.allBreakersData = passedAllBreakersData
+    def updateBreakerNode(self, passedBranchRecord, dateTimeString, polltype='shortPoll', powerW=None):
+        self.branchRecord = passedBranchRecord
+        self.powerW = powerW
 
         if int(self.getDriver('PULSCNT')) <= 0:
             LOGGER.debug("\n\tFor updateNode under '" + self.address + "', setting Breaker ID (PULSCNT) because it is currently 0.\n")
             self.setDriver('PULSCNT', self.breakerID, True, True)
         
-        self.poll('shortPoll')
+        self.poll(polltype)
 
         if "-1" in str(self.getDriver('GPV')):
             self.pushTextToDriver('GPV','NodeServer RUNNING')
         
-        if "instantPowerW" in self.allBreakersData:
+        if self.branchRecord is not None:
             self.pushTextToDriver('TIME', dateTimeString)
         
     def poll(self, polltype):
         if 'shortPoll' in polltype:
             tokenLastTen = self.token[-10:]
             LOGGER.debug('\n\tPOLL About to parse {} Breaker node of {}, using token ending in {}'.format(self.breakerID,self.ipAddress,tokenLastTen))
-            designatedBreakerData_tuple = self.allBreakersData.partition(chr(34) + 'id' + chr(34) + ':' + str(self.breakerID) + ',')
-            designatedBreakerData = designatedBreakerData_tuple[2]
-            designatedBreakerData_tuple = designatedBreakerData.partition('},')
-            designatedBreakerData = designatedBreakerData_tuple[0] + '}'
         
-            LOGGER.debug("\n\tPOLL Breaker Data: \n\t\t" + designatedBreakerData + "\n")
+            LOGGER.debug("\n\tPOLL Breaker Data: \n\t\t" + str(self.branchRecord) + "\n")
         
-            if "instantPowerW" in designatedBreakerData:
-                designatedBreakerStatus_tuple = designatedBreakerData.partition(chr(34) + "relayState" + chr(34) + ":")
-                designatedBreakerStatus = designatedBreakerStatus_tuple[2]
-                designatedBreakerStatus_tuple = designatedBreakerStatus.partition(',')
-                designatedBreakerStatus = designatedBreakerStatus_tuple[0]
-
-                designatedBreakerInstantPowerW_tuple = designatedBreakerData.partition(chr(34) + "instantPowerW" + chr(34) + ":")
-                designatedBreakerInstantPowerW = designatedBreakerInstantPowerW_tuple[2]
-                designatedBreakerInstantPowerW_tuple = designatedBreakerInstantPowerW.partition(',')
-                designatedBreakerInstantPowerW = designatedBreakerInstantPowerW_tuple[0]
-                designatedBreakerInstantPowerW = math.ceil(float(designatedBreakerInstantPowerW)*100)/100
+            if self.branchRecord is not None:
+                designatedBreakerStatus = self.branchRecord.relayState
               
-                LOGGER.debug("\n\tPOLL about to evaluate Breaker Status (" + designatedBreakerStatus + ") and set CLIEMD appropriately.\n")
-                if "CLOSED" in designatedBreakerStatus:
-                  self.setDriver('CLIEMD', 2, True, True)
-                elif "OPEN" in designatedBreakerStatus:
-                  self.setDriver('CLIEMD', 1, True, True)
-                else:
-                  self.setDriver('CLIEMD', 0, True, True)
+                if SPAN_scheduler.POWER_ONLY not in polltype:
+                    LOGGER.debug("\n\tPOLL about to evaluate Breaker Status (" + designatedBreakerStatus + ") and set CLIEMD appropriately.\n")
+                    if "CLOSED" in designatedBreakerStatus:
+                      self.setDriver('CLIEMD', 2, True, True)
+                    elif "OPEN" in designatedBreakerStatus:
+                      self.setDriver('CLIEMD', 1, True, True)
+                    else:
+                      self.setDriver('CLIEMD', 0, True, True)
                 
-                LOGGER.debug("\n\tPOLL About to set ST to " + str(abs(designatedBreakerInstantPowerW)) + " for Breaker " + str(self.breakerID) + ".\n")
-                self.setDriver('ST', round(abs(designatedBreakerInstantPowerW),2), True, True)
+                if self.powerW is not None:
+                    LOGGER.debug("\n\tPOLL About to set ST to " + str(self.powerW) + " for Breaker " + str(self.breakerID) + ".\n")
+                    self.setDriver('ST', self.powerW, True, True)
 
             else:
-                LOGGER.warning("\n\tPOLL ERROR: Unable to get designatedBreakerInstantPowerW from designatedBreakerData:\n\t\t" + designatedBreakerData + "\n")
+                LOGGER.warning("\n\tPOLL ERROR: No branch record was found for Breaker " + str(self.breakerID) + " under '" + self.address + "'.\n")
                 self.setDriver('TIME', -1, True, True)
                 self.pushTextToDriver('GPV',"POLL ERROR DESIGNATEDBREAKER")
                 
@@ -269,6 +240,7 @@ class BreakerNode(udi_interface.Node):
     '''
     def stop(self):
         LOGGER.warning("\n\tSTOP COMMAND received: Breaker Node '" + self.address + "'.\n")
+        self.driverCache.freeze()
         self.setDriver('ST', -1, True, True)
         self.setDriver('PULSCNT', -1, True, True)
         self.setDriver('CLIEMD', -1, True, True)
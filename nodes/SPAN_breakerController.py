@@ -8,10 +8,12 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
 import string
 import re
+import logging
 
-from nodes import SPAN_breaker, SPAN_circuitController
+from nodes import SPAN_breaker, SPAN_circuitController, SPAN_snapshot, SPAN_hub, SPAN_isy, SPAN_drivers, SPAN_scheduler, SPAN_health, SPAN_inventory, SPAN_topology, SPAN_arrays, SPAN_history, SPAN_archive
 
 # Standard Library
 from typing import Optional, Any, TYPE_CHECKING
@@ -72,13 +74,6 @@ def getValidNodeName(s: str) -> str:
 
     return name
 '''
-just for when nodes get silly
-'''
-class fakeNode( object ):
-    def wait_for_node_done(self):
-        return
-
-'''
 This is our Panel Breakers controller node. 
 '''
 class PanelNodeForBreakers(udi_interface.Node):
@@ -94,6 +89,12 @@ class PanelNodeForBreakers(udi_interface.Node):
             {'driver': 'GV3', 'value': -1, 'uom': 25},
             {'driver': 'GV4', 'value': -1, 'uom': 25},
             {'driver': 'GV5', 'value': -1, 'uom': 25},
+            {'driver': 'GV6', 'value': 0, 'uom': 58},
+            {'driver': 'GV7', 'value': -1, 'uom': 25},
+            {'driver': 'GV8', 'value': -1, 'uom': 73},
+            {'driver': 'GV9', 'value': -1, 'uom': 73},
+            {'driver': 'GV10', 'value': -1, 'uom': 51},
+            {'driver': 'GV11', 'value': -1, 'uom': 73},
             {'driver': 'GPV', 'value': -1, 'uom': 56}
             ]
 
@@ -105,13 +106,18 @@ class PanelNodeForBreakers(udi_interface.Node):
         self._initialized: bool = False
 
         self._fullyCreated: bool = False
+
+        # what has already been reported to IoX, so unchanged values are not re-sent every poll; 'ST' (Watts) also honours the power deadband
+        self.driverCache = SPAN_drivers.DriverStateCache(('ST',))
         
         self.poly = polyglot
-        self.n_queue = []
+        # set once ADDNODEDONE has been handled for this node (see wait_for_node_done)
+        self.nodeCreated = threading.Event()
         self.parent = parent
         self.sisterCircuitsController: SPAN_circuitController.PanelNodeForCircuits = sisterCircuitsControllerPassed
 
-        self.childBreakerNodes: SPAN_breaker.BreakerNode = []
+        # the child BreakerNodes, by address and by breaker ID (1-32)
+        self.childBreakerNodes = SPAN_inventory.ChildRegistry('breakerID')
         self.expectedNumberOfChildrenBreakers = 32
         self.allExpectedChildrenCreated: bool = False
 
@@ -125,10 +131,33 @@ class PanelNodeForBreakers(udi_interface.Node):
         tokenLastTen = self.token[-10:]
         LOGGER.debug("\n\tINIT Panel Breaker Controller's IP Address:" + self.ipAddress + "; Bearer Token (last 10 characters): " + tokenLastTen)
 
-        self.allBreakersData = ''
-        self.pollInProgress: bool = False
-
-        self.statusPollInProgress: bool = False
+        self.panelHub = SPAN_hub.getPanelDataHub(self.ipAddress, self.token)
+        self.topologyCache = SPAN_topology.getTopologyCache(self.ipAddress)
+
+        self.panelSnapshot = SPAN_snapshot.PanelSnapshot()
+        # power every short poll, relay / priority every few, /api/v1/status on the long poll (or on demand)
+        self.scheduler = SPAN_scheduler.PollScheduler()
+        # optional fast loop that only refreshes the panel total ('ST'); see startFastPoll()
+        self.fastPollTimer: Optional[SPAN_scheduler.FixedRateTimer] = None
+        # optional adaptive full poll that replaces the PG3 shortPoll for this panel; see startAdaptivePoll()
+        self.adaptiveInterval: Optional[SPAN_scheduler.AdaptiveInterval] = None
+        self.adaptivePollTimer: Optional[SPAN_scheduler.FixedRateTimer] = None
+
+        # fingerprints of the last published /api/v1/panel and /api/v1/circuits payloads (see SPAN_snapshot.fingerprintPayload),
+        # so a poll that returns the same readings skips parsing and publishing
+        self.lastPublishedFingerprints = None
+        self.lastRelayFingerprints = None
+        self.lastFastPollFingerprint = None
+        self.lastSeenPanelFingerprint = None
+        self.fingerprintLock = threading.Lock()
+        self.duplicateSnapshotsSkipped = 0
+        # the power arrays (SPAN_arrays.PanelPowerArrays) of the last poll published to the breaker children;
+        # a power-only poll only updates the breakers whose power changed since then
+        self.lastPublishedPowerArrays = None
+        # circuit <-> tab index (SPAN_arrays.TabIndex) for the phase-balance drivers; rebuilt when the topology changes
+        self.tabIndex: Optional[SPAN_arrays.TabIndex] = None
+        # learns the panel's own refresh period from the fingerprints, to phase-align our timers with it
+        self.refreshCadence = SPAN_scheduler.RefreshCadenceEstimator()
         
         # subscribe to the events we want
         #polyglot.subscribe(polyglot.POLL, self.pollBreakerController)
@@ -138,9 +167,10 @@ class PanelNodeForBreakers(udi_interface.Node):
         polyglot.subscribe(polyglot.DELETE, self.delete)
 
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
+    node_queue() and wait_for_node_done() create a simple way to wait
     for a node to be created.  The nodeAdd() API call is asynchronous and
     will return before the node is fully created. Using this, we can wait
+    (on a threading.Event, with an optional timeout; returns False if it ran out)
     until it is fully created before we try to use it.
     '''
     def node_queue(self, data):
@@ -151,46 +181,31 @@ class PanelNodeForBreakers(udi_interface.Node):
             #lastOctet = lastOctet_array[len(lastOctet_array)-1]
             #self.setDriver('FREQ', lastOctet, True, True, None, self.ipAddress)
 
-            self.setDriver('ST', -1, True, True)
-            self.setDriver('FREQ', -1, True, True)
-            self.setDriver('PULSCNT', 0, True, True)
-            self.setDriver('GV0', 0, True, True)
-            self.setDriver('TIME', -1, True, True)
-            self.setDriver('GV1', -1, True, True)
-            self.setDriver('GV2', -1, True, True)
-
-            self.setDriver('GPV', -1, True, True)
-            
             self.pushTextToDriver('FREQ', self.ipAddress.replace('.','-'))
 
-            if not(self.pollInProgress):
-                self.updateAllBreakersData()
+            # warm start: the panel has been seen before, so the breaker nodes can be created without waiting for it;
+            # the first short poll fills in their values
+            if self.topologyCache.load() is not None:
+                LOGGER.info("\n\tWARM START of Panel Breaker Controller '" + self.address + "' from the topology cache.\n")
+                self.createBreakers()
+                self._fullyCreated = True
+                self.restoreDrivers()
+                self.nodeCreated.set()
+                return
+
+            self.updateAllBreakersData()
 
             try:
-                if "branches" in self.allBreakersData:
-                    feedthroughPowerW_tuple = self.allBreakersData.partition(chr(34) + "feedthroughPowerW" + chr(34) + ":")
-                    feedthroughPowerW = feedthroughPowerW_tuple[2]
-                    feedthroughPowerW_tuple = feedthroughPowerW.partition(",")
-                    feedthroughPowerW = feedthroughPowerW_tuple[0]
-                    feedthroughPowerW = math.ceil(float(feedthroughPowerW)*100)/100
-    
-                    instantGridPowerW_tuple = self.allBreakersData.partition(chr(34) + "instantGridPowerW" + chr(34) + ":")
-                    instantGridPowerW = instantGridPowerW_tuple[2]
-                    instantGridPowerW_tuple = instantGridPowerW.partition(",")
-                    instantGridPowerW = instantGridPowerW_tuple[0]
-                    instantGridPowerW = math.ceil(float(instantGridPowerW)*100)/100
-    
+                if self.panelSnapshot.hasPanelData:
                     #if it turns out we need to handle feedthroughPower separately, subtract it from the main
                     #tracking from SPAN app generally seems to track more closely with what's show there by doing this subtraction... Shrug?
-                    self.setDriver('ST', round((instantGridPowerW-abs(feedthroughPowerW)),2), True, True)
+                    self.setDriver('ST', self.panelSnapshot.totalPowerW, True, True)
                     #otherwise, use the main directly
-                    #self.setDriver('ST', (instantGridPowerW), True, True)
+                    #self.setDriver('ST', SPAN_snapshot.ceilPower(self.panelSnapshot.instantGridPowerW), True, True)
     
-                    allBranchesData_tuple = self.allBreakersData.partition(chr(34) + "branches" + chr(34) + ":")
-                    allBranchesData = allBranchesData_tuple[2]
-                    LOGGER.debug("\n\tINIT Panel Breaker Controller's Branches Data: \n\t\t" + allBranchesData + "\n\t\tCount of OPEN Breakers: " + str(allBranchesData.count(chr(34) + 'OPEN' + chr(34) + ',')) + "\n\t\tCount of CLOSED Breakers: " + str(allBranchesData.count(chr(34) + 'CLOSED' + chr(34) + ',')) + "\n")
-                    self.setDriver('PULSCNT', allBranchesData.count(chr(34) + 'CLOSED' + chr(34) + ','), True, True)
-                    self.setDriver('GV0', allBranchesData.count(chr(34) + 'OPEN' + chr(34) + ','), True, True)
+                    LOGGER.debug("\n\tINIT Panel Breaker Controller's Branches Data: \n\t\t" + str(list(self.panelSnapshot.branches.values())) + "\n\t\tCount of OPEN Breakers: " + str(self.panelSnapshot.openBreakerCount) + "\n\t\tCount of CLOSED Breakers: " + str(self.panelSnapshot.closedBreakerCount) + "\n")
+                    self.setDriver('PULSCNT', self.panelSnapshot.closedBreakerCount, True, True)
+                    self.setDriver('GV0', self.panelSnapshot.openBreakerCount, True, True)
     
                     nowEpoch = int(time.time())
                     nowDT = datetime.datetime.fromtimestamp(nowEpoch)
@@ -199,23 +214,31 @@ class PanelNodeForBreakers(udi_interface.Node):
                     self.createBreakers()
                     
                     self._fullyCreated = True
-                    self.n_queue.append(data['address'])
+                    self.restoreDrivers()
+                    self.nodeCreated.set()
                 else:
                     LOGGER.warning("\n\tINIT Issue getting first-time Breakers Data for Panel Breaker Controller '" + self.address + "' @ " + self.ipAddress + ".\n")
             except:
                 LOGGER.warning("\n\tINIT Issue after returning from self.updateAllBreakersData().\n")
           
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    def wait_for_node_done(self, timeout: Optional[float]=None) -> bool:
+        return self.nodeCreated.wait(timeout)
+
+    '''
+    Called from both node_queue() and start() (they run on separate threads, in either order); once both have run,
+    the last known driver values are restored (SPAN_drivers.restoreNodeDrivers) instead of forcing every driver to -1.
+    Safe to run twice: the second pass finds nothing that differs.
+    '''
+    def restoreDrivers(self):
+        if self._initialized and self._fullyCreated:
+            SPAN_drivers.restoreNodeDrivers(self, self.driverCache)
 
     # called by the interface after the node data has been put in the Polyglot DB
     # and the node created/updated in the ISY
     def start(self):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
-        self.setDriver('GPV', -1, True, True)
+        self.restoreDrivers()
         
     def delete(self, address):
         if address == self.address:
@@ -227,6 +250,13 @@ class PanelNodeForBreakers(udi_interface.Node):
     # node not initialized
     def setDriver(self, driver: str, value: Any, report: bool=True, force: bool=False, uom: Optional[int]=None, text: Optional[str]=None):
         if self._initialized and self._fullyCreated:
+            if report and not(self.driverCache.shouldReport(driver, value, uom, text)):
+                return
+            collector = SPAN_drivers.activeCollector()
+            if report and collector is not None:
+                super().setDriver(driver, value, False, force, uom, text)
+                collector.addDriver(self, driver)
+                return
             super().setDriver(driver, value, report, force, uom, text)
 
     '''
@@ -242,6 +272,10 @@ class PanelNodeForBreakers(udi_interface.Node):
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
             
+        if not(self.driverCache.shouldPushText(driver, stringToPublish)):
+            LOGGER.debug("\n\tPUSHING REPORT SKIPPED for '" + self.address + "' driver " + driver + ": text is unchanged.\n")
+            return
+
         currentValue = int(self.getDriver(driver))
         newValue = -1
         encodedStringToPublish = urllib.parse.quote(stringToPublish, safe='')
@@ -261,70 +295,30 @@ class PanelNodeForBreakers(udi_interface.Node):
                     'driver': driver,
                     'value': newValue,
                     'uom': 56,
-                    'text': stringtoPublish
+                    'text': stringToPublish
                 }]
             }
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
+            collector = SPAN_drivers.activeCollector()
+            if collector is not None:
+                collector.add(self.address, driver, newValue, 56, stringToPublish)
+            else:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
+                self.poly.send(message, 'status')
+            self.driverCache.rememberText(driver, newValue, stringToPublish)
         elif not(self.ISY.unauthorized):
-            message = {
-                'set': [{
-                    'address': self.address,
-                    'driver': driver,
-                    'value': newValue,
-                    'uom': 56,
-                    'text': encodedStringToPublish
-                }]
-            }
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-    
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 0:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-        
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-    
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                    
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()
+            isyReporter = SPAN_isy.getIsyReporter(self.poly, self.ISY)
+            if isyReporter.isConfigured:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 (queued) via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
+                # remembered first: a publisher that fails fast calls forgetText, which has to find it
+                self.driverCache.rememberText(driver, newValue, stringToPublish)
+                isyReporter.enqueueText(self.address, driver, newValue, encodedStringToPublish, self.driverCache.forgetText)
         else:
             LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
 
-    #def updateNode(self, passedAllBreakersData, dateTimeString):
-    #    self.allBreakersData = passedAllBreakersData
-
     '''
     This is where the real work happens.  When we get a shortPoll, do some work. 
     '''
     def pollBreakerController(self, polltype):
-        if self.pollInProgress:
-            return
         LOGGER.debug("\n\tPOLL BREAKER CONTROLLER: " + polltype + " for '" + self.address + "'.\n")
         if 'shortPoll' in polltype:
             
@@ -340,46 +334,53 @@ class PanelNodeForBreakers(udi_interface.Node):
             tokenLastTen = self.token[-10:]
             LOGGER.debug("\n\tPOLL About to query Panel Breaker Controller '" + self.address + "' @ {}, using token ending in {}".format(self.ipAddress,tokenLastTen))
 
-            if not(self.pollInProgress):
-                try:
-                    self.updateAllBreakersData()
-                except:
-                    LOGGER.error("\n\tPOLL ERROR when querying Panel Breaker Controler '" + self.address +"' @ {}, using token ending in {}".format(self.ipaddress,tokenLastTen))
+            dueTiers = self.scheduler.beginShortPoll()
+            childPolltype = 'shortPoll'
+            if SPAN_scheduler.TIER_RELAY not in dueTiers:
+                childPolltype = childPolltype + SPAN_scheduler.POWER_ONLY
+
+            freshData = True
+            try:
+                freshData = self.updateAllBreakersData(dueTiers)
+            except:
+                LOGGER.error("\n\tPOLL ERROR when querying Panel Breaker Controler '" + self.address +"' @ {}, using token ending in {}".format(self.ipaddress,tokenLastTen))
+            self.publishPanelHealth()
            
-            if "branches" in self.allBreakersData:
-                
-                feedthroughPowerW_tuple = self.allBreakersData.partition(chr(34) + "feedthroughPowerW" + chr(34) + ":")
-                feedthroughPowerW = feedthroughPowerW_tuple[2]
-                feedthroughPowerW_tuple = feedthroughPowerW.partition(",")
-                feedthroughPowerW = feedthroughPowerW_tuple[0]
-                feedthroughPowerW = math.ceil(float(feedthroughPowerW)*100)/100
-
-                instantGridPowerW_tuple = self.allBreakersData.partition(chr(34) + "instantGridPowerW" + chr(34) + ":")
-                instantGridPowerW = instantGridPowerW_tuple[2]
-                instantGridPowerW_tuple = instantGridPowerW.partition(",")
-                instantGridPowerW = instantGridPowerW_tuple[0]
-                instantGridPowerW = math.ceil(float(instantGridPowerW)*100)/100
+            if freshData is None:
+                # the panel is down and still inside its backoff window; nothing was fetched, so there is nothing to pass on
+                LOGGER.debug("\n\tPOLL SKIPPED for Panel Breaker Controller '" + self.address + "': " + self.panelHub.health.statsString() + ".\n")
+            elif freshData is False:
+                # the panel has not refreshed its readings since the last poll; nothing below would change
+                nowEpoch = int(time.time())
+                nowDT = datetime.datetime.fromtimestamp(nowEpoch)
+                self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+                self.pushTextToDriver('GPV','NodeServer RUNNING')
+            elif self.panelSnapshot.stale and self.panelSnapshot.hasPanelData:
+                # this poll failed or missed its deadline; the last good values stay published and 'TIME' keeps showing when they were fetched
+                staleSince = datetime.datetime.fromtimestamp(int(self.panelSnapshot.timestamp)).strftime("%m/%d/%Y %I:%M:%S %p")
+                LOGGER.warning("\n\tPOLL of Panel Breaker Controller '" + self.address + "' got no fresh data; still showing the last good data, from " + staleSince + " (" + str(int(self.panelSnapshot.ageSeconds)) + " seconds ago).\n")
+                self.pushTextToDriver('GPV',"Panel did not answer in time; showing data from " + staleSince)
+            elif self.panelSnapshot.hasPanelData:
+                instantGridPowerW = SPAN_snapshot.ceilPower(self.panelSnapshot.instantGridPowerW)
+                feedthroughPowerW = SPAN_snapshot.ceilPower(self.panelSnapshot.feedthroughPowerW)
 
                 #if it turns out we need to handle feedthroughPower separately, subtract it from the main
                 #tracking from SPAN app generally seems to track more closely with what's show there by doing this subtraction... Shrug?
-                self.setDriver('ST', round((instantGridPowerW-abs(feedthroughPowerW)),2), True, True)
+                self.setDriver('ST', self.panelSnapshot.totalPowerW, True, True)
                 #otherwise, use the main directly
                 #self.setDriver('ST', (instantGridPowerW), True, True)
 
-                LOGGER.warning("\n\tNEW POLL OF DATA QUEUED (via '" + polltype + "'); Total Power of Panel #" + self.address.replace('panelbreaker_','') + " @ " + self.ipAddress + " = " + str(round((instantGridPowerW-abs(feedthroughPowerW)),2)) + ", calculated via instantGridPowerW - feedthroughPowerW, where " + chr(34) + "instantGridPowerW" + chr(34) + " = " + str(instantGridPowerW) + " and " + chr(34) + "feedthroughPowerW" + chr(34) + " = " + str(feedthroughPowerW) + ".\n")
+                LOGGER.warning("\n\tNEW POLL OF DATA QUEUED (via '" + polltype + "'); Total Power of Panel #" + self.address.replace('panelbreaker_','') + " @ " + self.ipAddress + " = " + str(self.panelSnapshot.totalPowerW) + ", calculated via instantGridPowerW - feedthroughPowerW, where " + chr(34) + "instantGridPowerW" + chr(34) + " = " + str(instantGridPowerW) + " and " + chr(34) + "feedthroughPowerW" + chr(34) + " = " + str(feedthroughPowerW) + ".\n")
 
-                allBranchesData_tuple = self.allBreakersData.partition(chr(34) + "branches" + chr(34) + ":")
-                allBranchesData = allBranchesData_tuple[2]
-                LOGGER.debug("\n\tSHORT POLL Panel Breaker Controller '" + self.address + "' - Branches Data: \n\t\t" + allBranchesData + "\n\t\tCount of OPEN Breakers: " + str(allBranchesData.count(chr(34) + 'OPEN' + chr(34) + ',')) + "\n\t\tCount of CLOSED Breakers: " + str(allBranchesData.count(chr(34) + 'CLOSED' + chr(34) + ',')) + "\n")
-                self.setDriver('PULSCNT', allBranchesData.count(chr(34) + 'CLOSED' + chr(34) + ','), True, True)
-                self.setDriver('GV0', allBranchesData.count(chr(34) + 'OPEN' + chr(34) + ','), True, True)
+                if SPAN_scheduler.TIER_RELAY in dueTiers:
+                    LOGGER.debug("\n\tSHORT POLL Panel Breaker Controller '" + self.address + "' - Branches Data: \n\t\t" + str(list(self.panelSnapshot.branches.values())) + "\n\t\tCount of OPEN Breakers: " + str(self.panelSnapshot.openBreakerCount) + "\n\t\tCount of CLOSED Breakers: " + str(self.panelSnapshot.closedBreakerCount) + "\n")
+                    self.setDriver('PULSCNT', self.panelSnapshot.closedBreakerCount, True, True)
+                    self.setDriver('GV0', self.panelSnapshot.openBreakerCount, True, True)
                 
-                if len(str(instantGridPowerW)) > 0:
-                    nowEpoch = int(time.time())
-                    nowDT = datetime.datetime.fromtimestamp(nowEpoch)
-                    self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+                nowEpoch = int(time.time())
+                nowDT = datetime.datetime.fromtimestamp(nowEpoch)
+                self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
 
-                nodes = self.poly.getNodes()
                 currentPanelBreakerPrefix = "s" + self.address.replace('panelbreaker_','') + "_breaker_"
                 LOGGER.debug("\n\tWill be looking for Breaker nodes with this as the prefix: '" + currentPanelBreakerPrefix + "'.\n")
                 recreateBreakers = False
@@ -388,35 +389,49 @@ class PanelNodeForBreakers(udi_interface.Node):
                 breakerCount = len(self.childBreakerNodes)
                 #we want 32 entities; if we have too many, figure it out.
                 if breakerCount != 32 and self._fullyCreated:
-                    LOGGER.warning("\n\tBREAKER CHILD NODE TRACKING ERROR: Any Breaker Controller Node should be tracking exactly 32 child Breaker Nodes; as it stands right now, controller '" + self.address + "' is tracking " + str(breakerCount-1) + " child Breaker Nodes.\n")
+                    LOGGER.warning("\n\tBREAKER CHILD NODE TRACKING ERROR: Any Breaker Controller Node should be tracking exactly 32 child Breaker Nodes; as it stands right now, controller '" + self.address + "' is tracking " + str(breakerCount) + " child Breaker Nodes.\n")
 
                 if breakerCount == self.expectedNumberOfChildrenBreakers and self._initialized:
                     self._fullyCreated = True
                     self.allExpectedChildrenCreated = True
                 
-                for i in range(0,32):
-                    node = currentPanelBreakerPrefix + str(i+1)
-                    LOGGER.debug("\n\tUpdating " + node + " (which should be a Breaker node under this Breakers controller: " + self.address + ").\n")
-                    nowEpoch = int(time.time())
-                    nowDT = datetime.datetime.fromtimestamp(nowEpoch)
+                powerArrays = self.panelSnapshot.powerArrays
+                self.publishPhaseBalance(self.panelSnapshot)
+                # every breaker is published when the relay tier is due; otherwise only those whose power changed
+                breakersToPublish = None
+                if SPAN_scheduler.TIER_RELAY not in dueTiers:
+                    breakersToPublish = powerArrays.changedBreakerIDs(self.lastPublishedPowerArrays)
+
+                dateTimeString = nowDT.strftime("%m/%d/%Y %I:%M:%S %p")
+                adoptionTried = False
+                for breakerID in range(1,33):
+                    childBreakerNode = self.childBreakerNodes.byEntity(breakerID)
+                    if childBreakerNode is None and not(adoptionTried):
+                        # recovery, at most once per poll: pick up any Breaker node objects Polyglot has that we are not tracking
+                        adoptionTried = True
+                        LOGGER.warning("\n\tNo child Breaker node is tracked for breaker #" + str(breakerID) + " under this Breakers controller: " + self.address + "; looking for one among the nodes Polyglot knows of.\n")
+                        adopted = self.childBreakerNodes.adopt(self.poly.getNodes(), currentPanelBreakerPrefix)
+                        breakerCount = len(self.childBreakerNodes)
+                        LOGGER.warning("\n\t\tInitially there was an error handling the childBreakerNodes, but after adopting " + str(adopted) + " node(s) we have " + str(breakerCount) + " childBreakerNodes.\n")
+                        childBreakerNode = self.childBreakerNodes.byEntity(breakerID)
+                    if childBreakerNode is None:
+                        if len(problemChildren) > 0:
+                            problemChildren = problemChildren + ", "
+                        problemChildren = problemChildren + "breaker #" + str(breakerID)
+                        recreateBreakers = True
+                        continue
+                    if breakersToPublish is not None and breakerID not in breakersToPublish and childBreakerNode.branchRecord is not None:
+                        continue
+                    LOGGER.debug("\n\tUpdating " + childBreakerNode.address + " (which should be a Breaker node under this Breakers controller: " + self.address + ").\n")
                     try:
-                        #nodes[node].updateBreakerNode(self.allBreakersData, nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
-                        self.childBreakerNodes[i].updateBreakerNode(self.allBreakersData, nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+                        childBreakerNode.updateBreakerNode(self.panelSnapshot.branches.get(breakerID), dateTimeString, childPolltype, powerArrays.breakerWatts.get(breakerID))
                     except:
-                        LOGGER.warning("\n\tERROR When Attempting to Update " + node + " (which should be a Breaker node under this Breakers controller: " + self.address + ").\n")
-                        try:
-                            nodes = self.poly.getNodes()
-                            for node in nodes:
-                                if currentPanelBreakerPrefix in node:
-                                    self.childBreakerNodes.append(node)
-                            breakerCount = len(self.childBreakerNodes)
-                            LOGGER.warning("\n\t\tInitially there was an error handling the childBreakerNodes, but now we have " + breakerCount.string + " childBreakerNodes.\n")
-                        except:
-                            LOGGER.warning("\n\t\tERROR When Attempting to Set self.childBreakerNodes[" + i.string + "] to " + node + ".\n") 
-                            if len(problemChildren) > 0:
-                                problemChildren = problemChildren + ", "
-                            problemChildren = problemChildren + "'" + node + "'"
-                            recreateBreakers = True
+                        LOGGER.warning("\n\tERROR When Attempting to Update " + childBreakerNode.address + " (which should be a Breaker node under this Breakers controller: " + self.address + ").\n")
+                        if len(problemChildren) > 0:
+                            problemChildren = problemChildren + ", "
+                        problemChildren = problemChildren + "'" + childBreakerNode.address + "'"
+                        recreateBreakers = True
+                self.lastPublishedPowerArrays = powerArrays
                             
                 if recreateBreakers and self.allExpectedChildrenCreated:
                     LOGGER.warning("\n\tUnable to execute updateBreakerNode on (" + problemChildren + ") Breaker node(s) [" + nowDT.strftime("%m/%d/%Y %I:%M:%S %p") + "].\n\t\tIf this persists repeatedly across multiple shortPolls with the same node ID(s) and/or the list is not getting shorter each time, contact developer.")
@@ -435,29 +450,18 @@ class PanelNodeForBreakers(udi_interface.Node):
             
     '''
     Create the breaker nodes.
+    One inventory of the existing nodes is diffed against the 32 breaker positions, so only missing or renamed
+    nodes are added or renamed, and the node objects that already exist are reused (see SPAN_inventory.reconcileChildren).
     '''
     def createBreakers(self):
-        '''
-        # delete any existing nodes but only under this panel
-        currentPanelBreakerPrefix = "s" + self.address.replace('panelbreaker_','') + "_breaker_"
-        nodes = self.poly.getNodes()
-        for node in nodes:
-             if currentPanelBreakerPrefix in node:
-                LOGGER.debug("\n\tDeleting " + node + " when creating child Breaker nodes for " + self.address + ".\n")
-                self.poly.delNode(node)
-        '''
-        
-        allBreakersArray = self.allBreakersData.split(chr(34) + 'id' + chr(34) + ':')
         panelNumberPrefix = self.address
         panelNumberPrefix = panelNumberPrefix.replace('panelbreaker_','')
+        currentPanelBreakerPrefix = "s" + panelNumberPrefix + "_breaker_"
 
         LOGGER.debug("\n\tHere is where we'll be creating Breaker children nodes for " + self.address + ". It should be a total of 32 child nodes, each with an address starting with s" + panelNumberPrefix + "_breaker_...\n")
 
+        desired = []
         for i in range(1, 33):
-            LOGGER.debug("\n\tHere is the currentBreakersData:\n\t\t" + allBreakersArray[i] + "\n")
-            
-            current_IPaddress = self.ipAddress
-            current_BearerToken = self.token
             stringI = str(i)
             if i<10:
                 stringI = '0' + str(i)
@@ -471,197 +475,281 @@ class PanelNodeForBreakers(udi_interface.Node):
             title = title + str(i)
             title = getValidNodeName(title)
 
-            checkNodes = self.poly.getNodes()
-            if address not in checkNodes:
-                node = SPAN_breaker.BreakerNode(self.poly, self.address, address, title, current_IPaddress, current_BearerToken, i)                
-                self.childBreakerNodes.append(node)
+            desired.append((address, title, i))
 
-                node.setDriver('GPV', -1, True, True)
-            else:
-                try:
-                    node = self.childBreakerNodes[self.childBreakerNodes.index(address)]
-                except:
-                    #self.childBreakerNodes.append(checkNodes[address])
-                    #Documentation says: address, name, [node_def_]id, primary, and drivers are required 
-                    #  In reality, it looks like hint and private are also required
-                    node = fakeNode()
-                    node.address = address
-                    node.name = title
-                    node.id = self.poly.profileNum
-                    node.primary = self.address
-                    node.hint = ''
-                    node.private = ''
-                    node.drivers = [
-                                {'driver': 'ST', 'value': -1, 'uom': 73},
-                                {'driver': 'PULSCNT', 'value': -1, 'uom': 56},
-                                {'driver': 'CLIEMD', 'value': 0, 'uom': 25},
-                                {'driver': 'AWAKE', 'value': 0, 'uom': 25},
-                                {'driver': 'TIME', 'value': -1, 'uom': 56},
-                                {'driver': 'GV0', 'value': -1, 'uom': 56},
-                                {'driver': 'GV1', 'value': -1, 'uom': 56},
-                                {'driver': 'GV2', 'value': -1, 'uom': 56},
-                                {'driver': 'GV3', 'value': -1, 'uom': 56},
-                                {'driver': 'GV4', 'value': -1, 'uom': 56},
-                                {'driver': 'GPV', 'value': -1, 'uom': 56}
-                                ]
-            
-            try:
-                self.poly.addNode(node)
-                #node.wait_for_node_done()
-                node.setDriver('GPV', -1, True, True)
-            except:
-                LOGGER.warning("\n\tUnable to create child Breaker node '" + node + "' for '" + self.address + "' at this time.\n")
-            
-            LOGGER.debug('\n\tCreated a Breaker child node {} under Panel Breaker controller {}\n'.format(title, panelNumberPrefix))
+        children, summary = SPAN_inventory.reconcileChildren(self.poly, currentPanelBreakerPrefix, desired, self.makeBreakerNode)
+        self.childBreakerNodes.replace(children)
+        LOGGER.info("\n\tBREAKER child nodes of '" + self.address + "': " + summary + ".\n")
+
+    def makeBreakerNode(self, address, title, breakerID):
+        node = SPAN_breaker.BreakerNode(self.poly, self.address, address, title, self.ipAddress, self.token, breakerID)
+        node.setDriver('GPV', -1, True, True)
+        return node
 
     '''
-    This is how we update the allBreakersData variable
+    This is how we update self.panelSnapshot.
+    /api/v1/panel and /api/v1/circuits (plus /api/v1/status, when that tier is due) are requested at the same time and joined
+    into one PanelSnapshot before anything is published, so breaker, circuit and status values all come from the same instant.
+    dueTiers comes from self.scheduler; None means everything is due.
+    Returns False when the readings are identical to the last published ones (nothing was parsed or published),
+    None when the panel is down and was not contacted at all (see SPAN_health), otherwise True.
     '''
-    def updateAllBreakersData(self):
-        self.pollInProgress = True
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
-        payload = ''
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
+    def updateAllBreakersData(self, dueTiers=None):
+        if dueTiers is None:
+            dueTiers = set([SPAN_scheduler.TIER_POWER, SPAN_scheduler.TIER_RELAY, SPAN_scheduler.TIER_STATUS])
+        sisterPolltype = "shortPoll|poll passed from sister controller"
+        if SPAN_scheduler.TIER_RELAY not in dueTiers:
+            sisterPolltype = sisterPolltype + SPAN_scheduler.POWER_ONLY
 
         try:
-            spanConnection.request("GET", "/api/v1/panel", payload, headers)
-            panelResponse = spanConnection.getresponse()
-        
-            self.allBreakersData = panelResponse.read()
-            self.allBreakersData = self.allBreakersData.decode("utf-8")
-            LOGGER.debug("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' Panel Data: \n\t\t" + self.allBreakersData + "\n")
+            paths = ["/api/v1/panel", "/api/v1/circuits"]
+            if SPAN_scheduler.TIER_STATUS in dueTiers:
+                paths.append("/api/v1/status")
+            responses = self.panelHub.getMany(paths, deadlineSeconds=SPAN_hub.HUB_POLL_DEADLINE_SECONDS)
+
+            panelData = responses["/api/v1/panel"]
+            statusData = responses.get("/api/v1/status")
+            circuitsData = responses["/api/v1/circuits"]
+
+            if isinstance(statusData, Exception):
+                LOGGER.error("\n\tUPDATING PANEL STATUS for Panel Breaker Controller '" + self.address + "' (and its sister) had an ERROR: {}\n".format(statusData))
+                statusData = None
+                # try again next short poll rather than waiting for the next long poll
+                self.scheduler.request(SPAN_scheduler.TIER_STATUS)
+            circuitsStale = False
+            if isinstance(circuitsData, Exception):
+                LOGGER.error("\n\tUPDATE ALLCIRCUITSDATA: SPAN API GET request for Panel Breaker Controller '" + self.address + "' (on behalf of its sister) FAILED: {}\n".format(circuitsData))
+                circuitsData = None
+                lastGoodCircuits = self.panelHub.lastGood("/api/v1/circuits")
+                if lastGoodCircuits is not None:
+                    LOGGER.warning("\n\tUPDATE ALLCIRCUITSDATA for Panel Breaker Controller '" + self.address + "' is reusing the last good Circuits Data, from " + str(int(time.time() - lastGoodCircuits[0])) + " seconds ago.\n")
+                    circuitsData = lastGoodCircuits[1]
+                    circuitsStale = True
+            if isinstance(panelData, SPAN_health.PanelUnavailableError):
+                return None
+            if isinstance(panelData, Exception):
+                raise panelData
+
+            fingerprints = (SPAN_snapshot.fingerprintPayload(panelData), SPAN_snapshot.fingerprintPayload(circuitsData))
+            self.observePanelFingerprint(fingerprints[0])
+            # relay state / priority are only published when their tier is due, so a relay-tier poll is only skipped if
+            # the last relay-tier poll already published these very readings
+            duplicate = fingerprints == self.lastPublishedFingerprints
+            if SPAN_scheduler.TIER_RELAY in dueTiers:
+                duplicate = duplicate and fingerprints == self.lastRelayFingerprints
+            if duplicate and statusData is None and self.panelSnapshot.hasPanelData:
+                self.duplicateSnapshotsSkipped += 1
+                self.panelSnapshot.stale = False
+                LOGGER.debug("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "': the panel has not refreshed its readings since the last poll; skipping (" + str(self.duplicateSnapshotsSkipped) + " skipped so far).\n")
+                self.adaptPollInterval(self.panelSnapshot)
+                return False
+
+            LOGGER.debug("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' received " + str(len(panelData)) + " bytes of Panel Data.\n")
+
+            # decode each payload once (the raw payloads are not kept); the breaker children and the sister Circuits controller all read from this snapshot
+            panelSnapshot = SPAN_snapshot.PanelSnapshot(panelData=panelData, circuitsData=circuitsData, statusData=statusData)
+            panelSnapshot.circuitsStale = circuitsStale
             
-            if "branches" in self.allBreakersData:
-                feedthroughPowerW_tuple = self.allBreakersData.partition(chr(34) + "feedthroughPowerW" + chr(34) + ":")
-                feedthroughPowerW = feedthroughPowerW_tuple[2]
-                feedthroughPowerW_tuple = feedthroughPowerW.partition(",")
-                feedthroughPowerW = feedthroughPowerW_tuple[0]           
-                feedthroughPowerW = math.ceil(float(feedthroughPowerW)*100)/100
-    
-                instantGridPowerW_tuple = self.allBreakersData.partition(chr(34) + "instantGridPowerW" + chr(34) + ":")
-                instantGridPowerW = instantGridPowerW_tuple[2]
-                instantGridPowerW_tuple = instantGridPowerW.partition(",")
-                instantGridPowerW = instantGridPowerW_tuple[0]             
-                instantGridPowerW = math.ceil(float(instantGridPowerW)*100)/100
-    
+            if panelSnapshot.hasPanelData:
+                self.panelSnapshot = panelSnapshot
+                self.lastPublishedFingerprints = fingerprints
+                if SPAN_scheduler.TIER_RELAY in dueTiers:
+                    self.lastRelayFingerprints = fingerprints
+
+                # persist the topology (for the next warm start) and have the sister reconcile its nodes if it changed
+                if panelSnapshot.hasCircuitsData and not(circuitsStale) and self.topologyCache.update(panelSnapshot):
+                    LOGGER.info("\n\tTOPOLOGY of the panel @ " + self.ipAddress + " saved to '" + self.topologyCache.path + "'.\n")
+                    self.tabIndex = None
+                    try:
+                        self.sisterCircuitsController.topologyNeedsReconcile = True
+                    except:
+                        LOGGER.debug("\n\tTOPOLOGY change could not be passed to the sister Circuits controller of '" + self.address + "'.\n")
+                self.adaptPollInterval(panelSnapshot)
+
+                history = SPAN_history.getHistoryStore(self.ipAddress)
+                if history is not None:
+                    history.record(panelSnapshot)
+                archive = SPAN_archive.getPanelArchive(self.ipAddress)
+                if archive is not None:
+                    archive.record(panelSnapshot)
+
                 epoch = int(time.time())
                 nowDT = datetime.datetime.fromtimestamp(epoch)
     
-                #if it turns out we need to handle feedthroughPower separately, subtract it from the main
-                #tracking from SPAN app generally seems to track more closely with what's show there by doing this subtraction... Shrug?            
-                totalPower = round((instantGridPowerW-abs(feedthroughPowerW)),2)
-                #otherwise, use the main directly
-                #totalPower = (instantGridPowerW)
-    
                 try:
-                    self.sisterCircuitsController.updateCircuitControllerStatusValuesFromPanelQueryInBreakerController(totalPower, nowDT.strftime("%m/%d/%Y %I:%M:%S %p"), self.allBreakersData)
-                    LOGGER.info("\n\tUPDATE ALLBREAKERSDATA under '" + self.address + "' successfully found its sisterCircuitsController, and tried to update its allBreakersData as well as its total power ('ST') and 'TIME' Status elements.\n")
+                    self.sisterCircuitsController.updateCircuitControllerStatusValuesFromPanelQueryInBreakerController(self.panelSnapshot, nowDT.strftime("%m/%d/%Y %I:%M:%S %p"), sisterPolltype)
+                    LOGGER.info("\n\tUPDATE ALLBREAKERSDATA under '" + self.address + "' successfully found its sisterCircuitsController, and tried to update its circuits as well as its total power ('ST') and 'TIME' Status elements.\n")
                 except:
-                    LOGGER.error("\n\tUPDATE ALLBREAKERSDATA under '" + self.address + "' encountered an error when, with its sisterCircuitsController, it tried to update its allBreakersData as well as its total power ('ST') and 'TIME' Status elements.\n")
-            
-            if not(self.statusPollInProgress):
-                    self.updateDoorStatusEtc()
-        except http.client.HTTPException:
-            LOGGER.error("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' Panel Data had an HTTPException ERROR.\n")
+                    LOGGER.error("\n\tUPDATE ALLBREAKERSDATA under '" + self.address + "' encountered an error when, with its sisterCircuitsController, it tried to update its circuits as well as its total power ('ST') and 'TIME' Status elements.\n")
+            else:
+                # the panel answered, but its Panel Data could not be decoded: keep showing the last good snapshot, flagged as stale
+                LOGGER.error("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' received Panel Data that could not be decoded.\n")
+                self.panelSnapshot.stale = True
+
+            if panelSnapshot.hasStatusData:
+                self.updateDoorStatusEtc(panelSnapshot.status)
+        except http.client.HTTPException as e:
+            LOGGER.error("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' Panel Data had an HTTPException ERROR: {}\n".format(e))
+            # keep showing the last good snapshot, flagged as stale
+            self.panelSnapshot.stale = True
         except:
             LOGGER.error("\n\tUPDATE ALLBREAKERSDATA Panel Breaker Controller '" + self.address + "' Panel Data had an unknown ERROR.\n")
-        finally:
-            spanConnection.close()
+            self.panelSnapshot.stale = True
             
-        self.pollInProgress = False
-        
-    def updateDoorStatusEtc(self):
-        self.statusPollInProgress = True
-        
-        doorStatus = 0
-        unlockButtonPressesRemaining = -1
-        serialString = 'Unknown'
-        firmwareVersionString = 'Unknown'
-        uptimeString = 'Unknown'
-  
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
-        payload = ''
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
+        LOGGER.info("\n\tSPAN PANEL DATA HUB for '" + self.address + "' @ " + self.ipAddress + ": " + self.panelHub.statsString() + "; " + self.refreshCadence.statsString() + ", duplicate snapshots skipped=" + str(self.duplicateSnapshotsSkipped) + ".\n")
+        return True
+
+    '''
+    Feed every /api/v1/panel fingerprint we see (full or fast poll) to the refresh cadence estimator.
+    '''
+    def observePanelFingerprint(self, fingerprint):
+        with self.fingerprintLock:
+            changed = fingerprint != self.lastSeenPanelFingerprint
+            self.lastSeenPanelFingerprint = fingerprint
+        self.refreshCadence.observe(changed)
+
+    '''
+    Start (or re-time) the fast panel-total loop, independent of the PG3 shortPoll; 0 or less turns it off.
+    '''
+    def startFastPoll(self, intervalSeconds):
+        self.stopFastPoll()
+        if intervalSeconds <= 0:
+            return
+        self.fastPollTimer = SPAN_scheduler.FixedRateTimer('SPAN_fastPoll_' + self.address, intervalSeconds, self.pollPanelPower, self.refreshCadence.alignTick)
+        LOGGER.info("\n\tFAST POLL of the panel total for '" + self.address + "' @ " + self.ipAddress + " every " + str(self.fastPollTimer.intervalSeconds) + " seconds.\n")
+        self.fastPollTimer.start()
+
+    def stopFastPoll(self):
+        if self.fastPollTimer is not None:
+            self.fastPollTimer.stop()
+            self.fastPollTimer = None
+
+    '''
+    Start adaptive polling: the whole panel is polled by pollPanel(self, polltype) on our own timer, whose interval
+    follows the observed power volatility (see SPAN_scheduler.AdaptiveInterval), instead of on the PG3 shortPoll.
+    '''
+    def startAdaptivePoll(self, minSeconds, maxSeconds, thresholdW, pollPanel):
+        self.stopAdaptivePoll()
+        self.adaptiveInterval = SPAN_scheduler.AdaptiveInterval(minSeconds, maxSeconds, thresholdW)
+        self.adaptivePollTimer = SPAN_scheduler.FixedRateTimer('SPAN_adaptivePoll_' + self.address, self.adaptiveInterval.intervalSeconds, lambda: pollPanel(self, "shortPoll|adaptive poll"), self.refreshCadence.alignTick)
+        LOGGER.info("\n\tADAPTIVE POLL of '" + self.address + "' @ " + self.ipAddress + " between " + str(self.adaptiveInterval.minSeconds) + " and " + str(self.adaptiveInterval.maxSeconds) + " seconds, speeding up on changes over " + str(self.adaptiveInterval.thresholdW) + " W.\n")
+        self.setDriver('GV6', self.adaptiveInterval.intervalSeconds, True, True)
+        self.adaptivePollTimer.start()
+
+    def stopAdaptivePoll(self):
+        if self.adaptivePollTimer is not None:
+            self.adaptivePollTimer.stop()
+            self.adaptivePollTimer = None
+        if self.adaptiveInterval is not None:
+            self.adaptiveInterval = None
+            self.setDriver('GV6', 0, True, True)
+
+    '''
+    After each full poll in adaptive mode, re-time the adaptive poll and publish the interval now in effect ('GV6').
+    '''
+    def adaptPollInterval(self, panelSnapshot):
+        adaptiveInterval = self.adaptiveInterval
+        adaptivePollTimer = self.adaptivePollTimer
+        if adaptiveInterval is None or adaptivePollTimer is None:
+            return
+        previousSeconds = adaptiveInterval.intervalSeconds
+        intervalSeconds = adaptiveInterval.observe(panelSnapshot)
+        adaptivePollTimer.setInterval(intervalSeconds)
+        if intervalSeconds != previousSeconds:
+            LOGGER.debug("\n\tADAPTIVE POLL of '" + self.address + "' now every " + str(round(intervalSeconds,1)) + " seconds.\n")
+        self.setDriver('GV6', round(intervalSeconds,1), True, True)
 
+    '''
+    One tick of the fast loop: fetch /api/v1/panel and refresh only the panel total ('ST') here and on the sister Circuits controller.
+    Everything else is left to the regular short poll.
+    '''
+    def pollPanelPower(self):
+        if not(self._fullyCreated):
+            return
         try:
-            spanConnection.request("GET", "/api/v1/status", payload, headers)
-            statusResponse = spanConnection.getresponse()
+            panelData = self.panelHub.get("/api/v1/panel", self.fastPollTimer.intervalSeconds/2 if self.fastPollTimer is not None else None)
+        except SPAN_health.PanelUnavailableError:
+            return
+        fingerprint = SPAN_snapshot.fingerprintPayload(panelData)
+        self.observePanelFingerprint(fingerprint)
+        if fingerprint == self.lastFastPollFingerprint:
+            return
+        self.lastFastPollFingerprint = fingerprint
+        panelSnapshot = SPAN_snapshot.PanelSnapshot(panelData=panelData)
+        if not(panelSnapshot.hasPanelData):
+            return
+        with SPAN_drivers.UpdateCollector(self.poly):
+            self.setDriver('ST', panelSnapshot.totalPowerW, True, True)
+            try:
+                self.sisterCircuitsController.setDriver('ST', panelSnapshot.totalPowerW, True, True)
+            except:
+                LOGGER.debug("\n\tFAST POLL could not update 'ST' on the sister Circuits controller of '" + self.address + "'.\n")
+
+    '''
+    Publish the panel's health ('GV7': SPAN_health.HEALTH_*) here and on the sister Circuits controller.
+    '''
+    def publishPanelHealth(self):
+        state = self.panelHub.health.state
+        self.setDriver('GV7', state, True, True)
+        try:
+            self.sisterCircuitsController.setDriver('GV7', state, True, True)
+        except:
+            LOGGER.debug("\n\tPANEL HEALTH could not update 'GV7' on the sister Circuits controller of '" + self.address + "'.\n")
+
+    '''
+    L1 / L2 leg loads (GV8 / GV9), leg imbalance in % (GV10) and the largest difference between a circuit's reported power
+    and the sum of its tabs (GV11), on this controller and its sister, computed from the snapshot's power arrays and the
+    circuit <-> tab index (built once per topology). GV11 is left alone while the circuits data is an earlier poll's.
+    '''
+    def publishPhaseBalance(self, panelSnapshot):
+        if not(panelSnapshot.hasPanelData) or not(panelSnapshot.hasCircuitsData):
+            return
+        powerArrays = panelSnapshot.powerArrays
+        if self.tabIndex is None or not(self.tabIndex.matches(powerArrays)):
+            self.tabIndex = SPAN_arrays.TabIndex(panelSnapshot)
+            LOGGER.debug("\n\tPHASE BALANCE index of '" + self.address + "' built for " + str(len(self.tabIndex.circuitIDs)) + " circuits on " + str(len(self.tabIndex.tabCircuit)) + " tabs.\n")
+        balance = SPAN_arrays.computePhaseBalance(powerArrays, self.tabIndex)
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            # sorting the loads is only worth it when the line is actually logged
+            LOGGER.debug("\n\tPHASE BALANCE of '" + self.address + "': " + str(balance) + "; top circuit loads: " + str(powerArrays.topCircuitLoads()) + ".\n")
+
+        for controller in (self, self.sisterCircuitsController):
+            try:
+                controller.setDriver('GV8', balance.legL1W, True, True)
+                controller.setDriver('GV9', balance.legL2W, True, True)
+                controller.setDriver('GV10', balance.imbalancePercent, True, True)
+                if not(panelSnapshot.circuitsStale):
+                    controller.setDriver('GV11', balance.largestMismatchW, True, True)
+            except:
+                LOGGER.debug("\n\tPHASE BALANCE could not be published on '" + str(getattr(controller, 'address', controller)) + "'.\n")
+
+    def updateDoorStatusEtc(self, statusRecord):
+        LOGGER.warning("\n\tDOOR STATUS, ETC UPDATE for '" + self.address + "': doorStatus = " + str(statusRecord.doorStatus) + "; unlockButtonPressesRemaining = " + str(statusRecord.unlockButtonPressesRemaining) + "; serialString = " + statusRecord.serial + "; firmwareVersionString = " + statusRecord.firmwareVersion + "; uptimeString = " + statusRecord.uptimeString + ".\n")
+        self.setDriver('GV1', statusRecord.doorStatus, True, True)
+        self.setDriver('GV2', statusRecord.unlockButtonPressesRemaining, True, True)
+        self.pushTextToDriver('GV3', statusRecord.serial)
+        self.pushTextToDriver('GV4', statusRecord.firmwareVersion)
+        self.pushTextToDriver('GV5', statusRecord.uptimeString)
         
-            statusData = statusResponse.read()
-            statusData = statusData.decode("utf-8")
-            LOGGER.debug("\n\tUPDATING PANEL STATUS for Panel Breaker Controller '" + self.address + "' (and its sister). Status Data: \n\t\t" + statusData + "\n")
-            
-            if "doorState" in statusData:
-                doorState_tuple = statusData.partition(chr(34) + "doorState" + chr(34) + ":")
-                doorState = doorState_tuple[2]
-                doorState_tuple = doorState.partition(",")
-                doorState = doorState_tuple[0]
-                if "CLOSED" in doorState:
-                    doorStatus = 1
-                elif "OPEN" in doorState:
-                    doorStatus = 2
-            
-            if "AuthUnlock" in statusData:
-                authRemaining_tuple = statusData.partition(chr(34) + "remainingAuthUnlockButtonPresses" + chr(34) + ":")
-                authRemaining = authRemaining_tuple[2]
-                authRemaining_tuple = authRemaining.partition(",")
-                authRemaining = authRemaining_tuple[0]
-                if "3" in str(authRemaining):
-                    unlockButtonPressesRemaining = 3
-                elif "2" in str(authRemaining):
-                    unlockButtonPressesRemaining = 2
-                elif "1" in str(authRemaining):
-                    unlockButtonPressesRemaining = 1
-            
-            if "serial" in statusData:
-                serial_tuple = statusData.partition(chr(34) + "serial" + chr(34) + ":")
-                serial = serial_tuple[2]
-                serial_tuple = serial.partition(",")
-                serialString = serial_tuple[0].replace(chr(34),'')
-                
-            if "firmwareVersion" in statusData:
-                firmwareVersion_tuple = statusData.partition(chr(34) + "firmwareVersion" + chr(34) + ":")
-                firmwareVersion = firmwareVersion_tuple[2]
-                firmwareVersion_tuple = firmwareVersion.partition(",")
-                firmwareVersionString = firmwareVersion_tuple[0].replace(chr(34),'')
-            
-            if "uptime" in statusData:
-                uptime_tuple = statusData.partition(chr(34) + "uptime" + chr(34) + ":")
-                uptime = uptime_tuple[2]
-                uptime_tuple = uptime.partition(",")
-                uptime = int(uptime_tuple[0].replace('}',''))
-                (days, remainder) = divmod(uptime, 86400)
-                (hours, remainder) = divmod(remainder, 3600)
-                (minutes, seconds) = divmod(remainder, 60)
-                uptimeString = str(days) + " Days, " + str(hours) + " Hours, " + str(minutes) + " Minutes, " + str(seconds) + " Seconds"
-    
-            LOGGER.warning("\n\tDOOR STATUS, ETC UPDATE for '" + self.address + "': doorStatus = " + str(doorStatus) + "; unlockButtonPressesRemaining = " + str(unlockButtonPressesRemaining) + "; serialString = " + serialString + "; firmwareVersionString = " + firmwareVersionString + "; uptimeString = " + uptimeString + ".\n")
-            self.setDriver('GV1', doorStatus, True, True)
-            self.setDriver('GV2', unlockButtonPressesRemaining, True, True)
-            self.pushTextToDriver('GV3', serialString)
-            self.pushTextToDriver('GV4', firmwareVersionString)
-            self.pushTextToDriver('GV5', uptimeString)
-            
-            self.sisterCircuitsController.updateDoorStatusEtc(doorStatus, unlockButtonPressesRemaining, serialString, firmwareVersionString, uptimeString)
-        except http.client.HTTPException:
-            LOGGER.error("\n\tUPDATING PANEL STATUS for Panel Breaker Controller '" + self.address + "' (and its sister) had an HTTPException ERROR.\n")
+        try:
+            self.sisterCircuitsController.updateDoorStatusEtc(statusRecord.doorStatus, statusRecord.unlockButtonPressesRemaining, statusRecord.serial, statusRecord.firmwareVersion, statusRecord.uptimeString)
         except:
             LOGGER.error("\n\tUPDATING PANEL STATUS for Panel Breaker Controller '" + self.address + "' (and its sister) had an unknown ERROR.\n")
-        finally:
-            spanConnection.close()            
-          
-        self.statusPollInProgress = False
     
     '''
     STOP Received
     '''
     def stop(self):
         LOGGER.debug("\n\tSTOP RECEIVED: Panel Breaker Controller handler '" + self.address + "'.\n")
+        self.driverCache.freeze()
+        self.stopFastPoll()
+        self.stopAdaptivePoll()
         self.setDriver('ST', -1, True, True)
+        self.setDriver('GV7', -1, True, True)
+        self.setDriver('GV8', -1, True, True)
+        self.setDriver('GV9', -1, True, True)
+        self.setDriver('GV10', -1, True, True)
+        self.setDriver('GV11', -1, True, True)
         self.setDriver('FREQ', -1, True, True)
         self.setDriver('PULSCNT', 0, True, True)
         self.setDriver('GV0', 0, True, True)
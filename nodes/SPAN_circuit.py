@@ -8,6 +8,7 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
 import string
 import re
 
@@ -16,6 +17,8 @@ from typing import Optional, Any, TYPE_CHECKING
 
 import math,datetime,urllib.parse,http.client,base64
 
+from nodes import SPAN_snapshot, SPAN_hub, SPAN_isy, SPAN_drivers, SPAN_scheduler
+
 LOGGER = udi_interface.LOGGER
 ISY = udi_interface.ISY
 
@@ -55,9 +58,13 @@ class CircuitNode(udi_interface.Node):
         self._initialized: bool = False
 
         self._fullyCreated:bool = False
+
+        # what has already been reported to IoX, so unchanged values are not re-sent every poll; 'ST' (Watts) also honours the power deadband
+        self.driverCache = SPAN_drivers.DriverStateCache(('ST',))
         
         self.poly = polyglot
-        self.n_queue = []
+        # set once ADDNODEDONE has been handled for this node (see wait_for_node_done)
+        self.nodeCreated = threading.Event()
         self.parent = parent
 
         self.ISY = ISY(self.poly)
@@ -68,8 +75,10 @@ class CircuitNode(udi_interface.Node):
         self.token = bearerToken
         self.circuitIndex = spanCircuitIndex
         self.circuitID = spanCircuitID
-        self.allCircuitsData = ''
-        self.allBreakersData = ''
+        self.circuitRecord: Optional[SPAN_snapshot.CircuitRecord] = None
+        # 'ST' as handed over with the circuit record
+        self.powerW: Optional[float] = None
+        self.panelHub = SPAN_hub.getPanelDataHub(self.ipAddress, self.token)
         
         tokenLastTen = self.token[-10:]
         LOGGER.debug("\n\tINIT IP Address for circuit:" + self.ipAddress + "; Bearer Token (last 10 characters): " + tokenLastTen + "; Circuit ID: " + self.circuitID)
@@ -84,61 +93,51 @@ class CircuitNode(udi_interface.Node):
 
         
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
+    node_queue() and wait_for_node_done() create a simple way to wait
     for a node to be created.  The nodeAdd() API call is asynchronous and
     will return before the node is fully created. Using this, we can wait
+    (on a threading.Event, with an optional timeout; returns False if it ran out)
     until it is fully created before we try to use it.
     '''
     def node_queue(self, data):
         if self.address == data['address']:
             LOGGER.debug("\n\tWAIT FOR NODE CREATION: Fully Complete for Circuit " + self.address + "\n")
             
-            self.setDriver('ST', -1, True, True)
-            self.setDriver('PULSCNT', -1, True, True)
-            self.setDriver('CLIEMD', 0, True, True)
-            self.setDriver('AWAKE', 0, True, True)
-            self.setDriver('TIME', -1, True, True)
-            self.setDriver('GV0', -1, True, True)
-            self.setDriver('GV1', -1, True, True)
-            self.setDriver('GV2', -1, True, True)
-            self.setDriver('GV3', -1, True, True)
-            self.setDriver('GV4', -1, True, True)
-            
-            self.setDriver('GPV', -1, True, True)
-            
-            self.pushTextToDriver('GV0',self.circuitID)
-            self.pushTextToDriver('GVP',"NodeServer RUNNING")
-            
             self._fullyCreated = True
+            self.restoreDrivers()
             
-            self.n_queue.append(data['address'])
+            self.nodeCreated.set()
+
+    def wait_for_node_done(self, timeout: Optional[float]=None) -> bool:
+        return self.nodeCreated.wait(timeout)
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    '''
+    Called from both node_queue() and start() (they run on separate threads, in either order); once both have run,
+    the last known driver values are restored (SPAN_drivers.restoreNodeDrivers) instead of forcing every driver to -1.
+    Safe to run twice: the second pass finds nothing that differs.
+    '''
+    def restoreDrivers(self):
+        if self._initialized and self._fullyCreated:
+            SPAN_drivers.restoreNodeDrivers(self, self.driverCache)
         
     # called by the interface after the node data has been put in the Polyglot DB
     # and the node created/updated in the ISY
     def start(self):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
-        self.setDriver('GPV', -1, True, True)
-        self.setDriver('ST', -1, True, True)
-        self.setDriver('PULSCNT', -1, True, True)
-        self.setDriver('CLIEMD', 0, True, True)
-        self.setDriver('AWAKE', 0, True, True)
-        self.setDriver('TIME', -1, True, True)
-        self.setDriver('GV0', -1, True, True)
-        self.setDriver('GV1', -1, True, True)
-        self.setDriver('GV2', -1, True, True)
-        self.setDriver('GV3', -1, True, True)
-        self.setDriver('GV4', -1, True, True)
+        self.restoreDrivers()
     
     # overload the setDriver() of the parent class to short circuit if 
     # node not initialized
     def setDriver(self, driver: str, value: Any, report: bool=True, force: bool=False, uom: Optional[int]=None, text: Optional[str]=None):
         if self._initialized and self._fullyCreated:
+            if report and not(self.driverCache.shouldReport(driver, value, uom, text)):
+                return
+            collector = SPAN_drivers.activeCollector()
+            if report and collector is not None:
+                super().setDriver(driver, value, False, force, uom, text)
+                collector.addDriver(self, driver)
+                return
             super().setDriver(driver, value, report, force, uom, text)
             
     def delete(self, address):
@@ -159,6 +158,10 @@ class CircuitNode(udi_interface.Node):
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
             
+        if not(self.driverCache.shouldPushText(driver, stringToPublish)):
+            LOGGER.debug("\n\tPUSHING REPORT SKIPPED for '" + self.address + "' driver " + driver + ": text is unchanged.\n")
+            return
+
         currentValue = int(self.getDriver(driver))
         newValue = -1
         encodedStringToPublish = urllib.parse.quote(stringToPublish, safe='')
@@ -181,65 +184,33 @@ class CircuitNode(udi_interface.Node):
                     'text': stringToPublish
                 }]
             }
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
+            collector = SPAN_drivers.activeCollector()
+            if collector is not None:
+                collector.add(self.address, driver, newValue, 56, stringToPublish)
+            else:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
+                self.poly.send(message, 'status')
+            self.driverCache.rememberText(driver, newValue, stringToPublish)
         elif not(self.ISY.unauthorized):
-            message = {
-                'set': [{
-                    'address': self.address,
-                    'driver': driver,
-                    'value': newValue,
-                    'uom': 56,
-                    'text': encodedStringToPublish
-                }]
-            }
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-    
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 0:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + " with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-        
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-                
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                    
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()  
+            isyReporter = SPAN_isy.getIsyReporter(self.poly, self.ISY)
+            if isyReporter.isConfigured:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 (queued) via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
+                # remembered first: a publisher that fails fast calls forgetText, which has to find it
+                self.driverCache.rememberText(driver, newValue, stringToPublish)
+                isyReporter.enqueueText(self.address, driver, newValue, encodedStringToPublish, self.driverCache.forgetText)
         else:
             LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
     
     '''
     This is where the real work happens.  When the parent controller gets a shortPoll, do some work with the passed data. 
+    The parent controller has already decoded the circuits payload; we are only handed our own circuit record, and the Watts
+    to show, already rounded for the whole panel at once (SPAN_arrays.PanelPowerArrays.circuitWatts).
+    When the polltype carries SPAN_scheduler.POWER_ONLY, only the power ('ST') is refreshed, not the relay state or priority.
     '''
-    def updateCircuitNode(self, passedAllCircuitsData, dateTimeString, passedAllBreakersData):
+    def updateCircuitNode(self, passedCircuitRecord, dateTimeString, polltype='shortPoll', powerW=None):
         LOGGER.debug("\n\tUPDATE CIRCUIT NODE called for '" + self.address + "'.\n")
-        self.allCircuitsData = passedAllCircuitsData
-        self.allBreakersData = passedAllBreakersData
+        self.circuitRecord = passedCircuitRecord
+        self.powerW = powerW
         
         repopulateTheCircuitsBreakerStatusDrivers = False
         
@@ -254,91 +225,65 @@ class CircuitNode(udi_interface.Node):
             self.pushTextToDriver('GV0',self.circuitID)
             repopulateTheCircuitsBreakerStatusDrivers = True
         
-        if "name" in self.allCircuitsData:
+        if self.circuitRecord is not None:
             self.pushTextToDriver('TIME', dateTimeString)
 
         if repopulateTheCircuitsBreakerStatusDrivers:
-            designatedCircuitData_tuple = self.allCircuitsData.partition(chr(34) + self.circuitID + chr(34) + ':')
-            designatedCircuitData = designatedCircuitData_tuple[2]
-            designatedCircuitData_tuple = designatedCircuitData.partition('},')
-            designatedCircuitData = designatedCircuitData_tuple[0] + '}'
-    
-            LOGGER.debug("\n\tUPDATE CIRCUIT NODE proceeding to set the physical breaker details [count and location(s)] for '" + self.address + "'; will search for the details in:\n\t\t" + designatedCircuitData + "\n")
+            LOGGER.debug("\n\tUPDATE CIRCUIT NODE proceeding to set the physical breaker details [count and location(s)] for '" + self.address + "'; will search for the details in:\n\t\t" + str(self.circuitRecord) + "\n")
     
-            if "name" in designatedCircuitData:
-                designatedCircuitTabs_tuple = designatedCircuitData.partition(chr(34) + "tabs" + chr(34) + ":")
-                designatedCircuitTabs = designatedCircuitTabs_tuple[2]
-                designatedCircuitTabs_tuple = designatedCircuitTabs.partition("],")
-                designatedCircuitTabs = designatedCircuitTabs_tuple[0]
-              
-                LOGGER.debug("\n\tDesignated Circuit Data: \n\t\t" + designatedCircuitData + "\n\t\tCount of Circuit Breakers In Circuit: " + str(designatedCircuitTabs.count(',')+1) + "\n")
-    
-                designatedCircuitTabs = designatedCircuitTabs.replace('[',' ')
-                designatedCircuitTabsArray = designatedCircuitTabs.split(',')
+            if self.circuitRecord is not None:
+                designatedCircuitTabsArray = self.circuitRecord.tabs
                 designatedCircuitTabsCount = len(designatedCircuitTabsArray)
+              
+                LOGGER.debug("\n\tDesignated Circuit Data: \n\t\t" + str(self.circuitRecord) + "\n\t\tCount of Circuit Breakers In Circuit: " + str(designatedCircuitTabsCount) + "\n")
 
                 self.setDriver('PULSCNT',designatedCircuitTabsCount, True, True)
         
                 for i in range(0,designatedCircuitTabsCount):
-                    LOGGER.debug("\n\tIn Circuit " + self.circuitID + ", Tab # " + str(i) + " corresponds to breaker number:\n\t\t" + designatedCircuitTabsArray[i] + "\n")
-                    self.pushTextToDriver('GV' + str(i+1), designatedCircuitTabsArray[i].replace(' ',''))
+                    LOGGER.debug("\n\tIn Circuit " + self.circuitID + ", Tab # " + str(i) + " corresponds to breaker number:\n\t\t" + str(designatedCircuitTabsArray[i]) + "\n")
+                    self.pushTextToDriver('GV' + str(i+1), str(designatedCircuitTabsArray[i]))
                         
                 for i in range(designatedCircuitTabsCount+1,5):
                     self.pushTextToDriver('GV' + str(i), '--')
             else:
                 LOGGER.warning("\n\t\tERROR getting designatedCircuitData for circuit '" + self.address + "'.\n")
         
-        self.poll('shortPoll|passing from updateCircuitNode')
+        self.poll(polltype + '|passing from updateCircuitNode')
         
     def poll(self, polltype):
         LOGGER.debug("\n\tPOLL CIRCUIT NODE: " + polltype + " for '" + self.address + "'.\n")
         if 'shortPoll' in polltype:
             tokenLastTen = self.token[-10:]
             LOGGER.debug('\n\tPOLL About to parse {} Circuit node of {}, using token ending in {}'.format(self.circuitID,self.ipAddress,tokenLastTen))
-            designatedCircuitData_tuple = self.allCircuitsData.partition(chr(34) + self.circuitID + chr(34) + ':')
-            designatedCircuitData = designatedCircuitData_tuple[2]
-            designatedCircuitData_tuple = designatedCircuitData.partition('},')
-            designatedCircuitData = designatedCircuitData_tuple[0] + '}'
         
-            LOGGER.debug("\n\tPOLL Circuit Data: \n\t\t" + designatedCircuitData + "\n")
+            LOGGER.debug("\n\tPOLL Circuit Data: \n\t\t" + str(self.circuitRecord) + "\n")
         
-            if "name" in designatedCircuitData:
-                designatedCircuitStatus_tuple = designatedCircuitData.partition(chr(34) + "relayState" + chr(34) + ":")
-                designatedCircuitStatus = designatedCircuitStatus_tuple[2]
-                designatedCircuitStatus_tuple = designatedCircuitStatus.partition(',')
-                designatedCircuitStatus = designatedCircuitStatus_tuple[0]
-
-                designatedCircuitPriority_tuple = designatedCircuitData.partition(chr(34) + "priority" + chr(34) + ":")
-                designatedCircuitPriority = designatedCircuitPriority_tuple[2]
-                designatedCircuitPriority_tuple = designatedCircuitPriority.partition(',')
-                designatedCircuitPriority = designatedCircuitPriority_tuple[0]                    
-
-                designatedCircuitInstantPowerW_tuple = designatedCircuitData.partition(chr(34) + "instantPowerW" + chr(34) + ":")
-                designatedCircuitInstantPowerW = designatedCircuitInstantPowerW_tuple[2]
-                designatedCircuitInstantPowerW_tuple = designatedCircuitInstantPowerW.partition(',')
-                designatedCircuitInstantPowerW = designatedCircuitInstantPowerW_tuple[0]
-                designatedCircuitInstantPowerW = math.ceil(float(designatedCircuitInstantPowerW)*100)/100
+            if self.circuitRecord is not None:
+                designatedCircuitStatus = self.circuitRecord.relayState
+                designatedCircuitPriority = self.circuitRecord.priority
               
-                LOGGER.debug("\n\tPOLL about to evaluate Circuit Status (" + designatedCircuitStatus + ") and set CLIEMD appropriately.\n")
-                if "CLOSED" in designatedCircuitStatus:
-                  self.setDriver('CLIEMD', 2, True, True)
-                elif "OPEN" in designatedCircuitStatus:
-                  self.setDriver('CLIEMD', 1, True, True)
-                else:
-                  self.setDriver('CLIEMD', 0, True, True)
+                if SPAN_scheduler.POWER_ONLY not in polltype:
+                    LOGGER.debug("\n\tPOLL about to evaluate Circuit Status (" + designatedCircuitStatus + ") and set CLIEMD appropriately.\n")
+                    if "CLOSED" in designatedCircuitStatus:
+                      self.setDriver('CLIEMD', 2, True, True)
+                    elif "OPEN" in designatedCircuitStatus:
+                      self.setDriver('CLIEMD', 1, True, True)
+                    else:
+                      self.setDriver('CLIEMD', 0, True, True)
                     
-                LOGGER.debug("\n\tPOLL about to evaluate Circuit Priority (" + designatedCircuitPriority + ") and set MODE appropriately.\n")
-                if "MUST" in designatedCircuitPriority:
-                  self.setDriver('AWAKE', 3, True, True)
-                elif "NICE" in designatedCircuitPriority:
-                  self.setDriver('AWAKE', 2, True, True)
-                elif "NON_" in designatedCircuitPriority:
-                  self.setDriver('AWAKE', 1, True, True)
-                else:
-                  self.setDriver('AWAKE', 0, True, True)
+                    LOGGER.debug("\n\tPOLL about to evaluate Circuit Priority (" + designatedCircuitPriority + ") and set MODE appropriately.\n")
+                    if "MUST" in designatedCircuitPriority:
+                      self.setDriver('AWAKE', 3, True, True)
+                    elif "NICE" in designatedCircuitPriority:
+                      self.setDriver('AWAKE', 2, True, True)
+                    elif "NON_" in designatedCircuitPriority:
+                      self.setDriver('AWAKE', 1, True, True)
+                    else:
+                      self.setDriver('AWAKE', 0, True, True)
                 
-                LOGGER.debug("\n\tPOLL About to set ST to " + str(designatedCircuitInstantPowerW) + " for Circuit " + self.circuitID + ".\n")
-                self.setDriver('ST', round(abs(designatedCircuitInstantPowerW),2), True, True)
+                if self.powerW is not None:
+                    LOGGER.debug("\n\tPOLL About to set ST to " + str(self.powerW) + " for Circuit " + self.circuitID + ".\n")
+                    self.setDriver('ST', self.powerW, True, True)
 
             else:
                 LOGGER.warning("\n\tPOLL Issue getting data for circuit '" + self.circuitID + "'.\n")
@@ -349,11 +294,7 @@ class CircuitNode(udi_interface.Node):
         LOGGER.debug(f'\n\t{self.address} being set via cmd_update_circuit_status to commandDetails={commandDetails}\n')
         
         #{"relayStateIn": {"relayState":STATE}}
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
         payload = "{"+ chr(34) + "relayStateIn" + chr(34) + ":{" + chr(34) + "relayState" + chr(34) + ":" + chr(34) + "STATE" + chr(34) + "}}"
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
         
         value = commandDetails.get('value')
         
@@ -367,12 +308,9 @@ class CircuitNode(udi_interface.Node):
      
         LOGGER.debug("\n\tCOMMAND About to POST a Circuit Status update of '" + payload + "' to " + self.ipAddress + "/api/v1/circuits/" + self.circuitID + "\n")
 
+        updateCircuitData = ''
         try:
-            spanConnection.request("POST", "/api/v1/circuits/" + self.circuitID, payload, headers)
-            updateCircuitResponse = spanConnection.getresponse()
-
-            updateCircuitData = updateCircuitResponse.read()
-            updateCircuitData = updateCircuitData.decode("utf-8")
+            updateCircuitData = self.panelHub.post("/api/v1/circuits/" + self.circuitID, payload)
     
             LOGGER.warning("\n\tCOMMAND POST Update Circuit Status Data: \n\t\t" + format(updateCircuitData) + "\n")
         except:
@@ -381,18 +319,10 @@ class CircuitNode(udi_interface.Node):
         if "200" in updateCircuitData:
             self.setDriver('CLIEMD', int(value), True, True)
 
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
-        payload = ''
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
-        
         try:
-            spanConnection.request("GET", "/api/v1/circuits", payload, headers)
-            circuitsResponse = spanConnection.getresponse()
-            
-            self.allCircuitsData = circuitsResponse.read()
-            self.allCircuitsData = self.allCircuitsData.decode("utf-8")
+            circuitRecord = SPAN_snapshot.decodeCircuitRecord(self.panelHub.get("/api/v1/circuits"), self.circuitID)
+            if circuitRecord is not None:
+                self.circuitRecord = circuitRecord
         except:
             LOGGER.error("\n\tCOMMAND GET Circuit Status Data had an ERROR.\n")
 
@@ -400,11 +330,7 @@ class CircuitNode(udi_interface.Node):
         LOGGER.debug(f'\n\t{self.address} being set via cmd_update_circuit_priority to commandDetails={commandDetails}\n')
         
         #{"priorityIn": {"priority": PRIORITY}}
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
         payload = "{"+ chr(34) + "priorityIn" + chr(34) + ":{" + chr(34) + "priority" + chr(34) + ":" +chr(34) + "PRIORITY" + chr(34) + "}}"
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
 
         value = commandDetails.get('value')
 
@@ -420,12 +346,9 @@ class CircuitNode(udi_interface.Node):
     
         LOGGER.debug("\n\tCOMMAND About to POST a Circuit Status update of '" + payload + "' to " + self.ipAddress + "/api/v1/circuits/" + self.circuitID + "\n")
         
+        updateCircuitData = ''
         try:
-            spanConnection.request("POST", "/api/v1/circuits/" + self.circuitID, payload, headers)
-            updateCircuitResponse = spanConnection.getresponse()
-            
-            updateCircuitData = updateCircuitResponse.read()
-            updateCircuitData = updateCircuitData.decode("utf-8")
+            updateCircuitData = self.panelHub.post("/api/v1/circuits/" + self.circuitID, payload)
     
             LOGGER.warning("\n\tCOMMAND POST Update Circuit Priority Data: \n\t\t" + format(updateCircuitData) + "\n")
         except:
@@ -434,18 +357,10 @@ class CircuitNode(udi_interface.Node):
         if "200" in updateCircuitData:
             self.setDriver('AWAKE', int(value), True, True)
 
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
-        payload = ''
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
-        
         try:
-            spanConnection.request("GET", "/api/v1/circuits", payload, headers)
-            circuitsResponse = spanConnection.getresponse()
-
-            self.allCircuitsData = circuitsResponse.read()
-            self.allCircuitsData = self.allCircuitsData.decode("utf-8")
+            circuitRecord = SPAN_snapshot.decodeCircuitRecord(self.panelHub.get("/api/v1/circuits"), self.circuitID)
+            if circuitRecord is not None:
+                self.circuitRecord = circuitRecord
         except:
             LOGGER.error("\n\tCOMMAND GET Circuit Status Data had an ERROR.\n")
     '''
@@ -453,6 +368,7 @@ class CircuitNode(udi_interface.Node):
     '''
     def stop(self):
         LOGGER.warning("\n\tSTOP COMMAND received: Circuit Node '" + self.address + "'.\n")
+        self.driverCache.freeze()
         self.setDriver('ST', -1, True, True)
         self.setDriver('PULSCNT', -1, True, True)
         self.setDriver('CLIEMD', 0, True, True)
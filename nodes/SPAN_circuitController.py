@@ -8,10 +8,11 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
 import string
 import re
 
-from nodes import SPAN_circuit, SPAN_breakerController
+from nodes import SPAN_circuit, SPAN_breakerController, SPAN_snapshot, SPAN_hub, SPAN_isy, SPAN_drivers, SPAN_scheduler, SPAN_inventory, SPAN_topology
 
 # Standard Library
 from typing import Optional, Any, TYPE_CHECKING
@@ -88,6 +89,11 @@ class PanelNodeForCircuits(udi_interface.Node):
             {'driver': 'GV3', 'value': -1, 'uom': 25},
             {'driver': 'GV4', 'value': -1, 'uom': 25},
             {'driver': 'GV5', 'value': -1, 'uom': 25},
+            {'driver': 'GV7', 'value': -1, 'uom': 25},
+            {'driver': 'GV8', 'value': -1, 'uom': 73},
+            {'driver': 'GV9', 'value': -1, 'uom': 73},
+            {'driver': 'GV10', 'value': -1, 'uom': 51},
+            {'driver': 'GV11', 'value': -1, 'uom': 73},
             {'driver': 'GPV', 'value': -1, 'uom': 56}
             ]
 
@@ -99,12 +105,17 @@ class PanelNodeForCircuits(udi_interface.Node):
         self._initialized: bool = False
 
         self._fullyCreated: bool = False
+
+        # what has already been reported to IoX, so unchanged values are not re-sent every poll; 'ST' (Watts) also honours the power deadband
+        self.driverCache = SPAN_drivers.DriverStateCache(('ST',))
         
         self.poly = polyglot
-        self.n_queue = []
+        # set once ADDNODEDONE has been handled for this node (see wait_for_node_done)
+        self.nodeCreated = threading.Event()
         self.parent = parent
 
-        self.childCircuitNodes: SPAN_circuit.CircuitNode = []
+        # the child CircuitNodes, by address and by circuit ID, in panel order
+        self.childCircuitNodes = SPAN_inventory.ChildRegistry('circuitID')
         self.expectedNumberOfChildrenCircuits = 0
         self.allExpectedChildrenCreated: bool = False
         
@@ -119,9 +130,15 @@ class PanelNodeForCircuits(udi_interface.Node):
         tokenLastTen = self.token[-10:]
         LOGGER.debug("\n\tINIT Panel Circuit Controller's IP Address:" + self.ipAddress + "; Bearer Token (last 10 characters): " + tokenLastTen)
 
-        self.allBreakersData = ''
-        self.allCircuitsData = ''
-        self.pollInProgress: bool = False
+        self.panelHub = SPAN_hub.getPanelDataHub(self.ipAddress, self.token)
+        self.topologyCache = SPAN_topology.getTopologyCache(self.ipAddress)
+        # set when the child nodes were built from the topology cache (or the panel's topology changed),
+        # so the next live snapshot reconciles them
+        self.topologyNeedsReconcile: bool = False
+
+        self.circuitsSnapshot = SPAN_snapshot.PanelSnapshot()
+        # the power arrays (SPAN_arrays.PanelPowerArrays) of the last poll published to the circuit children
+        self.lastPublishedPowerArrays = None
         
         # subscribe to the events we want
         #polyglot.subscribe(polyglot.POLL, self.pollCircuitController)
@@ -131,9 +148,10 @@ class PanelNodeForCircuits(udi_interface.Node):
         polyglot.subscribe(polyglot.DELETE, self.delete)
 
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
+    node_queue() and wait_for_node_done() create a simple way to wait
     for a node to be created.  The nodeAdd() API call is asynchronous and
     will return before the node is fully created. Using this, we can wait
+    (on a threading.Event, with an optional timeout; returns False if it ran out)
     until it is fully created before we try to use it.
     '''
     def node_queue(self, data):
@@ -143,48 +161,57 @@ class PanelNodeForCircuits(udi_interface.Node):
             #lastOctet = lastOctet_array[len(lastOctet_array)-1]
             #self.setDriver('FREQ', lastOctet, True, True, None, self.ipAddress)
         
-            self.setDriver('ST', -1, True, True)
-            self.setDriver('FREQ', -1, True, True)
-            self.setDriver('PULSCNT', -1, True, True)
-            self.setDriver('CLIEMD', -1, True, True)
-            self.setDriver('TIME', -1, True, True)
-            self.setDriver('GV1', -1, True, True)
-            self.setDriver('GV2', -1, True, True)            
-
-            self.setDriver('GPV', -1, True, True)
-            
             self.pushTextToDriver('FREQ',self.ipAddress.replace('.','-'))
 
-            if not(self.pollInProgress): 
-                self.updateAllCircuitsData()
+            # warm start: build the node tree from the last known topology right away, and reconcile with the first live snapshot
+            cachedTopology = self.topologyCache.load()
+            if cachedTopology is not None and len(cachedTopology.circuits) > 0:
+                LOGGER.info("\n\tWARM START of Panel Circuits Controller '" + self.address + "' from the topology cache (" + str(len(cachedTopology.circuits)) + " circuits); will reconcile with the first live poll.\n")
+                self.expectedNumberOfChildrenCircuits = len(cachedTopology.circuits)
+                self.createCircuits(cachedTopology.circuits)
+                self.topologyNeedsReconcile = True
+                self._fullyCreated = True
+                self.restoreDrivers()
+                self.nodeCreated.set()
+                return
+
+            self.updateAllCircuitsData()
 
             try:
-                if "circuits" in self.allCircuitsData:
-                    LOGGER.debug("\n\tINIT Panel Circuit Controller's Circuits Data: \n\t\t" + self.allCircuitsData + "\n\t\tCount of circuits: " + str(self.allCircuitsData.count(chr(34) + 'id' + chr(34) + ':')) + "\n")
-                    self.expectedNumberOfChildrenCircuits = self.allCircuitsData.count(chr(34) + 'id' + chr(34) + ':')
+                if self.circuitsSnapshot.hasCircuitsData:
+                    LOGGER.debug("\n\tINIT Panel Circuit Controller's Circuits Data: \n\t\t" + str(list(self.circuitsSnapshot.circuits.values())) + "\n\t\tCount of circuits: " + str(len(self.circuitsSnapshot.circuits)) + "\n")
+                    self.expectedNumberOfChildrenCircuits = len(self.circuitsSnapshot.circuits)
                     self.setDriver('PULSCNT', self.expectedNumberOfChildrenCircuits, True, True)
                     self.setDriver('CLIEMD', 1, True, True)
                     
                     self.createCircuits()
                         
                     self._fullyCreated = True
-                    self.n_queue.append(data['address'])
+                    self.restoreDrivers()
+                    self.nodeCreated.set()
                 else:
                     LOGGER.warning("\n\tINIT Issue getting Circuits Data for Panel Circuits Controller '" + self.address + "' @ " + self.ipAddress + ".\n")
             except:
                     LOGGER.error("\n\tINIT Issue after returning from self.updateAllCircuitsData().\n")
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    def wait_for_node_done(self, timeout: Optional[float]=None) -> bool:
+        return self.nodeCreated.wait(timeout)
+
+    '''
+    Called from both node_queue() and start() (they run on separate threads, in either order); once both have run,
+    the last known driver values are restored (SPAN_drivers.restoreNodeDrivers) instead of forcing every driver to -1.
+    Safe to run twice: the second pass finds nothing that differs.
+    '''
+    def restoreDrivers(self):
+        if self._initialized and self._fullyCreated:
+            SPAN_drivers.restoreNodeDrivers(self, self.driverCache)
 
     # called by the interface after the node data has been put in the Polyglot DB
     # and the node created/updated in the ISY
     def start(self):
         # set the initlized flag to allow setDriver to work
         self._initialized = True
-        self.setDriver('GPV', -1, True, True)
+        self.restoreDrivers()
         
     def delete(self, address):
         if address == self.address:
@@ -196,6 +223,13 @@ class PanelNodeForCircuits(udi_interface.Node):
     # node not initialized
     def setDriver(self, driver: str, value: Any, report: bool=True, force: bool=False, uom: Optional[int]=None, text: Optional[str]=None):
         if self._initialized and self._fullyCreated:
+            if report and not(self.driverCache.shouldReport(driver, value, uom, text)):
+                return
+            collector = SPAN_drivers.activeCollector()
+            if report and collector is not None:
+                super().setDriver(driver, value, False, force, uom, text)
+                collector.addDriver(self, driver)
+                return
             super().setDriver(driver, value, report, force, uom, text)
 
     '''
@@ -211,6 +245,10 @@ class PanelNodeForCircuits(udi_interface.Node):
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
         
+        if not(self.driverCache.shouldPushText(driver, stringToPublish)):
+            LOGGER.debug("\n\tPUSHING REPORT SKIPPED for '" + self.address + "' driver " + driver + ": text is unchanged.\n")
+            return
+
         currentValue = int(self.getDriver(driver))
         newValue = -1
         encodedStringToPublish = urllib.parse.quote(stringToPublish, safe='')
@@ -233,61 +271,23 @@ class PanelNodeForCircuits(udi_interface.Node):
                     'text': stringToPublish
                 }]
             }
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
+            collector = SPAN_drivers.activeCollector()
+            if collector is not None:
+                collector.add(self.address, driver, newValue, 56, stringToPublish)
+            else:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
+                self.poly.send(message, 'status')
+            self.driverCache.rememberText(driver, newValue, stringToPublish)
         elif not(self.ISY.unauthorized):
-            message = {
-                'set': [{
-                    'address': self.address,
-                    'driver': driver,
-                    'value': newValue,
-                    'uom': 56,
-                    'text': encodedStringToPublish
-                }]
-            }
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-    
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 0:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-                    
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                    
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()  
+            isyReporter = SPAN_isy.getIsyReporter(self.poly, self.ISY)
+            if isyReporter.isConfigured:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 (queued) via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
+                # remembered first: a publisher that fails fast calls forgetText, which has to find it
+                self.driverCache.rememberText(driver, newValue, stringToPublish)
+                isyReporter.enqueueText(self.address, driver, newValue, encodedStringToPublish, self.driverCache.forgetText)
         else:
             LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
     
-    #def updateNode(self, passedAllCircuitsData, dateTimeString):
-    #    self.allCircuitsData = passedAllCircuitsData
-
     '''
     This is where the real work happens.  When we get a shortPoll, do some work.
     Note: the Circuit and Breaker controllers will query and then pass data to the child nodes of Circuits and Breakers, respectively, so that we don't async hammer the http connection of SPAN panels. 
@@ -312,16 +312,26 @@ class PanelNodeForCircuits(udi_interface.Node):
                 self.setDriver('CLIEMD', 1, True, True)
 
             if "-1" in str(self.getDriver('PULSCNT')):
-                self.setDriver('PULSCNT', self.allCircuitsData.count(chr(34) + 'id' + chr(34) + ':'), True, True)
+                self.setDriver('PULSCNT', len(self.circuitsSnapshot.circuits), True, True)
         
             tokenLastTen = self.token[-10:]
             LOGGER.debug("\n\tPOLL About to query Panel Circuits Controller '" + self.address + "' @ {}, using token ending in {}".format(self.ipAddress,tokenLastTen))
             
-            if not(self.pollInProgress):
+            if "|poll passed from sister controller" not in polltype:
                 self.updateAllCircuitsData()
             
-            if "circuits" in self.allCircuitsData:
+            if self.circuitsSnapshot.hasCircuitsData:
                 
+                if self.topologyNeedsReconcile and not(self.circuitsSnapshot.circuitsStale) and self._fullyCreated:
+                    LOGGER.info("\n\tRECONCILING the child Circuit nodes of '" + self.address + "' with the live panel topology.\n")
+                    self.topologyNeedsReconcile = False
+                    self.createCircuits()
+
+                runningMessage = "NodeServer RUNNING"
+                if self.circuitsSnapshot.circuitsStale:
+                    # /api/v1/circuits missed this poll's deadline; the Breakers controller handed us the last good payload
+                    runningMessage = "Circuits did not answer in time; showing earlier data"
+
                 nowEpoch = int(time.time())
                 nowDT = datetime.datetime.fromtimestamp(nowEpoch)
                 self.pushTextToDriver('TIME',nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
@@ -343,10 +353,7 @@ class PanelNodeForCircuits(udi_interface.Node):
                 
                 if circuitCount < 1 and self._fullyCreated and self.allExpectedChildrenCreated:
                     LOGGER.warning("\n\tERROR in Circuit Controller Child Count for '" + self.address + "'; attempting to recover by searching for nodes with the name '" + currentPanelCircuitPrefix + "'...\n")
-                    nodes = self.poly.getNodes()
-                    for node in nodes:
-                        if currentPanelCircuitPrefix in node:
-                            self.childCircuitNodes.append(node)
+                    self.childCircuitNodes.adopt(self.poly.getNodes(), currentPanelCircuitPrefix)
                     circuitCount = len(self.childCircuitNodes)
                     if circuitCount < 1:
                         LOGGER.warning("\n\t\tERROR in Circuit Controller Child Count PERSISTS: Even after seeing a 0 count of child circuit nodes, and attempting to update the list of child circuit nodes, under controller '" + self.address + "', the NodeServer is still unable to find any child circuit nodes.\n\t\tIf this persists repeatedly across multiple shortPolls, contact developer.")
@@ -354,49 +361,56 @@ class PanelNodeForCircuits(udi_interface.Node):
                         #self.createCircuits()
                     else:
                         LOGGER.warning("\n\t\tCORRECTED Circuit Controller Child Count ERROR - the Circuit Controller Child Count was 0, but now it is showing as " + str(circuitCount) + ".\n")
-                        self.pushTextToDriver('GPV',"NodeServer RUNNING")
+                        self.pushTextToDriver('GPV',runningMessage)
                 else:
-                    self.pushTextToDriver('GPV',"NodeServer RUNNING")
+                    self.pushTextToDriver('GPV',runningMessage)
                     
-                for i in range(0, circuitCount):
+                childPolltype = 'shortPoll'
+                if SPAN_scheduler.POWER_ONLY in polltype:
+                    childPolltype = childPolltype + SPAN_scheduler.POWER_ONLY
+
+                # every circuit is published when the relay tier is due; otherwise only those whose power changed (and nodes without a record yet)
+                powerArrays = self.circuitsSnapshot.powerArrays
+                circuitsToPublish = None
+                if SPAN_scheduler.POWER_ONLY in polltype:
+                    circuitsToPublish = powerArrays.changedCircuitIDs(self.lastPublishedPowerArrays)
+
+                dateTimeString = nowDT.strftime("%m/%d/%Y %I:%M:%S %p")
+                for childCircuitNode in self.childCircuitNodes:
+                    if circuitsToPublish is not None and childCircuitNode.circuitID not in circuitsToPublish and childCircuitNode.circuitRecord is not None:
+                        continue
                     try:
-                        self.childCircuitNodes[i].updateCircuitNode(self.allCircuitsData, nowDT.strftime("%m/%d/%Y %I:%M:%S %p"), self.allBreakersData)
-                        LOGGER.debug("\n\t\tPOLL SUCCESS in Circuits Controller '" + self.address + "' for '" + self.childCircuitNodes[i].address + "'.\n")
+                        childCircuitNode.updateCircuitNode(self.circuitsSnapshot.circuits.get(childCircuitNode.circuitID), dateTimeString, childPolltype, powerArrays.circuitWatts.get(childCircuitNode.circuitID))
+                        LOGGER.debug("\n\t\tPOLL SUCCESS in Circuits Controller '" + self.address + "' for '" + childCircuitNode.address + "'.\n")
                     except:
-                        LOGGER.warning("\n\tUPDATE CIRCUIT NODE error for '" + self.childCircuitNodes[i] + "'.\n")
+                        LOGGER.warning("\n\tUPDATE CIRCUIT NODE error for '" + childCircuitNode.address + "'.\n")
+                self.lastPublishedPowerArrays = powerArrays
                             
             else:
                 tokenLastTen = self.token[-10:]
                 LOGGER.warning("\n\tPOLL ERROR when querying Circuits Controller '" + self.address + "' @ IP address {}, using token {}.\n".format(self.ipAddress,tokenLastTen))
     
     '''
-    Create the circuit nodes.
-    TODO: Handle fewer circuit nodes by deleting (currently commented out)
+    Create the circuit nodes, from the current snapshot or from 'circuits' (e.g. SPAN_topology.TopologyCircuit objects from the cache).
+    One inventory of the existing nodes is diffed against the circuits in the panel payload: only new, renamed or
+    removed circuits cause a node to be added, renamed or deleted; existing node objects are reused, and pointed at a
+    different circuit ID if the panel reordered its circuits (see SPAN_inventory.reconcileChildren).
     '''
-    def createCircuits(self):
-        
-        # delete any existing nodes but only under this panel
-        currentPanelCircuitPrefix = "s" + self.address.replace('panelcircuit_','') + "_circuit_"
-        nodes = self.poly.getNodes()
-        for node in nodes.copy():
-             if currentPanelCircuitPrefix in node:
-                LOGGER.warning("\n\tDeleting " + node + " when creating child Circuit nodes for Panel Circuits controller at " + self.address + ".\n")
-                self.poly.delNode(node)
-
-        how_many = self.getDriver('PULSCNT')
-        
-        allCircuitsArray = self.allCircuitsData.split(chr(34) + 'id' + chr(34) + ':')
+    def createCircuits(self, circuits: Optional[list]=None):
+        if circuits is None:
+            circuits = list(self.circuitsSnapshot.circuits.values())
+        allCircuitsArray = circuits
         panelNumberPrefix = self.address
         panelNumberPrefix = panelNumberPrefix.replace('panelcircuit_','')
+        currentPanelCircuitPrefix = "s" + panelNumberPrefix + "_circuit_"
 
-        LOGGER.debug("\n\tHere is where we'll be creating Circuit children nodes for Panel Circuits controller " + self.address + ". It should be a total of " + str(how_many) + " child nodes, each with an address starting with s" + panelNumberPrefix + "_circuit_...\n")
+        LOGGER.debug("\n\tHere is where we'll be creating Circuit children nodes for Panel Circuits controller " + self.address + ". It should be a total of " + str(len(allCircuitsArray)) + " child nodes, each with an address starting with s" + panelNumberPrefix + "_circuit_...\n")
 
-        for i in range(1, int(how_many)+1):
-            LOGGER.debug("\n\tHere is the currentCircuitData:\n\t\t" + allCircuitsArray[i] + "\n")
-            self.pushTextToDriver('GPV',"Initiating Circuit #" + str(i))
+        desired = []
+        for i in range(1, len(allCircuitsArray)+1):
+            currentCircuitRecord = allCircuitsArray[i-1]
+            LOGGER.debug("\n\tHere is the currentCircuitData:\n\t\t" + str(currentCircuitRecord) + "\n")
             
-            current_IPaddress = self.ipAddress
-            current_BearerToken = self.token
             stringI=str(i)
             if i<10:
                 stringI = '0' + str(i)
@@ -404,84 +418,72 @@ class PanelNodeForCircuits(udi_interface.Node):
             address = 'S' + panelNumberPrefix + '_Circuit_' + stringI
             address = getValidNodeAddress(address)
             
-            current_circuitID_tuple = allCircuitsArray[i].partition(',')
-            current_circuitID = current_circuitID_tuple[0]
-            current_circuitID = current_circuitID.replace(chr(34),'')
-            
-            current_circuitName_tuple = allCircuitsArray[i].partition(chr(34) + 'name' + chr(34) + ':')
-            current_circuitName = current_circuitName_tuple[2]
-            current_circuitName_tuple = current_circuitName.partition(',')
-            current_circuitName = current_circuitName_tuple[0]
-            current_circuitName = current_circuitName.replace(chr(34),'')
-            
-            title = current_circuitName
+            title = currentCircuitRecord.name
             title = getValidNodeName(title)
 
-            checkNodes = self.poly.getNodes()
-            if address not in checkNodes:
-                node = SPAN_circuit.CircuitNode(self.poly, self.address, address, title, current_IPaddress, current_BearerToken, current_circuitID, i)
-                self.childCircuitNodes.append(node)
-                node.setDriver('GPV', -1, True, True)
-            else:
-                try:
-                    node = self.childCircuitNodes[self.childCircuitNodes.index(address)]
-                except:
-                    self.childCircuitNodes.append(checkNodes[address])
-                    node = self.childCircuitNodes[self.childCircuitNodes.index(address)]
-            
-            self.poly.addNode(node)
-            node.setDriver('GPV', -1, True, True)
-            #node.wait_for_node_done()
-            
-            LOGGER.debug('\n\tCreated a Circuit child node {} under Panel Circuit Controller {}\n'.format(title, panelNumberPrefix))
+            desired.append((address, title, (currentCircuitRecord.circuitID, i)))
+
+        self.pushTextToDriver('GPV',"Initiating " + str(len(desired)) + " Circuits")
+        children, summary = SPAN_inventory.reconcileChildren(self.poly, currentPanelCircuitPrefix, desired, self.makeCircuitNode, self.refreshCircuitNode)
+        self.childCircuitNodes.replace(children)
+        self.expectedNumberOfChildrenCircuits = len(desired)
+        LOGGER.info("\n\tCIRCUIT child nodes of '" + self.address + "': " + summary + ".\n")
         
         #self.pushTextToDriver('GPV',"NodeServer RUNNING")
 
+    def makeCircuitNode(self, address, title, circuitSpec):
+        (circuitID, circuitIndex) = circuitSpec
+        node = SPAN_circuit.CircuitNode(self.poly, self.address, address, title, self.ipAddress, self.token, circuitID, circuitIndex)
+        node.setDriver('GPV', -1, True, True)
+        return node
+
     '''
-    This is how we handle whenever our sister Breaker controller updates its allBreakersData variable
+    An existing circuit node now at a different position in the panel payload takes on the circuit that is there now.
     '''
-    def updateCircuitControllerStatusValuesFromPanelQueryInBreakerController(self, totalPowerPassed, dateTimeStringPassed, allBreakersDataPassed):
+    def refreshCircuitNode(self, node, circuitSpec):
+        (circuitID, circuitIndex) = circuitSpec
+        node.circuitIndex = circuitIndex
+        if node.circuitID != circuitID:
+            LOGGER.warning("\n\tCircuit node '" + node.address + "' now follows circuit " + circuitID + " (was " + node.circuitID + ").\n")
+            node.circuitID = circuitID
+            node.circuitRecord = None
+            node.pushTextToDriver('GV0', circuitID)
+
+    '''
+    This is how we handle whenever our sister Breaker controller swaps in a new panelSnapshot.
+    The sister has already fetched /api/v1/circuits alongside /api/v1/panel, so we use its snapshot instead of fetching again.
+    '''
+    def updateCircuitControllerStatusValuesFromPanelQueryInBreakerController(self, panelSnapshotPassed, dateTimeStringPassed, polltype="shortPoll|poll passed from sister controller"):
         LOGGER.info("\n\t Using Shared Data from sister Breaker Controller to update 'ST' and 'TIME' on '" + self.address + "'.\n")
-        self.setDriver('ST', totalPowerPassed, True, True)
+        self.setDriver('ST', panelSnapshotPassed.totalPowerW, True, True)
         self.pushTextToDriver('TIME', dateTimeStringPassed)
+
+        self.circuitsSnapshot = panelSnapshotPassed
         
-        self.allBreakersData = allBreakersDataPassed
-        
-        self.pollCircuitController("shortPoll|poll passed from sister controller")
+        self.pollCircuitController(polltype)
 
     '''
-    This is how we update the allCircuitsData variable
+    This is how we update self.circuitsSnapshot on our own (at creation, before the sister starts sharing its snapshots).
     '''
     def updateAllCircuitsData(self):
         if not(self._fullyCreated):
             LOGGER.warning("\n\tUPDATING ALLCIRCUITSDATA for '" + self.address + "' but noticed it wasn't set to _fullyCreated = True.\n")
             self._fullyCreated = True
             
-        self.pollInProgress = True
         LOGGER.debug("\n\tUPDATING ALLCIRCUITSDATA for '" + self.address + "'...\n")
         
-        spanConnection = http.client.HTTPConnection(self.ipAddress)
-        payload = ''
-        headers = {
-            "Authorization": "Bearer " + self.token
-        }
-
         try:
-            spanConnection.request("GET", "/api/v1/circuits", payload, headers)
-            circuitsResponse = spanConnection.getresponse()
+            circuitsData = self.panelHub.get("/api/v1/circuits")
 
-            self.allCircuitsData = circuitsResponse.read()
-            self.allCircuitsData = self.allCircuitsData.decode("utf-8")
+            # decode the payload once (the raw payload is not kept); each child Circuit node is handed only its own record
+            self.circuitsSnapshot = SPAN_snapshot.PanelSnapshot(circuitsData=circuitsData)
             
-            LOGGER.debug("\n\tUPDATE ALLCIRCUITSDATA: SPAN API GET request for Panel Circuits Controller '" + self.address + "' Circuits Data: \n\t\t " + self.allCircuitsData + "\n")
+            LOGGER.debug("\n\tUPDATE ALLCIRCUITSDATA: SPAN API GET request for Panel Circuits Controller '" + self.address + "' returned " + str(len(circuitsData)) + " bytes, " + str(len(self.circuitsSnapshot.circuits)) + " circuits.\n")
         except http.client.HTTPException:
             LOGGER.error("\n\tUPDATE ALLCIRCUITSDATA: SPAN API GET request for Panel Circuits Controller '" + self.address + "' Circuits Data FAILED.\n")
         except:
             LOGGER.error("\n\tUPDATE ALLCIRCUITSDATA: SPAN API GET request for Panel Circuits Controller '" + self.address + "' Circuits Data FAILED.\n")
-        finally:
-            spanConnection.close()  
         
-        self.pollInProgress = False
     
     def updateDoorStatusEtc(self, doorStatus, unlockButtonPressesRemaining, serialString, firmwareVersionString, uptimeString):
         self.setDriver('GV1', doorStatus, True, True)
@@ -495,6 +497,7 @@ class PanelNodeForCircuits(udi_interface.Node):
     '''
     def stop(self):
         LOGGER.debug("\n\tSTOP RECEIVED: Panel Circuit Controller handler '" + self.address + "'.\n")
+        self.driverCache.freeze()
         self.setDriver('ST', -1, True, True)
         self.setDriver('FREQ', -1, True, True)
         self.setDriver('PULSCNT', -1, True, True)
@@ -502,6 +505,11 @@ class PanelNodeForCircuits(udi_interface.Node):
         self.setDriver('TIME', -1, True, True)
         self.setDriver('GV1', -1, True, True)
         self.setDriver('GV2', -1, True, True)
+        self.setDriver('GV7', -1, True, True)
+        self.setDriver('GV8', -1, True, True)
+        self.setDriver('GV9', -1, True, True)
+        self.setDriver('GV10', -1, True, True)
+        self.setDriver('GV11', -1, True, True)
         #self.setDriver('GV3', -1, True, True)
         #self.setDriver('GV4', -1, True, True)
         self.pushTextToDriver('GV5','--')
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Keep-Alive HTTP Client
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import time
+
+# Standard Library
+from typing import Optional, Any
+
+import http.client
+
+LOGGER = udi_interface.LOGGER
+
+SPAN_CONNECT_TIMEOUT_SECONDS = 5.0
+SPAN_READ_TIMEOUT_SECONDS = 10.0
+SPAN_MAX_IDLE_CONNECTIONS = 4
+
+# per-path response times kept for the p95 estimate that times hedged requests (see SPAN_hub)
+LATENCY_HISTORY = 50
+LATENCY_MIN_SAMPLES = 10
+
+'''
+Base of the errors this NodeServer raises for a SPAN request (SpanRequestError, SPAN_health.PanelUnavailableError,
+SPAN_hub.PollDeadlineExceeded). Subclasses HTTPException so the existing 'except http.client.HTTPException' handlers still catch them.
+'''
+class SpanError(http.client.HTTPException):
+    pass
+
+'''
+Raised when the SPAN panel answers, but not with a 2xx status.
+'''
+class SpanRequestError(SpanError):
+    def __init__(self, path: str, status: int, body: str, method: str='GET'):
+        super().__init__(method + " " + path + " returned HTTP " + str(status))
+        self.path = path
+        self.method = method
+        self.status = status
+        self.body = body
+
+'''
+Errors that mean a kept-alive connection went stale between requests (the server closed it);
+a GET is retried once on a fresh connection. Other requests are only retried if the error came while sending the
+request; once it was sent, the panel may already have acted on it.
+'''
+STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, http.client.CannotSendRequest, http.client.ResponseNotReady, ConnectionResetError, BrokenPipeError, ConnectionAbortedError)
+IDEMPOTENT_METHODS = ('GET',)
+
+'''
+A small pool of keep-alive HTTPConnections to one host.
+Idle connections are reused most-recently-used first; stale ones are replaced transparently.
+'''
+class ConnectionPool(object):
+    def __init__(self, host: str, port: Optional[int]=None, maxIdle: int=SPAN_MAX_IDLE_CONNECTIONS, connectTimeout: float=SPAN_CONNECT_TIMEOUT_SECONDS, readTimeout: float=SPAN_READ_TIMEOUT_SECONDS):
+        self.host = host
+        self.port = port
+        self.maxIdle = maxIdle
+        self.connectTimeout = connectTimeout
+        self.readTimeout = readTimeout
+
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+
+        self.requestCount = 0
+        self.connectionsOpened = 0
+        self.connectionsReused = 0
+        self.staleReconnects = 0
+
+    def _acquire(self):
+        with self._lock:
+            if len(self._idle) > 0:
+                self.connectionsReused += 1
+                return self._idle.pop(), True
+            self.connectionsOpened += 1
+
+        # connect with the connect timeout, then switch the socket over to the read timeout
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.connectTimeout)
+        try:
+            connection.connect()
+            connection.sock.settimeout(self.readTimeout)
+        except:
+            connection.close()
+            raise
+        return connection, False
+
+    def _release(self, connection):
+        with self._lock:
+            if len(self._idle) < self.maxIdle:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    '''
+    Issue one request; returns (status, body bytes).
+    '''
+    def request(self, method: str, path: str, body: Any=None, headers: Optional[dict]=None):
+        with self._lock:
+            self.requestCount += 1
+
+        for attempt in range(0, 2):
+            connection, reused = self._acquire()
+            sent = False
+            try:
+                connection.request(method, path, body, headers or {})
+                sent = True
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS:
+                connection.close()
+                # once the request is out, only a GET may be repeated; a command could reach the panel twice
+                if reused and attempt == 0 and (method in IDEMPOTENT_METHODS or not(sent)):
+                    with self._lock:
+                        self.staleReconnects += 1
+                    LOGGER.debug("\n\tKEEP-ALIVE connection to " + self.host + " was stale; reconnecting for " + method + " " + path + ".\n")
+                    continue
+                raise
+            except:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self._release(connection)
+            return response.status, data
+
+    def close(self):
+        with self._lock:
+            while len(self._idle) > 0:
+                self._idle.pop().close()
+
+    @property
+    def reuseRatio(self) -> float:
+        total = self.connectionsOpened + self.connectionsReused
+        if total == 0:
+            return 0.0
+        return self.connectionsReused / total
+
+    def statsString(self) -> str:
+        return "requests=" + str(self.requestCount) + ", connections opened=" + str(self.connectionsOpened) + ", reused=" + str(self.connectionsReused) + " (" + str(round(self.reuseRatio*100)) + "%), stale reconnects=" + str(self.staleReconnects)
+
+'''
+Recent response times of successful requests, per path.
+'''
+class LatencyTracker(object):
+    def __init__(self, history: int=LATENCY_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._samples: dict = {}
+
+    def record(self, path: str, seconds: float):
+        with self._lock:
+            samples = self._samples.get(path)
+            if samples is None:
+                samples = collections.deque(maxlen=self.history)
+                self._samples[path] = samples
+            samples.append(seconds)
+
+    '''
+    The 95th percentile response time for a path, or None until LATENCY_MIN_SAMPLES have been seen.
+    '''
+    def p95(self, path: str) -> Optional[float]:
+        with self._lock:
+            samples = self._samples.get(path)
+            if samples is None or len(samples) < LATENCY_MIN_SAMPLES:
+                return None
+            ordered = sorted(samples)
+        return ordered[min(len(ordered)-1, int(len(ordered)*0.95))]
+
+    def statsString(self) -> str:
+        with self._lock:
+            paths = list(self._samples.keys())
+        parts = []
+        for path in paths:
+            p95 = self.p95(path)
+            if p95 is not None:
+                parts.append(path.replace("/api/v1/","") + " p95=" + str(int(p95*1000)) + " ms")
+        return ", ".join(parts)
+
+'''
+Shared, per-panel client for the SPAN REST API.
+Owned by the panel's PanelDataHub (see SPAN_hub), which every node of the panel goes through,
+so they all draw from one pool of keep-alive connections.
+'''
+class SpanClient(object):
+    def __init__(self, ipAddress: str, token: str):
+        self.ipAddress = ipAddress
+        self.token = token
+        self.pool = ConnectionPool(ipAddress)
+        self.latency = LatencyTracker()
+
+    def _headers(self) -> dict:
+        return {
+            "Authorization": "Bearer " + self.token,
+            "Connection": "keep-alive"
+        }
+
+    '''
+    GET a SPAN API path and return the decoded body; raises SpanRequestError for non-2xx responses.
+    '''
+    def get(self, path: str) -> str:
+        startTime = time.monotonic()
+        status, data = self.pool.request("GET", path, '', self._headers())
+        text = data.decode("utf-8")
+        if status < 200 or status >= 300:
+            raise SpanRequestError(path, status, text)
+        self.latency.record(path, time.monotonic() - startTime)
+        return text
+
+    '''
+    POST to a SPAN API path and return the decoded body; raises SpanRequestError for non-2xx responses.
+    '''
+    def post(self, path: str, payload: str) -> str:
+        status, data = self.pool.request("POST", path, payload, self._headers())
+        text = data.decode("utf-8")
+        if status < 200 or status >= 300:
+            raise SpanRequestError(path, status, text, "POST")
+        return text
+
+    def close(self):
+        self.pool.close()
+
+    def statsString(self) -> str:
+        latency = self.latency.statsString()
+        if len(latency) > 0:
+            latency = "; " + latency
+        return self.pool.statsString() + latency
+
+_spanClients: dict = {}
+_spanClientsLock = threading.Lock()
+
+'''
+Return the shared SpanClient for a panel, creating it the first time (or if the token changed).
+'''
+def getSpanClient(ipAddress: str, token: str) -> SpanClient:
+    with _spanClientsLock:
+        client = _spanClients.get(ipAddress)
+        if client is None or client.token != token:
+            if client is not None:
+                client.close()
+            client = SpanClient(ipAddress, token)
+            _spanClients[ipAddress] = client
+        return client
@@ -8,20 +8,29 @@ MIT License
 import udi_interface
 import sys
 import time
+import threading
 import string
 import re
 
 import urllib.parse,http.client,math,time,datetime,base64
+import concurrent.futures
 
 # Standard Library
 from typing import Optional, Any, TYPE_CHECKING
 
-from nodes import SPAN_breakerController,SPAN_circuitController
+from nodes import SPAN_breakerController,SPAN_circuitController,SPAN_isy,SPAN_drivers,SPAN_scheduler,SPAN_health,SPAN_history,SPAN_archive
 
 LOGGER = udi_interface.LOGGER
 Custom = udi_interface.Custom
 ISY = udi_interface.ISY
 
+# panels are short-polled in parallel by a bounded pool; a panel that has not finished
+# within the deadline is reported as timed out (and skipped next time if it is still running)
+PANEL_POLL_MAX_WORKERS = 4
+PANEL_POLL_DEADLINE_SECONDS = 25
+# how long to wait for each panel controller node to be created (the Breakers controller also fetches the panel and adds its breakers)
+NODE_CREATION_TIMEOUT_SECONDS = 60
+
 ### Note for setDriver from BobP:
 ### setDriver(driver, value, report=true, forceReport=false, uom=None, text=None)
 
@@ -71,9 +80,13 @@ class Controller(udi_interface.Node):
         self._initialized: bool = False
 
         self._fullyCreated: bool = False
+
+        # what has already been reported to IoX, so unchanged values are not re-sent every poll
+        self.driverCache = SPAN_drivers.DriverStateCache()
         
         self.poly = polyglot
-        self.n_queue = []
+        # set once ADDNODEDONE has been handled for this node (see wait_for_node_done)
+        self.nodeCreated = threading.Event()
 
         self.childrenRunning = 0
         
@@ -86,6 +99,9 @@ class Controller(udi_interface.Node):
         self.circuitControllers: SPAN_circuitController.PanelNodeForCircuits = []
         self.breakerControllers: SPAN_breakerController.PanelNodeForBreakers = []
 
+        self.pollExecutor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self.panelPollFutures = {}
+
         self.ISY = ISY(self.poly)
         self.parent = parent
 
@@ -113,15 +129,9 @@ class Controller(udi_interface.Node):
             nowEpoch = int(time.time())
             nowDT = datetime.datetime.fromtimestamp(nowEpoch)
 
-            how_many = len(self.breakerControllers)
             if self._fullyCreated:
-                for i in range(0,how_many):
-                    try:
-                        self.breakerControllers[i].pollBreakerController(polltype + "|poll passed to '" + self.breakerControllers[i].address + "' from root controller in FOR loop of its own poll")
-                    except:
-                        LOGGER.error("\n\tERROR Handling Breaker Controller #" + format(i) + ".\n")
-                    finally:
-                        self.pushTextToDriver('GPV',"Last Short Poll Date / Time: " + nowDT.strftime("%m/%d/%Y %I:%M:%S %p"))
+                pollSummary = self.pollAllPanels(polltype)
+                self.pushTextToDriver('GPV',"Last Short Poll Date / Time: " + nowDT.strftime("%m/%d/%Y %I:%M:%S %p") + " (" + pollSummary + ")")
 
             '''
             nodes = self.poly.getNodes()
@@ -135,13 +145,93 @@ class Controller(udi_interface.Node):
             self.setDriver('GV0', how_many, True, True)
             '''
 
+        elif 'longPoll' in polltype and not(self.pg3ParameterErrors):
+            # door state, unlock presses, serial, firmware and uptime rarely change; refresh them with the next short poll
+            for breakerController in self.breakerControllers:
+                breakerController.scheduler.request(SPAN_scheduler.TIER_STATUS)
+            LOGGER.debug("\n\tLONG POLL: panel status requested for the next short poll of " + str(len(self.breakerControllers)) + " panel(s).\n")
+            if SPAN_drivers.getDriverStateStore().save():
+                LOGGER.debug("\n\tLONG POLL: last known driver values saved (" + SPAN_drivers.getDriverStateStore().statsString() + ").\n")
+            for history in SPAN_history.historyStores():
+                LOGGER.info("\n\tLONG POLL: HISTORY of the panel @ " + history.ipAddress + ": " + history.statsString() + ".\n")
+            for archive in SPAN_archive.panelArchives():
+                archive.enforceRetention()
+                LOGGER.info("\n\tLONG POLL: HISTORY ARCHIVE of the panel @ " + archive.ipAddress + ": " + archive.statsString() + ".\n")
         elif self.pg3ParameterErrors:
             self.pushTextToDriver('GPV',"Please correct the NodeServer parameters in PG3(x)")
             
     '''
-    node_queue() and wait_for_node_event() create a simple way to wait
+    Fan the short poll out to every Breaker controller (each of which feeds its sister Circuits controller) in parallel,
+    so that the poll takes as long as the slowest panel rather than the sum of all panels.
+    Returns a short summary of the outcome.
+    '''
+    def pollAllPanels(self, polltype):
+        if self.pollExecutor is None:
+            self.pollExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=PANEL_POLL_MAX_WORKERS, thread_name_prefix='SPAN_panelPoll')
+
+        startTime = time.monotonic()
+        futures = {}
+        stillRunning = 0
+        adaptive = 0
+
+        how_many = len(self.breakerControllers)
+        for i in range(0,how_many):
+            breakerController = self.breakerControllers[i]
+            if breakerController.adaptivePollTimer is not None:
+                # polled on its own adaptive timer instead
+                adaptive += 1
+                continue
+            previousFuture = self.panelPollFutures.get(breakerController.address)
+            if previousFuture is not None and not(previousFuture.done()):
+                LOGGER.warning("\n\tSKIPPING short poll of Breaker Controller '" + breakerController.address + "' because its previous poll is still running.\n")
+                stillRunning += 1
+                continue
+            future = self.pollExecutor.submit(self.pollPanel, breakerController, polltype + "|poll passed to '" + breakerController.address + "' from root controller in its parallel poll")
+            self.panelPollFutures[breakerController.address] = future
+            futures[future] = breakerController.address
+
+        done, notDone = concurrent.futures.wait(futures, timeout=PANEL_POLL_DEADLINE_SECONDS)
+
+        succeeded = 0
+        failed = 0
+        for future in done:
+            if future.exception() is None:
+                succeeded += 1
+            else:
+                failed += 1
+                LOGGER.error("\n\tERROR Handling Breaker Controller '" + futures[future] + "': {}\n".format(future.exception()))
+        for future in notDone:
+            LOGGER.warning("\n\tBreaker Controller '" + futures[future] + "' did not finish its short poll within " + str(PANEL_POLL_DEADLINE_SECONDS) + " seconds.\n")
+
+        down = 0
+        for breakerController in self.breakerControllers:
+            if breakerController.panelHub.health.state == SPAN_health.HEALTH_DOWN:
+                down += 1
+
+        elapsedMS = int((time.monotonic() - startTime)*1000)
+        pollSummary = str(succeeded) + " of " + str(how_many) + " panels OK, " + str(failed) + " failed, " + str(len(notDone)) + " timed out, " + str(stillRunning) + " still running, " + str(adaptive) + " adaptive, " + str(down) + " down; " + str(elapsedMS) + " ms"
+        isyMetrics = SPAN_isy.isyMetricsString()
+        if len(isyMetrics) > 0:
+            isyMetrics = "; " + isyMetrics
+        LOGGER.info("\n\tSHORT POLL SUMMARY: " + pollSummary + "; " + SPAN_drivers.totalsString() + isyMetrics + ".\n")
+        return pollSummary
+
+    '''
+    Poll one panel (Breaker controller, its sister Circuits controller, and all of their children),
+    collecting every driver update into a few large status messages that are sent once the panel is done.
+    '''
+    def pollPanel(self, breakerController, polltype):
+        with SPAN_drivers.UpdateCollector(self.poly) as collector:
+            breakerController.pollBreakerController(polltype)
+        LOGGER.debug("\n\tPANEL '" + breakerController.address + "' published " + str(collector.entriesSent) + " driver update(s) in " + str(collector.messagesSent) + " status message(s).\n")
+        if breakerController.fastPollTimer is not None:
+            LOGGER.info("\n\tFAST POLL of '" + breakerController.address + "' " + breakerController.fastPollTimer.statsString() + ".\n")
+
+    '''
+    node_queue() and wait_for_node_done() create a simple way to wait
     for a node to be created.  The nodeAdd() API call is asynchronous and
     will return before the node is fully created. Using this, we can wait
+    (on a threading.Event, with an optional timeout; returns False if it ran out)
     until it is fully created before we try to use it.
     '''
     def node_queue(self, data):
@@ -154,12 +244,10 @@ class Controller(udi_interface.Node):
             
             self._fullyCreated = True
             
-            self.n_queue.append(data['address'])
+            self.nodeCreated.set()
 
-    def wait_for_node_done(self):
-        while len(self.n_queue) == 0:
-            time.sleep(0.1)
-        self.n_queue.pop()
+    def wait_for_node_done(self, timeout: Optional[float]=None) -> bool:
+        return self.nodeCreated.wait(timeout)
 
     '''
     Read the user entered custom parameters.  Here is where the user will
@@ -197,10 +285,18 @@ class Controller(udi_interface.Node):
                 ioxErroMessage = ioxErrorMessage + '; '
             ioxErrorMessage = ioxErrorMessage + 'MISSING Access_Tokens Parameter'
 
-        
+        # optional: Power_Deadband_W / Power_Deadband_Percent
+        SPAN_drivers.setPowerDeadband(self.readOptionalNumberParameter('Power_Deadband_W', 0), self.readOptionalNumberParameter('Power_Deadband_Percent', 0))
+        # optional: History_Memory_MB
+        SPAN_history.setHistoryMemoryMB(self.readOptionalNumberParameter('History_Memory_MB', SPAN_history.HISTORY_DEFAULT_MEMORY_MB))
+        # optional: History_Archive_Days / History_Archive_MB
+        SPAN_archive.setArchiveLimits(self.readOptionalNumberParameter('History_Archive_Days', SPAN_archive.ARCHIVE_DEFAULT_DAYS), self.readOptionalNumberParameter('History_Archive_MB', SPAN_archive.ARCHIVE_DEFAULT_MAX_MB))
+
         if validIP_Addresses and validAccess_Tokens:
             self.createPanelControllers()
-            self.poly.Notices.clear()
+            # only the IP_Addresses / Access_Tokens notices; those about the optional parameters above must stay
+            self.poly.Notices.delete('IP_Addresses')
+            self.poly.Notices.delete('Access_Tokens')
             self.pg3ParameterErrors = False
         else:
             if not(validIP_Addresses):
@@ -210,6 +306,23 @@ class Controller(udi_interface.Node):
             
             self.pushTextToDriver('GPV',ioxErrorMessage)
 
+    '''
+    Read an optional, non-negative numeric custom parameter; blank or missing means 'default'.
+    '''
+    def readOptionalNumberParameter(self, key, default):
+        value = self.Parameters[key]
+        if value is None or len(str(value).strip()) == 0:
+            return default
+        try:
+            number = float(value)
+            if number >= 0:
+                return number
+        except:
+            pass
+        LOGGER.warning("\n\tCONFIGURATION INVALID: '" + str(value) + "' is not a valid value for the " + key + " parameter; using " + str(default) + ".\n")
+        self.poly.Notices[key] = key + ' must be a number 0 or greater (using ' + str(default) + ').'
+        return default
+
     '''
     This is called when the node is added to the interface module. It is
     run in a separate thread.  This is only run once so you should do any
@@ -233,6 +346,13 @@ class Controller(udi_interface.Node):
     # node not initialized
     def setDriver(self, driver: str, value: Any, report: bool=True, force: bool=False, uom: Optional[int]=None, text: Optional[str]=None):
         if self._initialized and self._fullyCreated:
+            if report and not(self.driverCache.shouldReport(driver, value, uom, text)):
+                return
+            collector = SPAN_drivers.activeCollector()
+            if report and collector is not None:
+                super().setDriver(driver, value, False, force, uom, text)
+                collector.addDriver(self, driver)
+                return
             super().setDriver(driver, value, report, force, uom, text)    
     '''
     Handling for <text /> attribute.
@@ -247,6 +367,10 @@ class Controller(udi_interface.Node):
             LOGGER.warning("\n\tPUSHING REPORT ERROR - a (correct) Driver was not passed for '" + self.address + "' trying to update driver " + driver + ".\n")
             return
             
+        if not(self.driverCache.shouldPushText(driver, stringToPublish)):
+            LOGGER.debug("\n\tPUSHING REPORT SKIPPED for '" + self.address + "' driver " + driver + ": text is unchanged.\n")
+            return
+
         currentValue = int(self.getDriver(driver))
         newValue = -1
         encodedStringToPublish = urllib.parse.quote(stringToPublish, safe='')
@@ -269,59 +393,20 @@ class Controller(udi_interface.Node):
                     'text': stringToPublish
                 }]
             }
-            LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
-            self.poly.send(message, 'status')
+            collector = SPAN_drivers.activeCollector()
+            if collector is not None:
+                collector.add(self.address, driver, newValue, 56, stringToPublish)
+            else:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3x via self.poly.send('" + stringToPublish + "','status') with a value of '" + str(newValue) + "'.\n")
+                self.poly.send(message, 'status')
+            self.driverCache.rememberText(driver, newValue, stringToPublish)
         elif not(self.ISY.unauthorized):
-            message = {
-                'set': [{
-                    'address': self.address,
-                    'driver': driver,
-                    'value': newValue,
-                    'uom': 56,
-                    'text': encodedStringToPublish
-                }]
-            }
-            userpassword = self.ISY._isy_user + ":" + self.ISY._isy_pass
-            userpasswordAsBytes = userpassword.encode("ascii")
-            userpasswordAsBase64Bytes = base64.b64encode(userpasswordAsBytes)
-            userpasswordAsBase64String = userpasswordAsBase64Bytes.decode("ascii")
-
-            if len(self.ISY._isy_ip) > 0 and len(userpasswordAsBase64String) > 3:
-                localConnection = http.client.HTTPConnection(self.ISY._isy_ip, self.ISY._isy_port)
-                payload = ''
-                headers = {
-                    "Authorization": "Basic " + userpasswordAsBase64String
-                }
-                
-                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
-        
-                prefixN = str(self.poly.profileNum)
-                if len(prefixN) < 2:
-                    prefixN = 'n00' + prefixN + '_'
-                elif len(prefixN) < 3:
-                    prefixN = 'n0' + prefixN + '_'
-                
-                suffixURL = '/rest/ns/' + str(self.poly.profileNum) + '/nodes/' + prefixN + self.address + '/report/status/' + driver + '/' + str(newValue) + '/56/text/' + encodedStringToPublish
-                
-                LOGGER.debug("\n\t\tPUSHING REPORT Details - this is the 'suffixURL':\n\t\t\t" + suffixURL + "\n")
-
-                try:
-                    localConnection.request("GET", suffixURL, payload, headers)
-                    localResponse = localConnection.getresponse()
-
-                    localResponseData = localResponse.read()
-                    localResponseData = localResponseData.decode("utf-8")
-                
-                    if '<status>200</status>' not in localResponseData:
-                        LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + localResponseData + "\n")
-                    else:
-                        LOGGER.debug("\n\t\tPUSHING REPORT on '" + self.address + "' for driver " + driver + ": RESPONSE from report:\n\t\t\t" + localResponseData + "\n")
-                except http.client.HTTPException:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                except:
-                    LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + " had an ERROR.\n")
-                finally:
-                    localConnection.close()  
+            isyReporter = SPAN_isy.getIsyReporter(self.poly, self.ISY)
+            if isyReporter.isConfigured:
+                LOGGER.debug("\n\tPUSHING REPORT TO '" + self.address + "' for driver " + driver + ", with PG3 (queued) via " + self.ISY._isy_ip + ":" + str(self.ISY._isy_port) + ", with a value of " + str(newValue) + ", and a text attribute (encoded) of '" + encodedStringToPublish + "'.\n")
+                # remembered first: a publisher that fails fast calls forgetText, which has to find it
+                self.driverCache.rememberText(driver, newValue, stringToPublish)
+                isyReporter.enqueueText(self.address, driver, newValue, encodedStringToPublish, self.driverCache.forgetText)
         else:
             LOGGER.warning("\n\t\PUSHING REPORT ERROR on '" + self.address + "' for driver " + driver + ": looks like this is a PG3 install but the ISY authorization state seems to currently be 'Unauthorized': 'True'.\n")
     
@@ -332,65 +417,122 @@ class Controller(udi_interface.Node):
         
         ipAddresses = self.Parameters['IP_Addresses']
         accessTokens = self.Parameters['Access_Tokens']
+        fastPollSeconds = self.Parameters['Fast_Poll_Seconds']
 
         listOfIPAddresses = ipAddresses.split(";")
         listOfBearerTokens = accessTokens.split(";")
+        listOfFastPollSeconds = []
+        if fastPollSeconds is not None:
+            listOfFastPollSeconds = str(fastPollSeconds).split(";")
+
+        # optional adaptive polling (all panels): on when both the minimum and the maximum interval are set
+        adaptivePollMinSeconds = self.readOptionalNumberParameter('Adaptive_Poll_Min_Seconds', 0)
+        adaptivePollMaxSeconds = self.readOptionalNumberParameter('Adaptive_Poll_Max_Seconds', 0)
+        adaptivePollThresholdW = self.readOptionalNumberParameter('Adaptive_Poll_Threshold_W', SPAN_scheduler.ADAPTIVE_DEFAULT_THRESHOLD_W)
+        adaptivePolling = adaptivePollMinSeconds > 0 and adaptivePollMaxSeconds > 0
         how_many = len(listOfIPAddresses)
 
         LOGGER.debug('\n\tCreating {} Panel nodes (which will be controllers for Circuit nodes)'.format(how_many))
-        for i in range(0, how_many):
-            self.pg3ParameterErrors = False
-            
-            current_IPaddress = listOfIPAddresses[i]
-            current_BearerToken = listOfBearerTokens[i]
-            
-            addressCircuits = 'PanelCircuit_{}'.format(i+1)
-            addressCircuits = getValidNodeAddress(addressCircuits)
-            titleCircuits = 'SPAN Panel #{} - Circuits'.format(i+1)
-            titleCircuits = getValidNodeName(titleCircuits)
-            
-            addressBreakers = 'PanelBreaker_{}'.format(i+1)
-            addressBreakers = getValidNodeAddress(addressBreakers)
-            titleBreakers = 'SPAN Panel #{} - Breakers'.format(i+1)
-            titleBreakers = getValidNodeName(titleBreakers)
+        startTime = time.monotonic()
+        # each panel's two controllers are created one after the other (the Breakers controller needs its sister),
+        # but all panels at the same time
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(how_many, PANEL_POLL_MAX_WORKERS)), thread_name_prefix='SPAN_panelCreate') as creationExecutor:
+            futures = []
+            for i in range(0, how_many):
+                self.pg3ParameterErrors = False
+                currentFastPollSeconds = 0
+                if i < len(listOfFastPollSeconds):
+                    currentFastPollSeconds = listOfFastPollSeconds[i]
+                futures.append(creationExecutor.submit(self.createPanel, i, listOfIPAddresses[i], listOfBearerTokens[i], currentFastPollSeconds))
+            createdPanels = [future.result() for future in futures]
+
+        # keep the controllers in panel order
+        for (panelCircuitController, panelBreakerController, currentFastPollSeconds) in createdPanels:
+            if panelCircuitController is not None and panelCircuitController not in self.circuitControllers:
+                self.circuitControllers.append(panelCircuitController)
+            if panelBreakerController is None:
+                continue
+            if panelBreakerController not in self.breakerControllers:
+                self.breakerControllers.append(panelBreakerController)
+            panelBreakerController.startFastPoll(currentFastPollSeconds)
+
+            if adaptivePolling:
+                panelBreakerController.startAdaptivePoll(adaptivePollMinSeconds, adaptivePollMaxSeconds, adaptivePollThresholdW, self.pollPanel)
+            else:
+                panelBreakerController.stopAdaptivePoll()
+
+        LOGGER.info("\n\tCREATED " + str(how_many) + " panel(s) in " + str(int((time.monotonic() - startTime)*1000)) + " ms.\n")
+        
+        self.setDriver('GV0', how_many, True, True)
+        self.pushTextToDriver('GPV','NodeServer started; AWAITING first short poll')
+
+    '''
+    Create (or find) the Circuits and Breakers controllers of panel #i+1, waiting up to NODE_CREATION_TIMEOUT_SECONDS for each.
+    Runs on a worker thread, one per panel; returns (circuit controller, breaker controller, fast poll seconds), with None for a controller that could not be created.
+    '''
+    def createPanel(self, i, current_IPaddress, current_BearerToken, fastPollSeconds):
+        panelCircuitController = None
+        panelBreakerController = None
+
+        addressCircuits = 'PanelCircuit_{}'.format(i+1)
+        addressCircuits = getValidNodeAddress(addressCircuits)
+        titleCircuits = 'SPAN Panel #{} - Circuits'.format(i+1)
+        titleCircuits = getValidNodeName(titleCircuits)
+        
+        addressBreakers = 'PanelBreaker_{}'.format(i+1)
+        addressBreakers = getValidNodeAddress(addressBreakers)
+        titleBreakers = 'SPAN Panel #{} - Breakers'.format(i+1)
+        titleBreakers = getValidNodeName(titleBreakers)
+
+        currentFastPollSeconds = 0
+        if fastPollSeconds:
+            currentFastPollSeconds = self.parseFastPollSeconds(str(fastPollSeconds), titleBreakers)
+        
+        #self.pushTextToDriver('GPV','Traversing circuits in Circuit Controller #' + str(i+1))
+        try:
+            checkNodes = self.poly.getNodes()
+            if addressCircuits not in checkNodes:    
+                LOGGER.debug("\n\t\ADD circuitController = SPAN_circuitController.PanelNodeForCircuits(self.poly, " + addressCircuits + ", " + addressCircuits + ", " + titleCircuits + ", " + current_IPaddress + ", " + current_BearerToken + ")\n")
+                panelCircuitController = SPAN_circuitController.PanelNodeForCircuits(self.poly, addressCircuits, addressCircuits, titleCircuits, current_IPaddress, current_BearerToken)
+                self.poly.addNode(panelCircuitController)
+                if not(panelCircuitController.wait_for_node_done(NODE_CREATION_TIMEOUT_SECONDS)):
+                    LOGGER.warning("\n\tPanel Circuits Controller '" + addressCircuits + "' was not fully created within " + str(NODE_CREATION_TIMEOUT_SECONDS) + " seconds; carrying on without waiting for it.\n")
+            else:
+                panelCircuitController = checkNodes[addressCircuits]
             
-            #self.pushTextToDriver('GPV','Traversing circuits in Circuit Controller #' + str(i+1))
+            #self.pushTextToDriver('GPV','Traversing breakers in Breaker Controller #' + str(i+1))
             try:
-                checkNodes = self.poly.getNodes()
-                if addressCircuits not in checkNodes:    
-                    LOGGER.debug("\n\t\ADD circuitController = SPAN_circuitController.PanelNodeForCircuits(self.poly, " + addressCircuits + ", " + addressCircuits + ", " + titleCircuits + ", " + current_IPaddress + ", " + current_BearerToken + ")\n")
-                    panelCircuitController = SPAN_circuitController.PanelNodeForCircuits(self.poly, addressCircuits, addressCircuits, titleCircuits, current_IPaddress, current_BearerToken)
-                    self.poly.addNode(panelCircuitController)
-                    panelCircuitController.wait_for_node_done()
-                    self.circuitControllers.append(panelCircuitController)
+                if addressBreakers not in checkNodes:
+                    LOGGER.debug("\n\t\ADD breakerController = SPAN_breakerController.PanelNodeForBreakers(self.poly, " + addressBreakers + ", " + addressBreakers + ", " + titleBreakers + ", " + current_IPaddress + ", " + current_BearerToken + ")\n")
+                    panelBreakerController = SPAN_breakerController.PanelNodeForBreakers(self.poly, addressBreakers, addressBreakers, titleBreakers, current_IPaddress, current_BearerToken, panelCircuitController)
+                    self.poly.addNode(panelBreakerController)
+                    if not(panelBreakerController.wait_for_node_done(NODE_CREATION_TIMEOUT_SECONDS)):
+                        LOGGER.warning("\n\tPanel Breakers Controller '" + addressBreakers + "' was not fully created within " + str(NODE_CREATION_TIMEOUT_SECONDS) + " seconds (is the panel @ " + current_IPaddress + " reachable?); carrying on without waiting for it.\n")
                 else:
-                    try:
-                        panelCircuitController = self.circuitControllers[self.circuitControllers.index(addressCircuits)]
-                    except:
-                        self.circuitControllers.append(panelCircuitController)
-                        panelCircuitController = self.circuitControllers[self.circuitControllers.index(addressCircuits)]
-                
-                #self.pushTextToDriver('GPV','Traversing breakers in Breaker Controller #' + str(i+1))
-                try:
-                    if addressBreakers not in checkNodes:
-                        LOGGER.debug("\n\t\ADD breakerController = SPAN_breakerController.PanelNodeForBreakers(self.poly, " + addressBreakers + ", " + addressBreakers + ", " + titleBreakers + ", " + current_IPaddress + ", " + current_BearerToken + ")\n")
-                        panelBreakerController = SPAN_breakerController.PanelNodeForBreakers(self.poly, addressBreakers, addressBreakers, titleBreakers, current_IPaddress, current_BearerToken, panelCircuitController)
-                        self.poly.addNode(panelBreakerController)
-                        panelBreakerController.wait_for_node_done()
-                        self.breakerControllers.append(panelBreakerController)
-                    else:
-                        try:
-                            panelBreakerController = self.breakerControllers[self.breakerControllers.index(addressBreakers)]
-                        except:
-                            self.breakerControllers.append(panelBreakerController)
-                            panelBreakerController = self.breakerControllers[self.breakerControllers.index(addressBreakers)]
-                except:
-                    LOGGER.warning('Failed to create Panel Breakers Controller {}: {}'.format(titleBreakers))
+                    panelBreakerController = checkNodes[addressBreakers]
             except:
-                LOGGER.warning('Failed to create Panel Circuits Controller {}: {}'.format(titleCircuits))
-        
-        self.setDriver('GV0', how_many, True, True)
-        self.pushTextToDriver('GPV','NodeServer started; AWAITING first short poll')
+                LOGGER.warning('Failed to create Panel Breakers Controller {}'.format(titleBreakers))
+        except:
+            LOGGER.warning('Failed to create Panel Circuits Controller {}'.format(titleCircuits))
+
+        return (panelCircuitController, panelBreakerController, currentFastPollSeconds)
+
+    '''
+    One entry of the optional Fast_Poll_Seconds parameter: blank or 0 = off, otherwise at least 1 second.
+    '''
+    def parseFastPollSeconds(self, value, title):
+        value = value.strip()
+        if len(value) == 0:
+            return 0
+        try:
+            seconds = float(value)
+        except:
+            LOGGER.warning("\n\tCONFIGURATION INVALID: '" + value + "' is not a valid Fast_Poll_Seconds value for " + title + "; fast polling is off for that panel.\n")
+            return 0
+        if 0 < seconds < SPAN_scheduler.FAST_POLL_MINIMUM_SECONDS:
+            LOGGER.warning("\n\tCONFIGURATION: Fast_Poll_Seconds for " + title + " is below the " + str(SPAN_scheduler.FAST_POLL_MINIMUM_SECONDS) + " second minimum; using the minimum.\n")
+            seconds = SPAN_scheduler.FAST_POLL_MINIMUM_SECONDS
+        return seconds
 
     '''
     STOP Command Received
@@ -400,6 +542,10 @@ class Controller(udi_interface.Node):
         self.setDriver('ST', 0, True, True)
         self.pushTextToDriver('GPV','NodeServer STOPPED')
         self.setDriver('GPV', -1, True, True)
+
+        if self.pollExecutor is not None:
+            self.pollExecutor.shutdown(wait=False)
+            self.pollExecutor = None
         nodes = self.poly.getNodes()
         
         for node in nodes.copy():
@@ -415,6 +561,13 @@ class Controller(udi_interface.Node):
             LOGGER.warning("\n\t\tSTOP of '" + node + "' COMPLETE.\n")
             self.childrenRunning -= 1
                 
+        # every node has frozen its last known values by now; keep them for the next start
+        SPAN_drivers.getDriverStateStore().save()
+        SPAN_archive.closeArchives()
+
+        # let queued ISY text pushes (e.g. 'NodeServer STOPPED') go out before the link closes
+        SPAN_isy.closeIsyReporter()
+
         if self.childrenRunning:
             LOGGER.warning("\n\tFINAL STOP - all children controllers and nodes appear to be stopped, so we can now stop the polyglot link.\n")
             self.poly.stop()
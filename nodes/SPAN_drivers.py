@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Driver State Cache
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import json
+
+# Standard Library
+from typing import Optional, Any
+
+from nodes import SPAN_topology
+
+LOGGER = udi_interface.LOGGER
+
+# drivers that carry NodeServer messages rather than panel values; they are neither persisted nor restored
+UNPERSISTED_DRIVERS = ('GPV',)
+
+# relative to the NodeServer's working directory
+DRIVER_STATE_FILE = 'driverState.json'
+DRIVER_STATE_VERSION = 1
+
+# restored values from nodes that finish creation within this long of each other go out in the same status message(s)
+RESTORE_BATCH_SECONDS = 0.5
+
+# Power deadband, shared by every node (set from the optional Power_Deadband_W / Power_Deadband_Percent custom parameters).
+# A wattage change is only reported once it is larger than the absolute deadband AND larger than the percent deadband
+# (i.e. whichever band is wider wins); 0 for both means every change is reported.
+_powerDeadbandW = 0.0
+_powerDeadbandPercent = 0.0
+
+_totalsLock = threading.Lock()
+_totalSent = 0
+_totalSuppressed = 0
+
+def setPowerDeadband(deadbandW: float, deadbandPercent: float):
+    global _powerDeadbandW, _powerDeadbandPercent
+    _powerDeadbandW = max(0.0, float(deadbandW))
+    _powerDeadbandPercent = max(0.0, float(deadbandPercent))
+    LOGGER.info("\n\tPOWER DEADBAND set to " + str(_powerDeadbandW) + " W / " + str(_powerDeadbandPercent) + "%.\n")
+
+def _count(sent: int, suppressed: int):
+    global _totalSent, _totalSuppressed
+    with _totalsLock:
+        _totalSent += sent
+        _totalSuppressed += suppressed
+
+'''
+Running totals across every node: how many driver updates went to IoX and how many were suppressed as unchanged.
+'''
+def totalsString() -> str:
+    with _totalsLock:
+        sent = _totalSent
+        suppressed = _totalSuppressed
+    total = sent + suppressed
+    percent = 0 if total == 0 else round(suppressed*100/total)
+    return "driver updates sent=" + str(sent) + ", suppressed=" + str(suppressed) + " (" + str(percent) + "%)"
+
+'''
+True when 'value' is close enough to 'previous' (the last value actually reported) to be inside the power deadband.
+-1 is the 'unknown / error' marker and is never treated as close to anything.
+'''
+def withinPowerDeadband(previous: Any, value: Any) -> bool:
+    if _powerDeadbandW <= 0 and _powerDeadbandPercent <= 0:
+        return False
+    try:
+        previous = float(previous)
+        value = float(value)
+    except (ValueError, TypeError):
+        return False
+    if previous == -1 or value == -1:
+        return False
+    difference = abs(value - previous)
+    return difference <= _powerDeadbandW or difference <= abs(previous)*_powerDeadbandPercent/100
+
+'''
+Per-node record of what was last reported to IoX for each driver, so unchanged values are not re-sent every poll.
+Drivers listed in deadbandDrivers (the wattage 'ST' drivers) additionally ignore changes inside the power deadband.
+'''
+class DriverStateCache(object):
+    def __init__(self, deadbandDrivers: tuple=()):
+        self.deadbandDrivers = tuple(deadbandDrivers)
+        # driver -> (str(value), uom, text) last reported
+        self._reported: dict = {}
+        # driver -> text last pushed by pushTextToDriver
+        self._texts: dict = {}
+        # driver -> [value, uom, text] last reported with a real value (never -1), as persisted by the DriverStateStore
+        self._lastKnown: dict = {}
+        # set once the node is stopping, so its stop values (-1, 0, '--') are not remembered as 'last known'
+        self._frozen = False
+        self._lock = threading.Lock()
+
+        self.sentCount = 0
+        self.suppressedCount = 0
+
+    '''
+    Decide whether a setDriver() should go to IoX; remembers the value when it does.
+    '''
+    def shouldReport(self, driver: str, value: Any, uom: Optional[int]=None, text: Optional[str]=None) -> bool:
+        with self._lock:
+            current = (str(value), uom, text)
+            previous = self._reported.get(driver)
+            if previous is not None:
+                if previous == current:
+                    self._suppressed()
+                    return False
+                if driver in self.deadbandDrivers and previous[1:] == current[1:] and withinPowerDeadband(previous[0], value):
+                    self._suppressed()
+                    return False
+
+            self._reported[driver] = current
+            if str(value) == '-1':
+                # the text is cleared along with the value, so the next push of the same text has to go out again
+                self._texts.pop(driver, None)
+            elif not(self._frozen) and driver not in UNPERSISTED_DRIVERS:
+                self._lastKnown[driver] = [value, uom, text]
+            self._sent()
+            return True
+
+    '''
+    Decide whether pushTextToDriver() should push 'text'; it only needs to when the text differs from the last push.
+    '''
+    def shouldPushText(self, driver: str, text: str) -> bool:
+        with self._lock:
+            if self._texts.get(driver) == text:
+                self._suppressed()
+                return False
+            return True
+
+    '''
+    Record a text push (and the flipped 0 / 1 value that carried it).
+    '''
+    def rememberText(self, driver: str, value: Any, text: str):
+        with self._lock:
+            self._texts[driver] = text
+            self._reported[driver] = (str(value), None, None)
+            if not(self._frozen) and driver not in UNPERSISTED_DRIVERS:
+                self._lastKnown[driver] = [value, None, text]
+            self._sent()
+
+    '''
+    Forget a pushed text (e.g. the push failed), so the same text is pushed again next time.
+    '''
+    def forgetText(self, driver: str):
+        with self._lock:
+            self._texts.pop(driver, None)
+
+    def forget(self, driver: Optional[str]=None):
+        with self._lock:
+            if driver is None:
+                self._reported.clear()
+                self._texts.clear()
+            else:
+                self._reported.pop(driver, None)
+                self._texts.pop(driver, None)
+
+    '''
+    Stop remembering last known values (called first thing in a node's stop()).
+    '''
+    def freeze(self):
+        with self._lock:
+            self._frozen = True
+
+    '''
+    driver -> [value, uom, text] of the last real values reported, for the DriverStateStore.
+    '''
+    def lastKnownState(self) -> dict:
+        with self._lock:
+            return dict((driver, list(state)) for driver, state in self._lastKnown.items())
+
+    '''
+    Take a restored value as already reported; 'textKnown' says whether IoX is also known to show 'text'
+    (only then is a later push of the same text skipped).
+    Returns False, changing nothing, if the driver was already reported in this session (a poll got there first).
+    '''
+    def restore(self, driver: str, value: Any, uom: Optional[int], text: Optional[str], textKnown: bool) -> bool:
+        with self._lock:
+            if driver in self._reported:
+                return False
+            self._lastKnown[driver] = [value, uom, text]
+            if text is not None and uom is None:
+                # a pushTextToDriver() text: the value is only the 0 / 1 carrier
+                self._reported[driver] = (str(value), None, None)
+                if textKnown:
+                    self._texts[driver] = text
+            else:
+                self._reported[driver] = (str(value), uom, text)
+            return True
+
+    def _sent(self):
+        self.sentCount += 1
+        _count(1, 0)
+
+    def _suppressed(self):
+        self.suppressedCount += 1
+        _count(0, 1)
+
+    def statsString(self) -> str:
+        return "sent=" + str(self.sentCount) + ", suppressed=" + str(self.suppressedCount)
+
+# a Polyglot status message is split once its JSON would exceed this many bytes
+MAX_STATUS_MESSAGE_BYTES = 16384
+
+_collectorState = threading.local()
+
+'''
+The UpdateCollector gathering driver updates on the current thread, if any.
+'''
+def activeCollector():
+    return getattr(_collectorState, 'collector', None)
+
+'''
+Gathers every driver update made on this thread during one panel poll (breaker, circuit and controller nodes alike)
+and sends them as a few large {'set': [...]} status messages instead of one poly.send() per driver:
+
+    with SPAN_drivers.UpdateCollector(self.poly):
+        ...setDriver() / pushTextToDriver() calls...
+
+Later updates to the same address / driver replace earlier ones; everything is flushed when the block exits.
+'''
+class UpdateCollector(object):
+    def __init__(self, poly, maxMessageBytes: int=MAX_STATUS_MESSAGE_BYTES):
+        self.poly = poly
+        self.maxMessageBytes = maxMessageBytes
+        # (address, driver) -> entry of the 'set' array
+        self._entries: dict = {}
+        self._previous = None
+
+        self.messagesSent = 0
+        self.entriesSent = 0
+
+    def __enter__(self):
+        self._previous = activeCollector()
+        _collectorState.collector = self
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        _collectorState.collector = self._previous
+        self.flush()
+        return False
+
+    '''
+    Queue one entry of a 'set' status message.
+    '''
+    def add(self, address: str, driver: str, value: Any, uom: Optional[int], text: Optional[str]=None):
+        key = (address, driver)
+        self._entries.pop(key, None)
+        self._entries[key] = {
+            'address': address,
+            'driver': driver,
+            'value': value,
+            'uom': uom,
+            'text': text
+        }
+
+    '''
+    Queue a node's current value for a driver, the same way Node.reportDriver() would have sent it.
+    '''
+    def addDriver(self, node, driver: str):
+        for entry in node.drivers:
+            if entry['driver'] == driver:
+                self.add(node.address, driver, str(entry['value']), entry['uom'], entry.get('text'))
+                return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def flush(self):
+        if len(self._entries) == 0:
+            return
+        entries = list(self._entries.values())
+        self._entries = {}
+
+        batch = []
+        batchBytes = 0
+        for entry in entries:
+            entryBytes = len(json.dumps(entry)) + 2
+            if len(batch) > 0 and batchBytes + entryBytes > self.maxMessageBytes:
+                self._send(batch)
+                batch = []
+                batchBytes = 0
+            batch.append(entry)
+            batchBytes += entryBytes
+        self._send(batch)
+
+    def _send(self, batch: list):
+        try:
+            self.poly.send({'set': batch}, 'status')
+            self.messagesSent += 1
+            self.entriesSent += len(batch)
+            LOGGER.debug("\n\tSTATUS BATCH of " + str(len(batch)) + " driver update(s) sent to Polyglot.\n")
+        except:
+            LOGGER.error("\n\tSTATUS BATCH ERROR: unable to send " + str(len(batch)) + " driver update(s) to Polyglot.\n")
+
+'''
+The on-disk copy (DRIVER_STATE_FILE) of every node's last known driver values, so a restart can put them back
+instead of forcing every driver to -1 and waiting for the first poll.
+Nodes register their DriverStateCache when they are created; save() (the long poll and stop) writes the file
+atomically, and only when something changed. Entries of nodes not (yet) registered in this session are kept.
+'''
+class DriverStateStore(object):
+    def __init__(self, path: str=DRIVER_STATE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        # address -> driver -> [value, uom, text], as read from the file (None until first needed)
+        self._saved: Optional[dict] = None
+        # address -> DriverStateCache
+        self._caches: dict = {}
+        self._lastWritten: Optional[dict] = None
+
+        self.restoredNodes = 0
+        self.restoredDrivers = 0
+        self.sentDrivers = 0
+        self.writeCount = 0
+
+    def _load(self):
+        if self._saved is not None:
+            return
+        self._saved = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as stateFile:
+                data = json.load(stateFile)
+            if data.get('version') == DRIVER_STATE_VERSION:
+                self._saved = dict(data.get('nodes', {}))
+                self._lastWritten = dict(self._saved)
+        except FileNotFoundError:
+            pass
+        except:
+            LOGGER.warning("\n\tDRIVER STATE at '" + self.path + "' could not be read; starting without last known values.\n")
+
+    def register(self, address: str, cache: DriverStateCache):
+        with self._lock:
+            self._caches[address] = cache
+
+    '''
+    driver -> [value, uom, text] saved for a node; empty if there is nothing saved.
+    '''
+    def stateFor(self, address: str) -> dict:
+        with self._lock:
+            self._load()
+            return dict(self._saved.get(address, {}))
+
+    '''
+    Write the registered nodes' last known values out if they changed since the last write; returns True if written.
+    '''
+    def save(self) -> bool:
+        with self._lock:
+            self._load()
+            state = dict(self._saved)
+            for address, cache in self._caches.items():
+                lastKnown = cache.lastKnownState()
+                if len(lastKnown) > 0:
+                    state[address] = lastKnown
+            if state == self._lastWritten:
+                return False
+            try:
+                SPAN_topology.writeJsonAtomically(self.path, {'version': DRIVER_STATE_VERSION, 'nodes': state}, None)
+            except:
+                LOGGER.warning("\n\tDRIVER STATE could not be written to '" + self.path + "'.\n")
+                return False
+            self._saved = state
+            self._lastWritten = state
+            self.writeCount += 1
+            return True
+
+    def statsString(self) -> str:
+        return "restored nodes=" + str(self.restoredNodes) + ", restored drivers=" + str(self.restoredDrivers) + ", sent as changed=" + str(self.sentDrivers) + ", writes=" + str(self.writeCount)
+
+_driverStateStore: Optional[DriverStateStore] = None
+_driverStateStoreLock = threading.Lock()
+
+def getDriverStateStore() -> DriverStateStore:
+    global _driverStateStore
+    with _driverStateStoreLock:
+        if _driverStateStore is None:
+            _driverStateStore = DriverStateStore()
+        return _driverStateStore
+
+_restoreLock = threading.Lock()
+_restoreCollector: Optional[UpdateCollector] = None
+
+def _flushRestored():
+    global _restoreCollector
+    with _restoreLock:
+        collector = _restoreCollector
+        _restoreCollector = None
+    if collector is not None:
+        count = len(collector)
+        collector.flush()
+        LOGGER.info("\n\tDRIVER STATE: " + str(count) + " restored driver value(s) that differed from Polyglot sent in " + str(collector.messagesSent) + " status message(s).\n")
+
+def _queueRestored(poly, entries: list):
+    global _restoreCollector
+    with _restoreLock:
+        if _restoreCollector is None:
+            _restoreCollector = UpdateCollector(poly)
+            timer = threading.Timer(RESTORE_BATCH_SECONDS, _flushRestored)
+            timer.daemon = True
+            timer.start()
+        for (address, driver, value, uom, text) in entries:
+            _restoreCollector.add(address, driver, value, uom, text)
+
+'''
+Bring a node that has just been created (and started) back to its last known driver values:
+  - Polyglot has already loaded the values it holds for the node into node.drivers;
+  - every saved value not already reported by a poll is taken into the node's DriverStateCache as reported, so the first poll only sends real changes;
+  - only the saved values that differ from what Polyglot holds are sent, batched with those of every other node
+    restored within RESTORE_BATCH_SECONDS.
+Registers the node's cache with the DriverStateStore. Returns the number of driver values sent.
+'''
+def restoreNodeDrivers(node, cache: DriverStateCache) -> int:
+    store = getDriverStateStore()
+    store.register(node.address, cache)
+    saved = store.stateFor(node.address)
+    if len(saved) == 0:
+        return 0
+
+    isPG3x = 'isPG3x' in node.poly.pg3init and node.poly.pg3init['isPG3x'] is True
+    restored = 0
+    entries = []
+    for driver, state in saved.items():
+        if driver in UNPERSISTED_DRIVERS:
+            continue
+        try:
+            (value, uom, text) = state
+            held = node.getDriver(driver)
+        except:
+            continue
+        if held is None:
+            continue
+        # PG3 can only show a text through the ISY REST push, so there it is left to the next pushTextToDriver()
+        if not(cache.restore(driver, value, uom, text, isPG3x)):
+            continue
+        restored += 1
+        if str(held) == str(value):
+            continue
+        # update the local copy only; the value goes out with the batch below
+        udi_interface.Node.setDriver(node, driver, value, False, False, uom)
+        sendUom = uom
+        if sendUom is None:
+            for entry in node.drivers:
+                if entry['driver'] == driver:
+                    sendUom = entry['uom']
+        entries.append((node.address, driver, str(value), sendUom, text if isPG3x else None))
+
+    if restored == 0:
+        return 0
+    with store._lock:
+        store.restoredNodes += 1
+        store.restoredDrivers += restored
+        store.sentDrivers += len(entries)
+    if len(entries) > 0:
+        _queueRestored(node.poly, entries)
+    LOGGER.debug("\n\tDRIVER STATE restored " + str(restored) + " driver(s) of '" + node.address + "'; " + str(len(entries)) + " differed from Polyglot.\n")
+    return len(entries)
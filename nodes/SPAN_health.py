@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Per-Panel Health and Backoff
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import time
+import random
+
+# Standard Library
+from typing import Optional, Any
+
+from nodes import SPAN_client
+
+LOGGER = udi_interface.LOGGER
+
+# values of the panel controllers' health driver ('GV7', editor SPAN_PANELHEALTH)
+HEALTH_UNKNOWN = 0
+HEALTH_HEALTHY = 1
+HEALTH_DEGRADED = 2
+HEALTH_DOWN = 3
+
+HEALTH_NAMES = {
+    HEALTH_UNKNOWN: 'unknown',
+    HEALTH_HEALTHY: 'healthy',
+    HEALTH_DEGRADED: 'degraded',
+    HEALTH_DOWN: 'down'
+}
+
+# a full poll makes up to 3 requests at once, so this is about two failed polls in a row
+HEALTH_DOWN_AFTER_FAILURES = 6
+# successes needed to go from degraded back to healthy
+HEALTH_RECOVER_AFTER_SUCCESSES = 2
+HEALTH_BACKOFF_BASE_SECONDS = 15.0
+HEALTH_BACKOFF_MAX_SECONDS = 600.0
+
+'''
+Raised instead of contacting a panel that is down and still inside its backoff window.
+'''
+class PanelUnavailableError(SPAN_client.SpanError):
+    def __init__(self, ipAddress: str, retryInSeconds: float):
+        super().__init__("SPAN panel @ " + ipAddress + " is down; next attempt in " + str(round(retryInSeconds,1)) + " s")
+        self.ipAddress = ipAddress
+        self.retryInSeconds = retryInSeconds
+
+'''
+Health of one panel, fed by the outcome of every request its PanelDataHub actually sends:
+  - healthy:  the last requests succeeded;
+  - degraded: requests are failing (or the panel just came back from down), but we keep trying at the normal rate;
+  - down:     HEALTH_DOWN_AFTER_FAILURES failures in a row; requests are refused locally (PanelUnavailableError) except
+              for one probe per backoff window (a single request, or one whole PanelDataHub.getMany batch), and the window
+              doubles (with jitter) on every failed probe, up to HEALTH_BACKOFF_MAX_SECONDS.
+Only failures that say something about reaching the panel are recorded (see SPAN_hub.isRetryable); a 4xx answer is not one.
+'''
+class PanelHealth(object):
+    def __init__(self, ipAddress: str, downAfterFailures: int=HEALTH_DOWN_AFTER_FAILURES, backoffBaseSeconds: float=HEALTH_BACKOFF_BASE_SECONDS, backoffMaxSeconds: float=HEALTH_BACKOFF_MAX_SECONDS):
+        self.ipAddress = ipAddress
+        self.downAfterFailures = max(1, downAfterFailures)
+        self.backoffBaseSeconds = backoffBaseSeconds
+        self.backoffMaxSeconds = max(backoffBaseSeconds, backoffMaxSeconds)
+
+        self._lock = threading.Lock()
+        self.state = HEALTH_UNKNOWN
+        self.consecutiveFailures = 0
+        self.consecutiveSuccesses = 0
+        self.backoffSeconds = 0.0
+        self._nextAttemptTime = 0.0
+        # True while the probe let through by checkAvailable has not reported back; the failures of one probe (batch) back off once
+        self._probeOutstanding = False
+        self.failedProbes = 0
+        self.lastError: Optional[str] = None
+
+        self.refusedCount = 0
+        self.probeCount = 0
+        self.transitionCount = 0
+
+    @property
+    def stateName(self) -> str:
+        return HEALTH_NAMES.get(self.state, 'unknown')
+
+    def _setState(self, state: int):
+        if state == self.state:
+            return
+        previousName = self.stateName
+        self.state = state
+        self.transitionCount += 1
+        if state == HEALTH_DOWN:
+            LOGGER.warning("\n\tPANEL HEALTH @ " + self.ipAddress + ": " + previousName + " -> down after " + str(self.consecutiveFailures) + " failed request(s) (" + str(self.lastError) + "); backing off " + str(round(self.backoffSeconds,1)) + " s.\n")
+        else:
+            LOGGER.warning("\n\tPANEL HEALTH @ " + self.ipAddress + ": " + previousName + " -> " + self.stateName + ".\n")
+
+    '''
+    Called before sending a request (or a batch of them). While down, only one probe is let through per backoff window;
+    raises PanelUnavailableError for everything else.
+    '''
+    def checkAvailable(self):
+        with self._lock:
+            if self.state != HEALTH_DOWN:
+                return
+            now = time.monotonic()
+            if now < self._nextAttemptTime:
+                self.refusedCount += 1
+                raise PanelUnavailableError(self.ipAddress, self._nextAttemptTime - now)
+            # this request is the probe; hold everyone else off until it reports back (or the window passes again)
+            self.probeCount += 1
+            self._probeOutstanding = True
+            self._nextAttemptTime = now + self.backoffSeconds
+
+    def recordSuccess(self):
+        with self._lock:
+            self.consecutiveFailures = 0
+            self.consecutiveSuccesses += 1
+            self.backoffSeconds = 0.0
+            self._probeOutstanding = False
+            self.failedProbes = 0
+            if self.state == HEALTH_DOWN:
+                self._setState(HEALTH_DEGRADED)
+            elif self.state == HEALTH_UNKNOWN or self.consecutiveSuccesses >= HEALTH_RECOVER_AFTER_SUCCESSES:
+                self._setState(HEALTH_HEALTHY)
+
+    def recordFailure(self, error: Any=None):
+        with self._lock:
+            self.consecutiveSuccesses = 0
+            self.consecutiveFailures += 1
+            self.lastError = str(error)
+            if self.state == HEALTH_DOWN:
+                if not(self._probeOutstanding):
+                    # another request of a probe batch that has already backed off (or a POST while down)
+                    return
+                self._probeOutstanding = False
+                self.failedProbes += 1
+            elif self.consecutiveFailures < self.downAfterFailures:
+                self._setState(HEALTH_DEGRADED)
+                return
+            else:
+                self.failedProbes = 0
+            # exponential backoff with 'equal jitter': half the window is fixed, the other half random,
+            # so several panels (or restarts) that went down together do not keep probing in lockstep
+            exponent = min(self.failedProbes, 16)
+            window = min(self.backoffMaxSeconds, self.backoffBaseSeconds * (2 ** exponent))
+            self.backoffSeconds = window/2 + random.uniform(0, window/2)
+            self._nextAttemptTime = time.monotonic() + self.backoffSeconds
+            self._setState(HEALTH_DOWN)
+
+    def statsString(self) -> str:
+        stats = "health=" + self.stateName + ", consecutive failures=" + str(self.consecutiveFailures) + ", refused=" + str(self.refusedCount) + ", probes=" + str(self.probeCount)
+        if self.state == HEALTH_DOWN:
+            stats = stats + ", next probe in " + str(round(max(0.0, self._nextAttemptTime - time.monotonic()),1)) + " s"
+        return stats
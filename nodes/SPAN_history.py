@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - In-Memory Power History (Ring Buffers with Downsampling Tiers)
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import math
+import numpy
+
+# Standard Library
+from typing import Optional, Any
+
+LOGGER = udi_interface.LOGGER
+
+HISTORY_RAW = 'raw'
+HISTORY_MINUTE = '1min'
+HISTORY_QUARTER_HOUR = '15min'
+
+# (tier, bucket seconds (0 = every sample as polled), how far back the tier reaches in seconds), finest first
+HISTORY_TIERS = (
+    (HISTORY_RAW, 0, 3600),
+    (HISTORY_MINUTE, 60, 2*86400),
+    (HISTORY_QUARTER_HOUR, 900, 14*86400)
+)
+
+# raw samples closer together than this are dropped, which bounds the raw tier at 3600 rows for its hour; at slower
+# polling the ring holds more than an hour of samples, but reads only reach back the tier's hour
+RAW_MIN_SPACING_SECONDS = 1.0
+
+# default for the optional History_Memory_MB custom parameter (per panel); 0 turns the history off
+HISTORY_DEFAULT_MEMORY_MB = 8
+
+# one column per series: the panel total (what 'ST' shows), breakers 1-32, then up to 32 circuits
+PANEL_COLUMN = 0
+FIRST_BREAKER_COLUMN = 1
+MAX_BREAKER_SERIES = 32
+FIRST_CIRCUIT_COLUMN = FIRST_BREAKER_COLUMN + MAX_BREAKER_SERIES
+MAX_CIRCUIT_SERIES = 32
+HISTORY_COLUMNS = FIRST_CIRCUIT_COLUMN + MAX_CIRCUIT_SERIES
+
+'''
+A preallocated ring of rows: one timestamp and one float32 value per column each. Appending overwrites the oldest row
+once full, so memory use is fixed from the start; missing values are NaN.
+'''
+class RingBuffer(object):
+    __slots__ = ('capacity', 'timestamps', 'values', 'head', 'count')
+
+    def __init__(self, capacity: int, columns: int):
+        self.capacity = max(1, int(capacity))
+        self.timestamps = numpy.zeros(self.capacity, dtype=numpy.float64)
+        self.values = numpy.full((self.capacity, columns), numpy.nan, dtype=numpy.float32)
+        # the row the next append writes
+        self.head = 0
+        self.count = 0
+
+    def append(self, timestamp: float, row: numpy.ndarray):
+        self.timestamps[self.head] = timestamp
+        self.values[self.head] = row
+        self.head = (self.head + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    @property
+    def lastTimestamp(self) -> Optional[float]:
+        if self.count == 0:
+            return None
+        return float(self.timestamps[(self.head - 1) % self.capacity])
+
+    '''
+    Row indexes from oldest to newest.
+    '''
+    def order(self) -> numpy.ndarray:
+        if self.count < self.capacity:
+            return numpy.arange(self.count)
+        return (numpy.arange(self.capacity) + self.head) % self.capacity
+
+    '''
+    (timestamps, values) of one column from 'sinceTimestamp' on (everything if None), oldest first.
+    '''
+    def column(self, column: int, sinceTimestamp: Optional[float]=None) -> tuple:
+        rows = self.order()
+        if sinceTimestamp is not None:
+            rows = rows[numpy.searchsorted(self.timestamps[rows], sinceTimestamp, side='left'):]
+        return (self.timestamps[rows], self.values[rows, column])
+
+    def clearColumn(self, column: int):
+        self.values[:, column] = numpy.nan
+
+    @property
+    def nbytes(self) -> int:
+        return self.timestamps.nbytes + self.values.nbytes
+
+    @staticmethod
+    def bytesFor(capacity: int, columns: int) -> int:
+        return max(1, int(capacity)) * (8 + 4*columns)
+
+'''
+One downsampling tier: samples are averaged (and their largest magnitude kept) per bucket of 'bucketSeconds', and each
+bucket goes into the 'means' / 'peaks' rings, stamped with its start, once the first sample of the next bucket arrives.
+'''
+class RollupTier(object):
+    def __init__(self, bucketSeconds: int, capacity: int, columns: int):
+        self.bucketSeconds = bucketSeconds
+        self.means = RingBuffer(capacity, columns)
+        self.peaks = RingBuffer(capacity, columns)
+        self._bucketStart: Optional[float] = None
+        self._sum = numpy.zeros(columns, dtype=numpy.float64)
+        self._count = numpy.zeros(columns, dtype=numpy.int32)
+        self._peak = numpy.full(columns, numpy.nan, dtype=numpy.float32)
+
+    def add(self, timestamp: float, row: numpy.ndarray):
+        bucketStart = math.floor(timestamp / self.bucketSeconds) * self.bucketSeconds
+        if self._bucketStart is not None and bucketStart != self._bucketStart:
+            self._close()
+        self._bucketStart = bucketStart
+        present = ~numpy.isnan(row)
+        self._sum[present] += row[present]
+        self._count[present] += 1
+        self._peak = numpy.fmax(self._peak, numpy.abs(row))
+
+    def _close(self):
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            means = self._sum / self._count
+        self.means.append(self._bucketStart, means)
+        self.peaks.append(self._bucketStart, self._peak)
+        self._sum.fill(0)
+        self._count.fill(0)
+        self._peak.fill(numpy.nan)
+
+    def clearColumn(self, column: int):
+        self.means.clearColumn(column)
+        self.peaks.clearColumn(column)
+        self._sum[column] = 0
+        self._count[column] = 0
+        self._peak[column] = numpy.nan
+
+    @property
+    def nbytes(self) -> int:
+        return self.means.nbytes + self.peaks.nbytes + self._sum.nbytes + self._count.nbytes + self._peak.nbytes
+
+'''
+Which column each circuit's history is kept in (columns FIRST_CIRCUIT_COLUMN on), assigned the first time a circuit is seen.
+With 'onRecycle', the column of a circuit the panel no longer reports is handed to a new circuit once all
+MAX_CIRCUIT_SERIES columns are taken (onRecycle(column) clears its old values); without it, such circuits are not recorded.
+'''
+class SeriesColumns(object):
+    def __init__(self, ipAddress: str, onRecycle=None):
+        self.ipAddress = ipAddress
+        self.onRecycle = onRecycle
+        # circuit ID -> column
+        self.circuitColumns: dict = {}
+        # the circuit IDs last asked for, and their columns (-1 = not recorded) in that order
+        self._lastCircuitIDs: Optional[tuple] = None
+        self._lastColumns = numpy.zeros(0, dtype=numpy.int64)
+        self.untrackedCircuits = 0
+        # set whenever circuitColumns changes (for whoever persists it)
+        self.changed = False
+
+    def load(self, circuitColumns: dict):
+        self.circuitColumns = dict((str(circuitID), int(column)) for circuitID, column in circuitColumns.items() if FIRST_CIRCUIT_COLUMN <= int(column) < HISTORY_COLUMNS)
+        self._lastCircuitIDs = None
+        self.changed = False
+
+    def columnsFor(self, circuitIDs: tuple) -> numpy.ndarray:
+        if circuitIDs == self._lastCircuitIDs:
+            return self._lastColumns
+        current = set(circuitIDs)
+        columns = []
+        untracked = 0
+        for circuitID in circuitIDs:
+            column = self.circuitColumns.get(circuitID)
+            if column is None:
+                column = self._freeColumn(current)
+                if column is None:
+                    untracked += 1
+                    column = -1
+                else:
+                    self.circuitColumns[circuitID] = column
+                    self.changed = True
+            columns.append(column)
+        if untracked > 0 and untracked != self.untrackedCircuits:
+            LOGGER.warning("\n\tHISTORY for " + self.ipAddress + " keeps at most " + str(MAX_CIRCUIT_SERIES) + " circuits; " + str(untracked) + " circuit(s) are not recorded.\n")
+        self.untrackedCircuits = untracked
+        self._lastCircuitIDs = circuitIDs
+        self._lastColumns = numpy.array(columns, dtype=numpy.int64)
+        return self._lastColumns
+
+    def _freeColumn(self, currentCircuitIDs: set) -> Optional[int]:
+        taken = set(self.circuitColumns.values())
+        for column in range(FIRST_CIRCUIT_COLUMN, HISTORY_COLUMNS):
+            if column not in taken:
+                return column
+        if self.onRecycle is None:
+            return None
+        for circuitID, column in list(self.circuitColumns.items()):
+            if circuitID not in currentCircuitIDs:
+                del self.circuitColumns[circuitID]
+                self.onRecycle(column)
+                return column
+        return None
+
+'''
+Write one poll into 'row' (HISTORY_COLUMNS float32 values, e.g. a ring buffer row or a row of an on-disk file):
+the panel total, the breakers, and the circuits when the snapshot's circuits data is this poll's; NaN for anything missing.
+'''
+def fillRow(panelSnapshot, seriesColumns: SeriesColumns, row: numpy.ndarray):
+    powerArrays = panelSnapshot.powerArrays
+    row.fill(numpy.nan)
+    totalPowerW = panelSnapshot.totalPowerW
+    if totalPowerW is not None:
+        row[PANEL_COLUMN] = totalPowerW
+    breakerIDs = powerArrays.breakerIDs
+    tracked = (breakerIDs >= 1) & (breakerIDs <= MAX_BREAKER_SERIES)
+    row[FIRST_BREAKER_COLUMN + breakerIDs[tracked] - 1] = powerArrays.breakerPowerW[tracked]
+    if panelSnapshot.hasCircuitsData and not(panelSnapshot.circuitsStale):
+        columns = seriesColumns.columnsFor(powerArrays.circuitIDs)
+        tracked = columns >= 0
+        row[columns[tracked]] = powerArrays.circuitPowerW[tracked]
+
+'''
+The power history of one panel, kept in memory only: the panel total, every breaker and every circuit, as
+  - raw samples (one per full poll) for the last hour,
+  - 1-minute averages / peaks for 2 days,
+  - 15-minute averages / peaks for 14 days.
+Every buffer is allocated up front; if the tiers would not fit in 'memoryBytes', all of them are shortened by the same
+factor, so memory use never grows past the cap. Recording a poll is a fixed amount of work (one row per tier).
+Circuits get a column the first time they are seen; the column of a circuit the panel no longer reports is reused
+(and its history cleared) only once all MAX_CIRCUIT_SERIES columns are taken.
+'''
+class HistoryStore(object):
+    def __init__(self, ipAddress: str, memoryBytes: int):
+        self.ipAddress = ipAddress
+        self._lock = threading.Lock()
+
+        capacities = {}
+        for (tier, bucketSeconds, retentionSeconds) in HISTORY_TIERS:
+            capacities[tier] = int(retentionSeconds / (RAW_MIN_SPACING_SECONDS if bucketSeconds == 0 else bucketSeconds))
+        fullBytes = sum(RingBuffer.bytesFor(capacities[tier], HISTORY_COLUMNS) * (1 if bucketSeconds == 0 else 2) for (tier, bucketSeconds, retentionSeconds) in HISTORY_TIERS)
+        # the rollup accumulators (sum, count, peak per column) are a fixed overhead outside the rings
+        ringBytes = max(0, int(memoryBytes) - (len(HISTORY_TIERS) - 1) * 16 * HISTORY_COLUMNS)
+        self.scale = min(1.0, ringBytes / fullBytes)
+        if self.scale < 1.0:
+            LOGGER.warning("\n\tHISTORY for " + ipAddress + ": " + str(round(fullBytes/1048576, 1)) + " MB would be needed for the full retention; keeping " + str(round(self.scale*100)) + "% of it to stay within " + str(round(memoryBytes/1048576, 1)) + " MB.\n")
+
+        self.raw: Optional[RingBuffer] = None
+        # tier -> RollupTier
+        self.rollups: dict = {}
+        self.bucketSeconds: dict = {}
+        # tier -> how far back reads from it reach, in seconds
+        self.reachSeconds: dict = {}
+        for (tier, bucketSeconds, retentionSeconds) in HISTORY_TIERS:
+            capacity = max(1, int(capacities[tier] * self.scale))
+            self.bucketSeconds[tier] = bucketSeconds
+            self.reachSeconds[tier] = retentionSeconds * self.scale
+            if bucketSeconds == 0:
+                self.raw = RingBuffer(capacity, HISTORY_COLUMNS)
+            else:
+                self.rollups[tier] = RollupTier(bucketSeconds, capacity, HISTORY_COLUMNS)
+
+        self._row = numpy.full(HISTORY_COLUMNS, numpy.nan, dtype=numpy.float32)
+        self.columns = SeriesColumns(ipAddress, self._clearColumn)
+        self._lastTimestamp: Optional[float] = None
+        self.samples = 0
+        self.dropped = 0
+
+    '''
+    Add one poll (a PanelSnapshot with panel data); circuits are only recorded when its circuits data is this poll's.
+    Returns False if the sample was dropped (too soon after the previous one, or older than it).
+    '''
+    def record(self, panelSnapshot) -> bool:
+        if not(panelSnapshot.hasPanelData):
+            return False
+        timestamp = panelSnapshot.timestamp
+        with self._lock:
+            if self._lastTimestamp is not None and timestamp - self._lastTimestamp < RAW_MIN_SPACING_SECONDS:
+                self.dropped += 1
+                return False
+            self._lastTimestamp = timestamp
+
+            fillRow(panelSnapshot, self.columns, self._row)
+            self.raw.append(timestamp, self._row)
+            for rollup in self.rollups.values():
+                rollup.add(timestamp, self._row)
+            self.samples += 1
+        return True
+
+    def _clearColumn(self, column: int):
+        self.raw.clearColumn(column)
+        for rollup in self.rollups.values():
+            rollup.clearColumn(column)
+
+    '''
+    The finest tier that reaches 'seconds' back.
+    '''
+    def tierFor(self, seconds: float) -> str:
+        for (tier, bucketSeconds, retentionSeconds) in HISTORY_TIERS:
+            if seconds <= self.reachSeconds[tier]:
+                return tier
+        return HISTORY_TIERS[-1][0]
+
+    '''
+    (timestamps, Watts) of one column for the last 'seconds' (as far back as the tier reaches if None, or if it reaches less), oldest first, from 'tier'
+    (the finest one covering 'seconds' if None). For the rollup tiers, 'peaks' selects the per-bucket largest magnitude
+    instead of the average; the bucket in progress is not included.
+    '''
+    def _series(self, column: Optional[int], seconds: Optional[float], tier: Optional[str], peaks: bool) -> tuple:
+        if column is None:
+            return (numpy.zeros(0), numpy.zeros(0, dtype=numpy.float32))
+        if tier is None:
+            tier = HISTORY_RAW if seconds is None else self.tierFor(seconds)
+        with self._lock:
+            if tier == HISTORY_RAW:
+                ring = self.raw
+            else:
+                ring = self.rollups[tier].peaks if peaks else self.rollups[tier].means
+            sinceTimestamp = None
+            if ring.lastTimestamp is not None:
+                reachSeconds = self.reachSeconds[tier] if seconds is None else min(seconds, self.reachSeconds[tier])
+                sinceTimestamp = (self._lastTimestamp if self._lastTimestamp is not None else ring.lastTimestamp) - reachSeconds
+            (timestamps, values) = ring.column(column, sinceTimestamp)
+            return (timestamps.copy(), values.copy())
+
+    def panelSeries(self, seconds: Optional[float]=None, tier: Optional[str]=None, peaks: bool=False) -> tuple:
+        return self._series(PANEL_COLUMN, seconds, tier, peaks)
+
+    def breakerSeries(self, breakerID: int, seconds: Optional[float]=None, tier: Optional[str]=None, peaks: bool=False) -> tuple:
+        column = None
+        if 1 <= breakerID <= MAX_BREAKER_SERIES:
+            column = FIRST_BREAKER_COLUMN + breakerID - 1
+        return self._series(column, seconds, tier, peaks)
+
+    def circuitSeries(self, circuitID: str, seconds: Optional[float]=None, tier: Optional[str]=None, peaks: bool=False) -> tuple:
+        with self._lock:
+            column = self.columns.circuitColumns.get(circuitID)
+        return self._series(column, seconds, tier, peaks)
+
+    '''
+    Average of a (timestamps, Watts) series, ignoring gaps; None if it has no values.
+    '''
+    @staticmethod
+    def averageW(series: tuple) -> Optional[float]:
+        values = series[1]
+        values = values[~numpy.isnan(values)]
+        if len(values) == 0:
+            return None
+        return round(float(values.mean()), 2)
+
+    @property
+    def nbytes(self) -> int:
+        return self.raw.nbytes + sum(rollup.nbytes for rollup in self.rollups.values()) + self._row.nbytes
+
+    def statsString(self) -> str:
+        with self._lock:
+            tiers = HISTORY_RAW + " " + str(self.raw.count) + "/" + str(self.raw.capacity)
+            for tier, rollup in self.rollups.items():
+                tiers = tiers + ", " + tier + " " + str(rollup.means.count) + "/" + str(rollup.means.capacity)
+            return "samples=" + str(self.samples) + ", dropped=" + str(self.dropped) + ", circuits=" + str(len(self.columns.circuitColumns)) + ", rows " + tiers + ", memory=" + str(round(self.nbytes/1048576, 2)) + " MB"
+
+# memory cap per panel (set from the optional History_Memory_MB custom parameter); 0 = no history
+_historyMemoryBytes = HISTORY_DEFAULT_MEMORY_MB * 1048576
+
+_historyStores: dict = {}
+_historyStoresLock = threading.Lock()
+
+'''
+Set the per-panel memory cap; existing histories are dropped if it changed (they are rebuilt at the new size on the next poll).
+'''
+def setHistoryMemoryMB(memoryMB: float):
+    global _historyMemoryBytes
+    memoryBytes = int(max(0.0, float(memoryMB)) * 1048576)
+    with _historyStoresLock:
+        if memoryBytes == _historyMemoryBytes:
+            return
+        _historyMemoryBytes = memoryBytes
+        _historyStores.clear()
+    if memoryBytes == 0:
+        LOGGER.info("\n\tHISTORY is off.\n")
+    else:
+        LOGGER.info("\n\tHISTORY limited to " + str(round(memoryBytes/1048576, 1)) + " MB per panel.\n")
+
+'''
+Return the shared HistoryStore for a panel, creating it on first use; None when the history is off.
+'''
+def getHistoryStore(ipAddress: str) -> Optional[HistoryStore]:
+    with _historyStoresLock:
+        if _historyMemoryBytes <= 0:
+            return None
+        store = _historyStores.get(ipAddress)
+        if store is None:
+            store = HistoryStore(ipAddress, _historyMemoryBytes)
+            _historyStores[ipAddress] = store
+        return store
+
+def historyStores() -> list:
+    with _historyStoresLock:
+        return list(_historyStores.values())
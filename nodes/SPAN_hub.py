@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Per-Panel Data Hub
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import time
+import concurrent.futures
+
+import http.client
+
+# Standard Library
+from typing import Optional, Any
+
+from nodes import SPAN_client, SPAN_health
+
+LOGGER = udi_interface.LOGGER
+
+# how long a fetched payload may be handed out again instead of asking the panel
+HUB_CACHE_TTL_SECONDS = 2.0
+HUB_MAX_PARALLEL_FETCHES = 4
+
+# how long one poll may wait, in total, for a payload (hedges and retries included)
+HUB_POLL_DEADLINE_SECONDS = 10.0
+# a second (hedged) request is sent if the first has not answered after the path's p95 response time;
+# until there are enough samples for a p95, after HEDGE_DEFAULT_DELAY_SECONDS
+HEDGE_DEFAULT_DELAY_SECONDS = 1.5
+HEDGE_MIN_DELAY_SECONDS = 0.2
+# requests per fetch: the original, one hedge, and one retry if both failed
+HUB_MAX_ATTEMPTS_PER_FETCH = 3
+
+'''
+Raised when a payload could not be fetched before the poll's deadline.
+'''
+class PollDeadlineExceeded(SPAN_client.SpanError):
+    def __init__(self, path: str, deadlineSeconds: float):
+        super().__init__("GET " + path + " did not complete within the " + str(round(deadlineSeconds,1)) + " s poll deadline")
+        self.path = path
+
+'''
+Errors worth another attempt: the panel was slow or the connection failed, as opposed to the panel refusing the
+request (a 4xx answer, e.g. a bad token), which would only fail again.
+'''
+def isRetryable(error: BaseException) -> bool:
+    if isinstance(error, SPAN_client.SpanRequestError):
+        return error.status >= 500
+    return isinstance(error, (OSError, http.client.HTTPException))
+
+'''
+One request to the panel that several callers may be waiting on.
+'''
+class _Flight(object):
+    def __init__(self, generation: int):
+        self.generation = generation
+        self.done = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+'''
+Owns all fetching from one SPAN panel. The Breakers controller, the Circuits controller and every Circuit node of
+the panel go through the same hub (see getPanelDataHub), so:
+  - concurrent callers asking for the same endpoint share one in-flight request (single-flight);
+  - a payload fetched within the last HUB_CACHE_TTL_SECONDS is handed out again instead of re-requested;
+  - a slow request is hedged with a second one after the path's p95 response time, a failed one is retried, and the
+    whole fetch is bounded by a per-poll deadline (PollDeadlineExceeded);
+  - a POST (circuit command) invalidates the cached payloads it affects;
+  - the outcome of every request feeds the panel's SPAN_health.PanelHealth, and while the panel is down GETs are
+    refused locally (SPAN_health.PanelUnavailableError) instead of waiting on the connect timeout every poll.
+'''
+class PanelDataHub(object):
+    def __init__(self, ipAddress: str, token: str, cacheTTL: float=HUB_CACHE_TTL_SECONDS):
+        self.ipAddress = ipAddress
+        self.token = token
+        self.cacheTTL = cacheTTL
+        self.client = SPAN_client.getSpanClient(ipAddress, token)
+        self.health = SPAN_health.PanelHealth(ipAddress)
+        self._fetchExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=HUB_MAX_PARALLEL_FETCHES, thread_name_prefix='SPAN_fetch')
+        # the individual requests (original, hedge, retry) of each fetch; separate from _fetchExecutor, whose workers wait on them
+        self._attemptExecutor = concurrent.futures.ThreadPoolExecutor(max_workers=HUB_MAX_PARALLEL_FETCHES*HUB_MAX_ATTEMPTS_PER_FETCH, thread_name_prefix='SPAN_request')
+
+        self._lock = threading.Lock()
+        # path -> (monotonic time fetched, decoded body)
+        self._cache: dict = {}
+        # path -> _Flight currently fetching it
+        self._inFlight: dict = {}
+        # path -> bumped on every invalidation, so a fetch that started before a POST is not cached after it
+        self._generations: dict = {}
+        # path -> (wall-clock time fetched, decoded body) of the last successful fetch, kept regardless of age
+        self._lastGood: dict = {}
+
+        self.fetchCount = 0
+        self.cacheHits = 0
+        self.sharedFlights = 0
+        self.hedgedRequests = 0
+        self.hedgeWins = 0
+        self.retries = 0
+        self.deadlineMisses = 0
+
+    '''
+    GET a SPAN API path, from the cache if it is at most maxAge seconds old, otherwise from the panel
+    (joining a request for the same path that is already in flight, if there is one).
+    deadline is a time.monotonic() by which to give up (PollDeadlineExceeded); by default HUB_POLL_DEADLINE_SECONDS from now.
+    healthChecked is True when the caller (getMany) has already passed the panel's health check for the whole batch.
+    '''
+    def get(self, path: str, maxAge: Optional[float]=None, deadline: Optional[float]=None, healthChecked: bool=False) -> str:
+        if maxAge is None:
+            maxAge = self.cacheTTL
+        if deadline is None:
+            deadline = time.monotonic() + HUB_POLL_DEADLINE_SECONDS
+
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and time.monotonic() - cached[0] <= maxAge:
+                self.cacheHits += 1
+                return cached[1]
+
+            flight = self._inFlight.get(path)
+            if flight is not None:
+                self.sharedFlights += 1
+                leader = False
+            else:
+                if not(healthChecked):
+                    self.health.checkAvailable()
+                flight = _Flight(self._generations.get(path, 0))
+                self._inFlight[path] = flight
+                self.fetchCount += 1
+                leader = True
+
+        if not(leader):
+            if not(flight.done.wait(max(0, deadline - time.monotonic()))):
+                with self._lock:
+                    self.deadlineMisses += 1
+                raise PollDeadlineExceeded(path, HUB_POLL_DEADLINE_SECONDS)
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        succeeded = False
+        try:
+            flight.result = self._fetch(path, deadline)
+            succeeded = True
+            self.health.recordSuccess()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            # a 4xx answer (e.g. a revoked token) means the panel is reachable; it is passed on without touching its health
+            if isRetryable(e):
+                self.health.recordFailure(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inFlight.get(path) is flight:
+                    del self._inFlight[path]
+                if not(succeeded) and flight.error is None:
+                    flight.error = http.client.HTTPException("GET " + path + " was interrupted")
+                if succeeded:
+                    self._lastGood[path] = (time.time(), flight.result)
+                    if self._generations.get(path, 0) == flight.generation:
+                        self._cache[path] = (time.monotonic(), flight.result)
+            flight.done.set()
+
+    '''
+    Fetch one path from the panel: send the request, hedge it with a second one if it has not answered after the
+    path's p95 response time, retry (once) if every request sent so far failed, and give up at the deadline.
+    The first successful answer wins; requests still running are left to finish on their own.
+    '''
+    def _fetch(self, path: str, deadline: float) -> str:
+        startTime = time.monotonic()
+        hedgeDelay = self.client.latency.p95(path)
+        if hedgeDelay is None:
+            hedgeDelay = HEDGE_DEFAULT_DELAY_SECONDS
+        hedgeDelay = max(HEDGE_MIN_DELAY_SECONDS, hedgeDelay)
+
+        pending = set()
+        first = self._attemptExecutor.submit(self.client.get, path)
+        pending.add(first)
+        attempts = 1
+        hedged = False
+        lastError: Optional[BaseException] = None
+
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self.deadlineMisses += 1
+                raise PollDeadlineExceeded(path, deadline - startTime)
+            timeout = remaining
+            if not(hedged) and attempts < HUB_MAX_ATTEMPTS_PER_FETCH:
+                timeout = min(remaining, max(0, startTime + hedgeDelay - time.monotonic()))
+
+            done, pending = concurrent.futures.wait(pending, timeout=timeout, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if hedged and future is not first:
+                        with self._lock:
+                            self.hedgeWins += 1
+                    return future.result()
+                lastError = error
+
+            if len(pending) == 0:
+                if lastError is not None and not(isRetryable(lastError)):
+                    raise lastError
+                if attempts >= HUB_MAX_ATTEMPTS_PER_FETCH:
+                    raise lastError
+                LOGGER.debug("\n\tSPAN PANEL DATA HUB retrying GET " + path + " @ " + self.ipAddress + " after: {}\n".format(lastError))
+                with self._lock:
+                    self.retries += 1
+                pending.add(self._attemptExecutor.submit(self.client.get, path))
+                attempts += 1
+                # the retry is the last chance; no hedge for it
+                hedged = True
+            elif len(done) == 0 and not(hedged) and time.monotonic() - startTime >= hedgeDelay:
+                LOGGER.debug("\n\tSPAN PANEL DATA HUB hedging GET " + path + " @ " + self.ipAddress + " after " + str(int(hedgeDelay*1000)) + " ms.\n")
+                with self._lock:
+                    self.hedgedRequests += 1
+                pending.add(self._attemptExecutor.submit(self.client.get, path))
+                attempts += 1
+                hedged = True
+
+    '''
+    The last payload successfully fetched for a path, however old, as (wall-clock time fetched, decoded body); None if there never was one.
+    '''
+    def lastGood(self, path: str):
+        with self._lock:
+            return self._lastGood.get(path)
+
+    '''
+    GET several paths at the same time and wait for all of them, with one deadline (deadlineSeconds from now) for the lot.
+    Returns a dict of path -> decoded body, or path -> the exception that request raised.
+    The panel's health is checked once for the batch, so while it is down the whole batch is either the probe or refused.
+    '''
+    def getMany(self, paths: list, maxAge: Optional[float]=None, deadlineSeconds: float=HUB_POLL_DEADLINE_SECONDS) -> dict:
+        deadline = time.monotonic() + deadlineSeconds
+        try:
+            self.health.checkAvailable()
+        except SPAN_health.PanelUnavailableError as e:
+            return dict((path, e) for path in paths)
+        futures = {}
+        for path in paths:
+            futures[path] = self._fetchExecutor.submit(self.get, path, maxAge, deadline, True)
+
+        results = {}
+        for path, future in futures.items():
+            try:
+                results[path] = future.result()
+            except Exception as e:
+                results[path] = e
+        return results
+
+    '''
+    POST to a SPAN API path; the panel and circuits payloads are invalidated, since a command changes both.
+    Commands are user-initiated, so they are sent even while the panel is down (and count as a probe).
+    '''
+    def post(self, path: str, payload: str) -> str:
+        try:
+            result = self.client.post(path, payload)
+            self.health.recordSuccess()
+            return result
+        except Exception as e:
+            # a rejected command (4xx) says nothing about whether the panel is reachable
+            if isRetryable(e):
+                self.health.recordFailure(e)
+            raise
+        finally:
+            self.invalidate("/api/v1/panel", "/api/v1/circuits")
+
+    '''
+    Drop cached payloads (all of them if no paths are given); requests already in flight are not reused.
+    '''
+    def invalidate(self, *paths):
+        with self._lock:
+            if len(paths) == 0:
+                paths = list(set(self._cache.keys()) | set(self._inFlight.keys()))
+            for path in paths:
+                self._cache.pop(path, None)
+                self._inFlight.pop(path, None)
+                self._generations[path] = self._generations.get(path, 0) + 1
+
+    def close(self):
+        self._fetchExecutor.shutdown(wait=False)
+        self._attemptExecutor.shutdown(wait=False)
+        self.client.close()
+
+    def statsString(self) -> str:
+        return "fetches=" + str(self.fetchCount) + ", cache hits=" + str(self.cacheHits) + ", shared in-flight=" + str(self.sharedFlights) + ", hedged=" + str(self.hedgedRequests) + " (won " + str(self.hedgeWins) + "), retries=" + str(self.retries) + ", deadline misses=" + str(self.deadlineMisses) + "; " + self.health.statsString() + "; " + self.client.statsString()
+
+_panelDataHubs: dict = {}
+_panelDataHubsLock = threading.Lock()
+
+'''
+Return the shared PanelDataHub for a panel, creating it the first time (or if the token changed).
+'''
+def getPanelDataHub(ipAddress: str, token: str) -> PanelDataHub:
+    with _panelDataHubsLock:
+        hub = _panelDataHubs.get(ipAddress)
+        if hub is None or hub.token != token:
+            if hub is not None:
+                hub.close()
+            hub = PanelDataHub(ipAddress, token)
+            _panelDataHubs[ipAddress] = hub
+        return hub
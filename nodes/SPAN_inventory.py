@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Node Inventory, Child Node Reconciliation and Child Registries
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+
+# Standard Library
+from typing import Optional, Any
+
+LOGGER = udi_interface.LOGGER
+
+'''
+One snapshot of the nodes that exist, taken once per create pass instead of calling getNodes() for every child:
+the node objects added in this session (getNodes) plus the nodes Polyglot has saved from earlier runs (getNodesFromDb).
+'''
+class NodeInventory(object):
+    def __init__(self, poly):
+        self.poly = poly
+        # address -> node object added in this session
+        self.live: dict = dict(poly.getNodes())
+        # address -> name Polyglot has on record (includes nodes not added yet in this session)
+        self.saved: dict = {}
+        try:
+            for record in poly.getNodesFromDb() or []:
+                self.saved[record['address']] = record.get('name')
+        except:
+            LOGGER.warning("\n\tNODE INVENTORY could not read the saved nodes from Polyglot; only nodes added in this session are known.\n")
+
+    def addresses(self, prefix: str) -> set:
+        return set(address for address in list(self.live.keys()) + list(self.saved.keys()) if address.startswith(prefix))
+
+    def liveNode(self, address: str) -> Any:
+        return self.live.get(address)
+
+    def savedName(self, address: str) -> Optional[str]:
+        return self.saved.get(address)
+
+'''
+Bring the child nodes whose addresses start with 'prefix' in line with 'desired', a list of (address, name, spec) in the
+order the children should be kept, touching as few nodes as possible:
+  - a node already added in this session is reused (refreshNode(node, spec) lets the caller update it), and renamed only if its name changed;
+  - a node Polyglot has saved from an earlier run is re-added (makeNode(address, name, spec)) with rename only if its name changed;
+  - a node that does not exist yet is added;
+  - a node with the prefix that is no longer desired is deleted.
+Returns (the child nodes in 'desired' order, a summary string for the log).
+'''
+def reconcileChildren(poly, prefix: str, desired: list, makeNode, refreshNode=None, inventory: Optional[NodeInventory]=None):
+    if inventory is None:
+        inventory = NodeInventory(poly)
+
+    children = []
+    added = 0
+    restored = 0
+    renamed = 0
+    kept = 0
+    failed = 0
+    desiredAddresses = set()
+
+    for (address, name, spec) in desired:
+        desiredAddresses.add(address)
+        try:
+            node = inventory.liveNode(address)
+            if node is not None and not(isinstance(node, str)):
+                if refreshNode is not None:
+                    refreshNode(node, spec)
+                if node.name != name:
+                    poly.renameNode(address, name)
+                    renamed += 1
+                else:
+                    kept += 1
+                children.append(node)
+                continue
+
+            node = makeNode(address, name, spec)
+            savedName = inventory.savedName(address)
+            if savedName is None:
+                poly.addNode(node)
+                added += 1
+            elif savedName != name:
+                poly.addNode(node, rename=True)
+                renamed += 1
+            else:
+                poly.addNode(node)
+                restored += 1
+            children.append(node)
+        except:
+            failed += 1
+            LOGGER.warning("\n\tUnable to create or update child node '" + address + "' at this time.\n")
+
+    deleted = 0
+    for address in sorted(inventory.addresses(prefix) - desiredAddresses):
+        LOGGER.warning("\n\tDeleting '" + address + "', which the panel no longer reports.\n")
+        try:
+            poly.delNode(address)
+            deleted += 1
+        except:
+            failed += 1
+            LOGGER.warning("\n\tUnable to delete child node '" + address + "' at this time.\n")
+
+    summary = "added=" + str(added) + ", restored=" + str(restored) + ", renamed=" + str(renamed) + ", deleted=" + str(deleted) + ", unchanged=" + str(kept) + ", failed=" + str(failed)
+    return children, summary
+
+'''
+The child nodes of one controller, indexed by node address and by the panel entity each node follows
+(entityAttribute: 'breakerID' for breakers, 'circuitID' for circuits), with exactly one entry per node.
+Iterating yields the nodes in the order they were registered (the panel order from reconcileChildren).
+'''
+class ChildRegistry(object):
+    def __init__(self, entityAttribute: str):
+        self.entityAttribute = entityAttribute
+        self._lock = threading.Lock()
+        # address -> node, in registration order
+        self._byAddress: dict = {}
+        # entity ID -> node
+        self._byEntity: dict = {}
+        # address -> the entity ID the node was registered under
+        self._entityOf: dict = {}
+
+    '''
+    Replace every entry with 'children' (e.g. the nodes returned by reconcileChildren), re-reading their entity IDs.
+    '''
+    def replace(self, children: list):
+        with self._lock:
+            self._byAddress = {}
+            self._byEntity = {}
+            self._entityOf = {}
+            for node in children:
+                self._add(node)
+
+    '''
+    Register (or re-register, e.g. after its entity ID changed) one node; returns False for anything that is not a node object.
+    '''
+    def add(self, node) -> bool:
+        with self._lock:
+            return self._add(node)
+
+    def _add(self, node) -> bool:
+        if node is None or isinstance(node, str):
+            return False
+        previousEntityID = self._entityOf.pop(node.address, None)
+        if previousEntityID is not None and getattr(self._byEntity.get(previousEntityID), 'address', None) == node.address:
+            del self._byEntity[previousEntityID]
+        entityID = getattr(node, self.entityAttribute)
+        self._byAddress[node.address] = node
+        self._byEntity[entityID] = node
+        self._entityOf[node.address] = entityID
+        return True
+
+    '''
+    Recovery: register the node objects in 'nodes' (as returned by poly.getNodes(): address -> node) whose address
+    starts with 'prefix'. Returns how many were registered.
+    '''
+    def adopt(self, nodes: dict, prefix: str) -> int:
+        adopted = 0
+        with self._lock:
+            for address, node in list(nodes.items()):
+                if address.startswith(prefix) and self._add(node):
+                    adopted += 1
+        return adopted
+
+    def byAddress(self, address: str) -> Any:
+        return self._byAddress.get(address)
+
+    def byEntity(self, entityID: Any) -> Any:
+        return self._byEntity.get(entityID)
+
+    def nodes(self) -> list:
+        with self._lock:
+            return list(self._byAddress.values())
+
+    def __iter__(self):
+        return iter(self.nodes())
+
+    def __len__(self):
+        return len(self._byAddress)
+
+    def __contains__(self, address: str):
+        return address in self._byAddress
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - ISY REST Reporter (PG3 text path)
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import collections
+import time
+
+# Standard Library
+from typing import Optional, Any
+
+import http.client,base64
+
+from nodes import SPAN_client
+
+LOGGER = udi_interface.LOGGER
+
+ISY_MAX_IN_FLIGHT = 2
+ISY_CONNECT_TIMEOUT_SECONDS = 5.0
+ISY_READ_TIMEOUT_SECONDS = 10.0
+# pending text pushes are bounded; when full, the oldest pending push is dropped to make room
+ISY_MAX_QUEUED_PUSHES = 512
+
+'''
+On PG3 (not PG3x) the 'text' attribute of a driver has to be pushed straight to the ISY's REST interface.
+One IsyReporter is shared by every node: the Basic auth header and the node address prefix are computed once,
+keep-alive connections to the ISY are reused, and at most ISY_MAX_IN_FLIGHT requests are outstanding at once.
+Nodes hand their pushes to enqueueText(); ISY_MAX_IN_FLIGHT publisher threads send them in the background.
+'''
+class IsyReporter(object):
+    def __init__(self, poly, isy, maxInFlight: int=ISY_MAX_IN_FLIGHT):
+        self.isyIP = isy._isy_ip
+        self.isyPort = isy._isy_port
+        self.isyUser = isy._isy_user
+        self.isyPass = isy._isy_pass
+        self.profileNum = str(poly.profileNum)
+
+        userpassword = self.isyUser + ":" + self.isyPass
+        self.authorization = "Basic " + base64.b64encode(userpassword.encode("ascii")).decode("ascii")
+
+        prefixN = self.profileNum
+        if len(prefixN) < 2:
+            prefixN = 'n00' + prefixN + '_'
+        elif len(prefixN) < 3:
+            prefixN = 'n0' + prefixN + '_'
+        self.nodePrefix = prefixN
+
+        self.pool = SPAN_client.ConnectionPool(self.isyIP, self.isyPort, maxIdle=maxInFlight, connectTimeout=ISY_CONNECT_TIMEOUT_SECONDS, readTimeout=ISY_READ_TIMEOUT_SECONDS)
+        self._inFlight = threading.BoundedSemaphore(maxInFlight)
+
+        # (address, driver) -> (value, encoded text, monotonic time queued, onFailure), oldest first
+        self.maxInFlight = maxInFlight
+        self._pending = collections.OrderedDict()
+        self._queueCondition = threading.Condition()
+        self._publishers = []
+        self._lastPublished: dict = {}
+        self._closed = False
+
+        self.publishedCount = 0
+        self.failedCount = 0
+        self.coalescedCount = 0
+        self.droppedCount = 0
+        self.maxQueueDepth = 0
+        self.lastLatencyMS = 0.0
+        self.maxLatencyMS = 0.0
+        self._totalLatencyMS = 0.0
+
+    def matches(self, isy) -> bool:
+        return self.isyIP == isy._isy_ip and self.isyPort == isy._isy_port and self.isyUser == isy._isy_user and self.isyPass == isy._isy_pass
+
+    @property
+    def isConfigured(self) -> bool:
+        return len(self.isyIP) > 0 and len(self.isyUser + self.isyPass) > 0
+
+    '''
+    Push a value plus its (already URL-encoded) text attribute for one driver; returns True when the ISY answered 200.
+    '''
+    def reportText(self, address: str, driver: str, value: Any, encodedText: str) -> bool:
+        suffixURL = '/rest/ns/' + self.profileNum + '/nodes/' + self.nodePrefix + address + '/report/status/' + driver + '/' + str(value) + '/56/text/' + encodedText
+        headers = {
+            "Authorization": self.authorization,
+            "Connection": "keep-alive"
+        }
+
+        LOGGER.debug("\n\t\tPUSHING REPORT Details - this is the 'suffixURL':\n\t\t\t" + suffixURL + "\n")
+
+        try:
+            with self._inFlight:
+                status, data = self.pool.request("GET", suffixURL, '', headers)
+            responseData = data.decode("utf-8")
+
+            if '<status>200</status>' not in responseData:
+                LOGGER.warning("\n\t\tPUSHING REPORT ERROR on '" + address + "' for driver " + driver + ": RESPONSE from report was not '<status>200</status>' as expected:\n\t\t\t" + responseData + "\n")
+                return False
+            LOGGER.debug("\n\t\tPUSHING REPORT on '" + address + "' for driver " + driver + ": RESPONSE from report:\n\t\t\t" + responseData + "\n")
+            return True
+        except http.client.HTTPException:
+            LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + address + "' for driver " + driver + " had an HTTPException ERROR.\n")
+        except:
+            LOGGER.error("\n\t\tPUSHING REPORT ERROR on '" + address + "' for driver " + driver + " had an ERROR.\n")
+        return False
+
+    '''
+    Queue a text push for the publisher threads and return immediately, so a slow ISY never holds up a poll.
+    If a push for the same address / driver is still waiting, it is replaced (latest value wins).
+    onFailure(driver) is called if the push is finally dropped or rejected (never while the queue's lock is held).
+    '''
+    def enqueueText(self, address: str, driver: str, value: Any, encodedText: str, onFailure=None):
+        key = (address, driver)
+        # (onFailure, driver) of a push that will not be sent, called once the lock is released
+        failed = None
+        with self._queueCondition:
+            if self._closed:
+                failed = (onFailure, driver)
+            else:
+                if key in self._pending:
+                    del self._pending[key]
+                    self.coalescedCount += 1
+                elif len(self._pending) >= ISY_MAX_QUEUED_PUSHES:
+                    droppedKey, dropped = self._pending.popitem(last=False)
+                    self.droppedCount += 1
+                    LOGGER.warning("\n\tPUSHING REPORT DROPPED for '" + droppedKey[0] + "' driver " + droppedKey[1] + ": the ISY publish queue is full.\n")
+                    failed = (dropped[3], droppedKey[1])
+                self._pending[key] = (value, encodedText, time.monotonic(), onFailure)
+                self.maxQueueDepth = max(self.maxQueueDepth, len(self._pending))
+                self._startPublishers()
+                self._queueCondition.notify()
+        if failed is not None and failed[0] is not None:
+            failed[0](failed[1])
+
+    def _startPublishers(self):
+        while len(self._publishers) < self.maxInFlight:
+            publisher = threading.Thread(target=self._publishLoop, name='SPAN_isyPublisher_' + str(len(self._publishers)+1), daemon=True)
+            self._publishers.append(publisher)
+            publisher.start()
+
+    def _publishLoop(self):
+        while True:
+            with self._queueCondition:
+                while len(self._pending) == 0 and not(self._closed):
+                    self._queueCondition.wait()
+                if len(self._pending) == 0:
+                    return
+                key, (value, encodedText, queuedAt, onFailure) = self._pending.popitem(last=False)
+                # the ISY only registers a new text when the value changes, and coalescing can swallow a flip,
+                # so flip relative to what was last actually published for this driver
+                lastValue = self._lastPublished.get(key)
+                if lastValue is not None:
+                    value = 0 if lastValue == 1 else 1
+
+            success = self.reportText(key[0], key[1], value, encodedText)
+            latencyMS = (time.monotonic() - queuedAt)*1000
+
+            with self._queueCondition:
+                self.lastLatencyMS = latencyMS
+                self.maxLatencyMS = max(self.maxLatencyMS, latencyMS)
+                self._totalLatencyMS += latencyMS
+                if success:
+                    self.publishedCount += 1
+                    self._lastPublished[key] = value
+                else:
+                    self.failedCount += 1
+            if not(success) and onFailure is not None:
+                onFailure(key[1])
+
+    @property
+    def queueDepth(self) -> int:
+        with self._queueCondition:
+            return len(self._pending)
+
+    def metricsString(self) -> str:
+        with self._queueCondition:
+            completed = self.publishedCount + self.failedCount
+            averageLatencyMS = 0 if completed == 0 else self._totalLatencyMS/completed
+            return "ISY queue depth=" + str(len(self._pending)) + " (max " + str(self.maxQueueDepth) + "), published=" + str(self.publishedCount) + ", failed=" + str(self.failedCount) + ", coalesced=" + str(self.coalescedCount) + ", dropped=" + str(self.droppedCount) + ", latency last/avg/max=" + str(int(self.lastLatencyMS)) + "/" + str(int(averageLatencyMS)) + "/" + str(int(self.maxLatencyMS)) + " ms"
+
+    '''
+    Stop accepting pushes, give the publishers up to 'timeout' seconds to drain what is queued, then close the connections.
+    '''
+    def close(self, timeout: float=0):
+        with self._queueCondition:
+            self._closed = True
+            self._queueCondition.notify_all()
+        deadline = time.monotonic() + timeout
+        for publisher in self._publishers:
+            publisher.join(max(0, deadline - time.monotonic()))
+        self.pool.close()
+
+_isyReporter: Optional[IsyReporter] = None
+_isyReporterLock = threading.Lock()
+
+'''
+Return the IsyReporter shared by all nodes, (re)building it if the ISY connection details changed.
+'''
+def getIsyReporter(poly, isy) -> IsyReporter:
+    global _isyReporter
+    with _isyReporterLock:
+        if _isyReporter is None or not(_isyReporter.matches(isy)):
+            if _isyReporter is not None:
+                _isyReporter.close()
+            _isyReporter = IsyReporter(poly, isy)
+        return _isyReporter
+
+'''
+Publisher metrics for the log, or '' if nothing has been pushed to the ISY yet.
+'''
+def isyMetricsString() -> str:
+    with _isyReporterLock:
+        reporter = _isyReporter
+    if reporter is None:
+        return ''
+    return reporter.metricsString()
+
+'''
+Flush (up to 'timeout' seconds) and close the shared IsyReporter, e.g. when the NodeServer stops.
+'''
+def closeIsyReporter(timeout: float=5.0):
+    global _isyReporter
+    with _isyReporterLock:
+        reporter = _isyReporter
+        _isyReporter = None
+    if reporter is not None:
+        reporter.close(timeout)
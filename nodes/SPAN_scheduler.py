@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Tiered Poll Scheduler
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import time
+import math
+
+# Standard Library
+from typing import Optional, Any
+
+LOGGER = udi_interface.LOGGER
+
+# data classes, each with its own cadence
+TIER_POWER = 'power'       # Watts (ST): every short poll
+TIER_RELAY = 'relay'       # relay state, priority, open / closed counts: every RELAY_PRIORITY_EVERY_N_POLLS short polls
+TIER_STATUS = 'status'     # /api/v1/status (door, unlock presses, serial, firmware, uptime): on the long poll, or on demand
+
+RELAY_PRIORITY_EVERY_N_POLLS = 3
+
+# appended to the polltype handed to child nodes when only the power tier is due
+POWER_ONLY = "|power only"
+
+'''
+Decides, per short poll of one panel, which data classes are due.
+A tier with a cadence of 0 is only due when request()ed (the long poll does this for TIER_STATUS).
+'''
+class PollScheduler(object):
+    def __init__(self, relayEveryNPolls: int=RELAY_PRIORITY_EVERY_N_POLLS):
+        self.tierEveryNPolls = {
+            TIER_POWER: 1,
+            TIER_RELAY: max(1, relayEveryNPolls),
+            TIER_STATUS: 0
+        }
+        self.shortPollCount = 0
+        self._lock = threading.Lock()
+        # everything is due on the first poll
+        self._requested = set(self.tierEveryNPolls.keys())
+
+    '''
+    Ask for a tier to be refreshed on the next short poll.
+    '''
+    def request(self, tier: str):
+        with self._lock:
+            self._requested.add(tier)
+
+    '''
+    Called at the start of each short poll; returns the set of tiers due this time.
+    '''
+    def beginShortPoll(self) -> set:
+        with self._lock:
+            due = set(self._requested)
+            self._requested.clear()
+            for tier, everyNPolls in self.tierEveryNPolls.items():
+                if everyNPolls > 0 and self.shortPollCount % everyNPolls == 0:
+                    due.add(tier)
+            self.shortPollCount += 1
+            return due
+
+FAST_POLL_MINIMUM_SECONDS = 1.0
+
+# poll this long after the panel is expected to have refreshed its readings
+FRESH_DATA_MARGIN_SECONDS = 0.25
+REFRESH_CADENCE_HISTORY = 9
+
+'''
+Learns how often the panel refreshes its readings, from the polls where the payload fingerprint changed.
+Only the gaps between changes with at least one unchanged poll in between are used: when every poll sees new data,
+we are polling slower than the panel and the gap says nothing about its refresh period.
+'''
+class RefreshCadenceEstimator(object):
+    def __init__(self, history: int=REFRESH_CADENCE_HISTORY):
+        self.history = history
+        self._lock = threading.Lock()
+        self._gaps: list = []
+        # monotonic time of the first poll that saw the current readings (the refresh happened at or just before it)
+        self._lastRefreshTime: Optional[float] = None
+        self._sawDuplicate = False
+
+        self.duplicateCount = 0
+        self.changeCount = 0
+
+    def observe(self, changed: bool, pollTime: Optional[float]=None):
+        if pollTime is None:
+            pollTime = time.monotonic()
+        with self._lock:
+            if not(changed):
+                self.duplicateCount += 1
+                self._sawDuplicate = True
+                return
+            self.changeCount += 1
+            if self._lastRefreshTime is not None and self._sawDuplicate:
+                self._gaps.append(pollTime - self._lastRefreshTime)
+                if len(self._gaps) > self.history:
+                    self._gaps.pop(0)
+            self._lastRefreshTime = pollTime
+            self._sawDuplicate = False
+
+    '''
+    Median refresh period in seconds, once there are at least 3 usable observations; otherwise None.
+    '''
+    @property
+    def periodSeconds(self) -> Optional[float]:
+        with self._lock:
+            if len(self._gaps) < 3:
+                return None
+            gaps = sorted(self._gaps)
+        return gaps[len(gaps)//2]
+
+    '''
+    Move a timer's proposed tick to just after the next expected refresh, at most half an interval earlier
+    (and never more than one refresh period later) than proposed.
+    '''
+    def alignTick(self, proposedTick: float, intervalSeconds: float) -> float:
+        period = self.periodSeconds
+        with self._lock:
+            lastRefreshTime = self._lastRefreshTime
+        if period is None or period <= 0 or lastRefreshTime is None:
+            return proposedTick
+        earliest = proposedTick - intervalSeconds/2
+        refreshes = math.ceil((earliest - lastRefreshTime - FRESH_DATA_MARGIN_SECONDS)/period)
+        return min(lastRefreshTime + refreshes*period + FRESH_DATA_MARGIN_SECONDS, proposedTick + period)
+
+    def statsString(self) -> str:
+        period = self.periodSeconds
+        return "panel refresh period=" + ("unknown" if period is None else str(round(period,2)) + " s") + ", changed polls=" + str(self.changeCount) + ", duplicate polls=" + str(self.duplicateCount)
+
+'''
+Calls 'callback' every intervalSeconds on its own thread, on a fixed monotonic grid (tick n is due at start + n*interval),
+so the timing does not drift with how long each call takes. If a call overruns one or more ticks, those ticks are
+skipped and counted rather than queued up.
+'''
+class FixedRateTimer(object):
+    def __init__(self, name: str, intervalSeconds: float, callback, aligner=None):
+        self.name = name
+        self.intervalSeconds = max(FAST_POLL_MINIMUM_SECONDS, float(intervalSeconds))
+        self.callback = callback
+        # optional aligner(proposedTick, intervalSeconds) -> tick, e.g. RefreshCadenceEstimator.alignTick
+        self.aligner = aligner
+
+        self._stopEvent = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.tickCount = 0
+        self.skippedTicks = 0
+        self.errorCount = 0
+        self.lastDurationMS = 0.0
+        self.maxDurationMS = 0.0
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopEvent.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopEvent.set()
+
+    '''
+    Change the interval; it takes effect from the next tick.
+    '''
+    def setInterval(self, intervalSeconds: float):
+        self.intervalSeconds = max(FAST_POLL_MINIMUM_SECONDS, float(intervalSeconds))
+
+    def _run(self):
+        nextTick = time.monotonic()
+        while not(self._stopEvent.is_set()):
+            startTime = time.monotonic()
+            try:
+                self.callback()
+            except:
+                self.errorCount += 1
+                LOGGER.error("\n\tTIMER '" + self.name + "' had an ERROR.\n")
+            finishTime = time.monotonic()
+            self.tickCount += 1
+            self.lastDurationMS = (finishTime - startTime)*1000
+            self.maxDurationMS = max(self.maxDurationMS, self.lastDurationMS)
+
+            nextTick += self.intervalSeconds
+            if finishTime >= nextTick:
+                missedTicks = int((finishTime - nextTick)//self.intervalSeconds) + 1
+                self.skippedTicks += missedTicks
+                nextTick += missedTicks*self.intervalSeconds
+                LOGGER.debug("\n\tTIMER '" + self.name + "' overran; skipped " + str(missedTicks) + " tick(s).\n")
+            if self.aligner is not None:
+                try:
+                    nextTick = max(finishTime, self.aligner(nextTick, self.intervalSeconds))
+                except:
+                    LOGGER.debug("\n\tTIMER '" + self.name + "' could not phase-align its next tick.\n")
+            self._stopEvent.wait(max(0, nextTick - finishTime))
+
+    def statsString(self) -> str:
+        return "every " + str(self.intervalSeconds) + " s: ticks=" + str(self.tickCount) + ", skipped=" + str(self.skippedTicks) + ", errors=" + str(self.errorCount) + ", duration last/max=" + str(int(self.lastDurationMS)) + "/" + str(int(self.maxDurationMS)) + " ms"
+
+ADAPTIVE_BACKOFF_FACTOR = 1.5
+ADAPTIVE_DEFAULT_THRESHOLD_W = 50.0
+
+'''
+Poll interval that follows how volatile the panel is: as soon as the grid power or any circuit's power moves by more
+than thresholdW between two polls the interval drops to minSeconds, and while everything is steady it backs off by
+ADAPTIVE_BACKOFF_FACTOR per poll up to maxSeconds.
+'''
+class AdaptiveInterval(object):
+    def __init__(self, minSeconds: float, maxSeconds: float, thresholdW: float=ADAPTIVE_DEFAULT_THRESHOLD_W):
+        self.minSeconds = max(FAST_POLL_MINIMUM_SECONDS, float(minSeconds))
+        self.maxSeconds = max(self.minSeconds, float(maxSeconds))
+        self.thresholdW = max(0.0, float(thresholdW))
+        self.intervalSeconds = self.minSeconds
+
+        self._lastGridPowerW: Optional[float] = None
+        # the previous poll's SPAN_arrays.PanelPowerArrays, for the circuit power changes
+        self._lastPowerArrays = None
+
+    '''
+    Feed one poll's PanelSnapshot in; returns the interval to use until the next poll.
+    '''
+    def observe(self, panelSnapshot) -> float:
+        largestChangeW = None
+        if panelSnapshot.instantGridPowerW is not None:
+            if self._lastGridPowerW is not None:
+                largestChangeW = abs(panelSnapshot.instantGridPowerW - self._lastGridPowerW)
+            self._lastGridPowerW = panelSnapshot.instantGridPowerW
+
+        if len(panelSnapshot.circuits) > 0:
+            powerArrays = panelSnapshot.powerArrays
+            circuitChangeW = powerArrays.largestCircuitChangeW(self._lastPowerArrays)
+            if circuitChangeW is not None and (largestChangeW is None or circuitChangeW > largestChangeW):
+                largestChangeW = circuitChangeW
+            self._lastPowerArrays = powerArrays
+
+        if largestChangeW is None:
+            return self.intervalSeconds
+        if largestChangeW > self.thresholdW:
+            self.intervalSeconds = self.minSeconds
+        else:
+            self.intervalSeconds = min(self.maxSeconds, self.intervalSeconds*ADAPTIVE_BACKOFF_FACTOR)
+        return self.intervalSeconds
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Parsed Panel Snapshot
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import sys
+import time
+import json
+import math
+import re
+import zlib
+
+# Standard Library
+from typing import Optional, Any
+
+from nodes import SPAN_arrays
+
+LOGGER = udi_interface.LOGGER
+
+'''
+Rounding that has always been applied to SPAN wattages before they are published:
+round UP to the hundredth of a Watt.
+'''
+def ceilPower(value: Any) -> float:
+    return math.ceil(float(value)*100)/100
+
+# the values a poll actually publishes; names, tabs and the like only matter when nodes are created
+FINGERPRINT_FIELDS = re.compile(rb'"(?:instantGridPowerW|feedthroughPowerW|instantPowerW|relayState|priority)"\s*:\s*(?:"[^"]*"|[-+0-9.eE]+)')
+
+'''
+Cheap fingerprint of a raw /api/v1/panel or /api/v1/circuits response: a CRC-32 over just the published fields,
+found with a regex instead of a full JSON parse. Equal fingerprints mean there is nothing new to publish.
+'''
+def fingerprintPayload(payload: Any) -> Optional[int]:
+    if payload is None:
+        return None
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+    elif not(isinstance(payload, (bytes, bytearray))):
+        payload = json.dumps(payload).encode("utf-8")
+    return zlib.crc32(b"|".join(FINGERPRINT_FIELDS.findall(payload)))
+
+'''
+Decode a raw SPAN API response (bytes, str, or an already-decoded dict) into a dict.
+'''
+def decodePayload(payload: Any) -> dict:
+    if isinstance(payload, dict):
+        return payload
+    if isinstance(payload, (bytes, bytearray)):
+        payload = payload.decode("utf-8")
+    return json.loads(payload)
+
+'''
+One entry of the 'branches' array from /api/v1/panel (one physical breaker position).
+__slots__ and interned state strings keep the 32 records per panel per poll small.
+'''
+class BranchRecord(object):
+    __slots__ = ('breakerID', 'relayState', 'instantPowerW')
+
+    def __init__(self, breakerID: int, relayState: str, instantPowerW: float):
+        self.breakerID = breakerID
+        self.relayState = relayState
+        self.instantPowerW = instantPowerW
+
+    def __repr__(self):
+        return "BranchRecord(" + str(self.breakerID) + ", " + self.relayState + ", " + str(self.instantPowerW) + ")"
+
+'''
+One entry of the 'circuits' object from /api/v1/circuits (one SPAN circuit).
+'''
+class CircuitRecord(object):
+    __slots__ = ('circuitID', 'name', 'relayState', 'priority', 'instantPowerW', 'tabs')
+
+    def __init__(self, circuitID: str, name: str, relayState: str, priority: str, instantPowerW: float, tabs: list):
+        self.circuitID = circuitID
+        self.name = name
+        self.relayState = relayState
+        self.priority = priority
+        self.instantPowerW = instantPowerW
+        self.tabs = tabs
+
+    def __repr__(self):
+        return "CircuitRecord(" + self.circuitID + ", " + self.name + ", " + self.relayState + ", " + self.priority + ", " + str(self.instantPowerW) + ", " + str(self.tabs) + ")"
+
+'''
+Build the CircuitRecord for one entry of the 'circuits' object ('key' is its key in that object).
+'''
+def circuitRecordFrom(key: str, circuit: dict) -> CircuitRecord:
+    circuitID = str(circuit.get('id', key))
+    tabs = [int(tab) for tab in circuit.get('tabs', [])]
+    return CircuitRecord(circuitID, str(circuit.get('name', circuitID)), sys.intern(str(circuit.get('relayState', 'UNKNOWN'))), sys.intern(str(circuit.get('priority', 'UNKNOWN'))), float(circuit['instantPowerW']), tabs)
+
+'''
+The record of just one circuit from a /api/v1/circuits response (e.g. re-read after a command), without building
+records for every other circuit; None if the circuit is not in it or the payload cannot be decoded.
+'''
+def decodeCircuitRecord(circuitsData: Any, circuitID: str) -> Optional[CircuitRecord]:
+    try:
+        circuits = decodePayload(circuitsData)['circuits']
+        circuit = circuits.get(circuitID)
+        if circuit is not None:
+            return circuitRecordFrom(circuitID, circuit)
+        for key, circuit in circuits.items():
+            if str(circuit.get('id', key)) == circuitID:
+                return circuitRecordFrom(key, circuit)
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        LOGGER.warning("\n\tSNAPSHOT unable to decode the record of circuit " + circuitID + ": {}\n".format(e))
+    return None
+
+'''
+Depth-first search of a decoded payload for the first value stored under 'key'.
+The /api/v1/status sections have moved around between firmware versions, so we don't hard-code the nesting.
+'''
+def findKey(data: Any, key: str) -> Any:
+    if isinstance(data, dict):
+        if key in data:
+            return data[key]
+        children = data.values()
+    elif isinstance(data, list):
+        children = data
+    else:
+        return None
+    for child in children:
+        found = findKey(child, key)
+        if found is not None:
+            return found
+    return None
+
+'''
+The parts of /api/v1/status that the panel controllers publish.
+'''
+class StatusRecord(object):
+    __slots__ = ('doorStatus', 'unlockButtonPressesRemaining', 'serial', 'firmwareVersion', 'uptimeSeconds')
+
+    def __init__(self, doorStatus: int=0, unlockButtonPressesRemaining: int=-1, serial: str='Unknown', firmwareVersion: str='Unknown', uptimeSeconds: Optional[int]=None):
+        # 0 = Unknown, 1 = Closed, 2 = Open (see IX_SPAN_DOORSTATUS)
+        self.doorStatus = doorStatus
+        # -1 = Unknown, otherwise 1-3 (see IX_SPAN_AUTHUNLOCK_BUTTONPRESSES_REMAINING)
+        self.unlockButtonPressesRemaining = unlockButtonPressesRemaining
+        self.serial = serial
+        self.firmwareVersion = firmwareVersion
+        self.uptimeSeconds = uptimeSeconds
+
+    @property
+    def uptimeString(self) -> str:
+        if self.uptimeSeconds is None:
+            return 'Unknown'
+        (days, remainder) = divmod(self.uptimeSeconds, 86400)
+        (hours, remainder) = divmod(remainder, 3600)
+        (minutes, seconds) = divmod(remainder, 60)
+        return str(days) + " Days, " + str(hours) + " Hours, " + str(minutes) + " Minutes, " + str(seconds) + " Seconds"
+
+    def __repr__(self):
+        return "StatusRecord(door=" + str(self.doorStatus) + ", unlockPresses=" + str(self.unlockButtonPressesRemaining) + ", serial=" + self.serial + ", firmware=" + self.firmwareVersion + ", uptime=" + str(self.uptimeSeconds) + ")"
+
+'''
+Typed, indexed view of one poll of a SPAN panel.
+Each payload is decoded exactly once and the raw payload is not kept; child nodes are then handed only their own record,
+looked up by breaker ID (branches) or circuit ID (circuits).
+A snapshot is built completely before the Breakers controller swaps it in (one assignment), and the same object is then
+shared with the sister Circuits controller; its records are not changed afterwards, only the stale flags.
+'''
+class PanelSnapshot(object):
+    __slots__ = ('timestamp', 'stale', 'circuitsStale', 'instantGridPowerW', 'feedthroughPowerW', 'branches', 'circuits', 'status', '_powerArrays')
+
+    def __init__(self, panelData: Any=None, circuitsData: Any=None, statusData: Any=None, timestamp: Optional[float]=None):
+        self.timestamp = time.time() if timestamp is None else timestamp
+        # True once a later poll failed and this (last good) snapshot is being shown in its place
+        self.stale: bool = False
+        # True when the circuits part is an earlier poll's payload, because /api/v1/circuits did not answer in time
+        self.circuitsStale: bool = False
+
+        self.instantGridPowerW: Optional[float] = None
+        self.feedthroughPowerW: Optional[float] = None
+
+        # breaker ID (1-32) -> BranchRecord
+        self.branches: dict = {}
+        # circuit ID -> CircuitRecord, in the order the panel reports them
+        self.circuits: dict = {}
+        self.status: Optional[StatusRecord] = None
+        self._powerArrays: Optional[SPAN_arrays.PanelPowerArrays] = None
+
+        if panelData is not None:
+            self.loadPanelData(panelData)
+        if circuitsData is not None:
+            self.loadCircuitsData(circuitsData)
+        if statusData is not None:
+            self.loadStatusData(statusData)
+
+    '''
+    Decode /api/v1/panel.
+    '''
+    def loadPanelData(self, panelData: Any):
+        try:
+            data = decodePayload(panelData)
+            branches = {}
+            for branch in data['branches']:
+                breakerID = int(branch['id'])
+                branches[breakerID] = BranchRecord(breakerID, sys.intern(str(branch.get('relayState', 'UNKNOWN'))), float(branch['instantPowerW']))
+            self.instantGridPowerW = float(data['instantGridPowerW'])
+            self.feedthroughPowerW = float(data['feedthroughPowerW'])
+            self.branches = branches
+        except (ValueError, TypeError, KeyError) as e:
+            LOGGER.warning("\n\tSNAPSHOT unable to decode Panel Data: {}\n".format(e))
+
+    '''
+    Decode /api/v1/circuits.
+    '''
+    def loadCircuitsData(self, circuitsData: Any):
+        try:
+            data = decodePayload(circuitsData)
+            circuits = {}
+            for circuitID, circuit in data['circuits'].items():
+                record = circuitRecordFrom(circuitID, circuit)
+                circuits[record.circuitID] = record
+            self.circuits = circuits
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            LOGGER.warning("\n\tSNAPSHOT unable to decode Circuits Data: {}\n".format(e))
+
+    '''
+    Decode /api/v1/status.
+    '''
+    def loadStatusData(self, statusData: Any):
+        try:
+            data = decodePayload(statusData)
+            status = StatusRecord()
+
+            doorState = findKey(data, 'doorState')
+            if doorState is not None:
+                if "CLOSED" in str(doorState):
+                    status.doorStatus = 1
+                elif "OPEN" in str(doorState):
+                    status.doorStatus = 2
+
+            authRemaining = findKey(data, 'remainingAuthUnlockButtonPresses')
+            if authRemaining is not None and int(authRemaining) in (1, 2, 3):
+                status.unlockButtonPressesRemaining = int(authRemaining)
+
+            serial = findKey(data, 'serial')
+            if serial is not None:
+                status.serial = str(serial)
+
+            firmwareVersion = findKey(data, 'firmwareVersion')
+            if firmwareVersion is not None:
+                status.firmwareVersion = str(firmwareVersion)
+
+            uptime = findKey(data, 'uptime')
+            if uptime is not None:
+                status.uptimeSeconds = int(uptime)
+
+            self.status = status
+        except (ValueError, TypeError) as e:
+            LOGGER.warning("\n\tSNAPSHOT unable to decode Status Data: {}\n".format(e))
+
+    @property
+    def hasPanelData(self) -> bool:
+        return self.instantGridPowerW is not None and len(self.branches) > 0
+
+    @property
+    def hasCircuitsData(self) -> bool:
+        return len(self.circuits) > 0
+
+    '''
+    The branch and circuit powers as SPAN_arrays.PanelPowerArrays, built once (on first use) per snapshot.
+    '''
+    @property
+    def powerArrays(self) -> SPAN_arrays.PanelPowerArrays:
+        if self._powerArrays is None:
+            self._powerArrays = SPAN_arrays.PanelPowerArrays(self)
+        return self._powerArrays
+
+    @property
+    def ageSeconds(self) -> float:
+        return max(0.0, time.time() - self.timestamp)
+
+    @property
+    def hasStatusData(self) -> bool:
+        return self.status is not None
+
+    '''
+    Total panel power, calculated the same way the controllers always have:
+    instantGridPowerW - feedthroughPowerW (tracks more closely with the SPAN app).
+    '''
+    @property
+    def totalPowerW(self) -> Optional[float]:
+        if self.instantGridPowerW is None or self.feedthroughPowerW is None:
+            return None
+        return round((ceilPower(self.instantGridPowerW)-abs(ceilPower(self.feedthroughPowerW))),2)
+
+    @property
+    def closedBreakerCount(self) -> int:
+        return sum(1 for branch in self.branches.values() if branch.relayState == 'CLOSED')
+
+    @property
+    def openBreakerCount(self) -> int:
+        return sum(1 for branch in self.branches.values() if branch.relayState == 'OPEN')
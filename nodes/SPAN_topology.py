@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Polyglot v3 NodeServer SPAN Smart Panels - Persisted Panel Topology
+Copyright (C) 2023 Matt Burke
+
+MIT License
+"""
+import udi_interface
+import threading
+import json
+import os
+import re
+
+# Standard Library
+from typing import Optional, Any
+
+LOGGER = udi_interface.LOGGER
+
+# relative to the NodeServer's working directory
+TOPOLOGY_CACHE_DIRECTORY = 'topology'
+TOPOLOGY_CACHE_VERSION = 1
+
+'''
+Write 'data' as JSON so that a crash leaves either the old file or the new one, never a partial one:
+temporary file, fsync, then rename over the original.
+'''
+def writeJsonAtomically(path: str, data: Any, indent: Optional[int]=1):
+    directory = os.path.dirname(path)
+    if len(directory) > 0:
+        os.makedirs(directory, exist_ok=True)
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'w', encoding='utf-8') as jsonFile:
+        json.dump(data, jsonFile, indent=indent)
+        jsonFile.flush()
+        os.fsync(jsonFile.fileno())
+    os.replace(temporaryPath, path)
+
+'''
+One circuit as far as the node tree is concerned (no readings); has the circuitID / name of a SPAN_snapshot.CircuitRecord.
+'''
+class TopologyCircuit(object):
+    def __init__(self, circuitID: str, name: str, tabs: list):
+        self.circuitID = circuitID
+        self.name = name
+        self.tabs = tabs
+
+    def toDict(self) -> dict:
+        return {'id': self.circuitID, 'name': self.name, 'tabs': self.tabs}
+
+    def __repr__(self):
+        return "TopologyCircuit(" + self.circuitID + ", " + self.name + ", " + str(self.tabs) + ")"
+
+'''
+What a panel looks like, as needed to build its node tree: circuits (ID, name, tabs, in panel order), breaker count and serial.
+'''
+class PanelTopology(object):
+    def __init__(self, circuits: Optional[list]=None, breakerCount: int=0, serial: str='Unknown'):
+        self.circuits: list = circuits if circuits is not None else []
+        self.breakerCount = breakerCount
+        self.serial = serial
+
+    '''
+    The topology of a live PanelSnapshot; the serial is only in /api/v1/status, so it is carried over from 'previous' when the snapshot has none.
+    '''
+    @classmethod
+    def fromSnapshot(cls, panelSnapshot, previous: Optional['PanelTopology']=None) -> 'PanelTopology':
+        circuits = [TopologyCircuit(record.circuitID, record.name, list(record.tabs)) for record in panelSnapshot.circuits.values()]
+        serial = 'Unknown'
+        if panelSnapshot.status is not None:
+            serial = panelSnapshot.status.serial
+        elif previous is not None:
+            serial = previous.serial
+        return cls(circuits, len(panelSnapshot.branches), serial)
+
+    @classmethod
+    def fromDict(cls, data: dict) -> 'PanelTopology':
+        circuits = [TopologyCircuit(str(circuit['id']), str(circuit['name']), [int(tab) for tab in circuit.get('tabs', [])]) for circuit in data['circuits']]
+        return cls(circuits, int(data.get('breakerCount', 0)), str(data.get('serial', 'Unknown')))
+
+    def toDict(self) -> dict:
+        return {
+            'version': TOPOLOGY_CACHE_VERSION,
+            'serial': self.serial,
+            'breakerCount': self.breakerCount,
+            'circuits': [circuit.toDict() for circuit in self.circuits]
+        }
+
+    def __eq__(self, other):
+        return isinstance(other, PanelTopology) and self.toDict() == other.toDict()
+
+'''
+The on-disk copy of one panel's topology (TOPOLOGY_CACHE_DIRECTORY/<ip address>.json).
+Written atomically (temporary file, fsync, rename) and only when the topology actually changed.
+'''
+class TopologyCache(object):
+    def __init__(self, ipAddress: str, directory: str=TOPOLOGY_CACHE_DIRECTORY):
+        self.ipAddress = ipAddress
+        self.path = os.path.join(directory, re.sub(r'[^0-9A-Za-z_.-]', '_', ipAddress) + '.json')
+        self._lock = threading.Lock()
+        self.topology: Optional[PanelTopology] = None
+        self.writeCount = 0
+
+    '''
+    Read the saved topology; None if there is none (or it is unreadable).
+    '''
+    def load(self) -> Optional[PanelTopology]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as cacheFile:
+                data = json.load(cacheFile)
+            if data.get('version') != TOPOLOGY_CACHE_VERSION:
+                return None
+            topology = PanelTopology.fromDict(data)
+        except FileNotFoundError:
+            return None
+        except:
+            LOGGER.warning("\n\tTOPOLOGY CACHE for " + self.ipAddress + " at '" + self.path + "' could not be read; ignoring it.\n")
+            return None
+        with self._lock:
+            self.topology = topology
+        return topology
+
+    '''
+    Remember the topology of a live snapshot (one that has circuits data), writing it out if it changed.
+    Returns True if it changed.
+    '''
+    def update(self, panelSnapshot) -> bool:
+        with self._lock:
+            topology = PanelTopology.fromSnapshot(panelSnapshot, self.topology)
+            if topology == self.topology:
+                return False
+            self.topology = topology
+            try:
+                self._write(topology)
+                self.writeCount += 1
+            except:
+                LOGGER.warning("\n\tTOPOLOGY CACHE for " + self.ipAddress + " could not be written to '" + self.path + "'.\n")
+            return True
+
+    def _write(self, topology: PanelTopology):
+        writeJsonAtomically(self.path, topology.toDict())
+
+_topologyCaches: dict = {}
+_topologyCachesLock = threading.Lock()
+
+'''
+Return the shared TopologyCache for a panel (both of its controllers use the same one).
+'''
+def getTopologyCache(ipAddress: str) -> TopologyCache:
+    with _topologyCachesLock:
+        cache = _topologyCaches.get(ipAddress)
+        if cache is None:
+            cache = TopologyCache(ipAddress)
+            _topologyCaches[ipAddress] = cache
+        return cache